@@ -0,0 +1,236 @@
+# This script benchmarks the stages of the ROP compiler against the example binaries: finding gadgets in a file (per
+# architecture and file parser), classifying instruction windows, loading a saved gadget file, and compiling a ROP chain for
+# each of the example goals.  The results are written as JSON, so they can be saved and compared against later runs to catch
+# performance regressions.
+import archinfo
+import logging, time, json, os, sys, resource, multiprocessing, collections, platform, traceback
+import rop_compiler.factories as factories, rop_compiler.classifier as cl, rop_compiler.file_finder as file_finder
+import rop_compiler.memory_finder as memory_finder, rop_compiler.multifile_handler as multifile_handler
+import rop_compiler.goal as goal, rop_compiler.scheduler as scheduler, rop_compiler.stats as stats
+
+import argparse
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "example")
+
+"""An address in the stack of the example binaries, used as the target of the shellcode goals"""
+SHELLCODE_ADDRESS = "0x7fffffffe000"
+
+"""The number of instruction windows to classify in the classifier benchmarks"""
+CLASSIFIER_WINDOWS = 2000
+
+# name -> (filename, arch, endness)
+FIND_BENCHMARKS = collections.OrderedDict([
+  ("bof",       ("bof",           "AMD64",  "Iend_LE")),
+  ("arm_bof",   ("arm_bof",       "ARMEL",  "Iend_LE")),
+  ("mips_bof",  ("mips_bof",      "MIPS32", "Iend_BE")),
+  ("ppc_bof",   ("ppc_bof",       "PPC32",  "Iend_BE")),
+  ("libc",      ("libc.so",       "X86",    "Iend_LE")),
+  ("arm_libc",  ("arm_libc.so.6", "ARMEL",  "Iend_LE")),
+])
+
+# The large libraries take minutes to scan, so they're only run when asked for
+LARGE_BENCHMARKS = ["libc", "arm_libc"]
+
+# name -> (gadget filename, arch)
+LOAD_BENCHMARKS = collections.OrderedDict([
+  ("rsync",       ("rsync.gadgets",                          "AMD64")),
+  ("nginx",       ("bkp/andrew/nginx.gadgets",               "AMD64")),
+  ("complexcalc", ("bkp/complexcalc/complexcalc.gadgets",    "AMD64")),
+])
+
+# name -> (filename, arch, endness, goals)
+COMPILE_BENCHMARKS = collections.OrderedDict([
+  ("bof",           ("bof",           "AMD64",  "Iend_LE", [["shellcode", SHELLCODE_ADDRESS]])),
+  ("bof_execve",    ("bof_execve",    "AMD64",  "Iend_LE", [["function", "dup2", 4, 0], ["function", "dup2", 4, 1],
+                                                            ["function", "dup2", 4, 2], ["execve", "/bin/sh"]])),
+  ("bof_many_args", ("bof_many_args", "AMD64",  "Iend_LE", [["function", "callme", 11, 12, 13, 14, 15, 16, 17, 18]])),
+  ("arm_bof",       ("arm_bof",       "ARMEL",  "Iend_LE", [["shellcode", "0xbefff000"]])),
+  ("mips_bof",      ("mips_bof",      "MIPS32", "Iend_BE", [["shellcode", "0x7fff6000"]])),
+  ("ppc_bof",       ("ppc_bof",       "PPC32",  "Iend_BE", [["shellcode", "0xbffff000"]])),
+])
+
+# The metrics that are compared against the baseline, and whether a larger value is better
+COMPARED_METRICS = [("wall_time", False), ("peak_rss_kb", False), ("gadgets_per_second", True)]
+
+def example_path(filename):
+  return os.path.join(EXAMPLE_DIR, filename)
+
+def peak_rss():
+  """Returns the peak resident set size of this process in kilobytes"""
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak / 1024 if sys.platform == "darwin" else peak # OS X reports bytes, while Linux reports kilobytes
+
+class Timer(object):
+  """This class records the time taken by each of the named stages of a benchmark"""
+
+  def __init__(self):
+    self.stages = collections.OrderedDict()
+    self.start = time.time()
+
+  def stage(self, name):
+    now = time.time()
+    self.stages[name] = now - self.start
+    self.start = now
+
+  def total(self):
+    return sum(self.stages.values())
+
+def bench_find(filename, arch, parser_type, level):
+  timer = Timer()
+  finder = memory_finder.MemoryFinder(example_path(filename), arch, 0, level, parser_type)
+  timer.stage("parse")
+  num_gadgets = 0
+  for gadget in finder.iter_gadgets():
+    num_gadgets += 1
+  timer.stage("find_gadgets")
+  return timer, {"gadgets" : num_gadgets}
+
+def bench_classifier(filename, arch, parser_type, level):
+  timer = Timer()
+  finder = memory_finder.MemoryFinder(example_path(filename), arch, 0, level, parser_type)
+  (segment_number, data, seg_address, start, end) = finder.get_segment_regions()[0]
+  windows = [(data[i:i + finder.MAX_GADGET_SIZE[arch.name]].tobytes(), seg_address + i)
+    for i in range(start, end, arch.instruction_alignment)][:CLASSIFIER_WINDOWS]
+  timer.stage("parse")
+
+  classifier = cl.GadgetClassifier(arch, log_level = level)
+  num_gadgets = 0
+  for code, address in windows:
+    num_gadgets += len(classifier.create_gadgets_from_instructions(code, address))
+  timer.stage("classify")
+  return timer, {"windows" : len(windows), "windows_per_second" : len(windows) / max(timer.stages["classify"], 1e-9),
+    "gadgets" : num_gadgets}
+
+def bench_load(filename, arch, level):
+  timer = Timer()
+  finder = file_finder.FileFinder(example_path(filename), arch, 0, level)
+  gadget_list = finder.find_gadgets()
+  timer.stage("load")
+  return timer, {"gadgets" : len([x for x in gadget_list.foreach()])}
+
+def bench_compile(filename, arch, goals, parser_type, level):
+  timer = Timer()
+  file_handler = multifile_handler.MultifileHandler([(example_path(filename), None, 0)], [], arch, level, parser_type)
+  goal_resolver = goal.GoalResolver(file_handler, goals, level)
+  timer.stage("resolve_goals")
+  gadgets = file_handler.find_gadgets()
+  timer.stage("find_gadgets")
+  gadget_scheduler = scheduler.Scheduler(gadgets, goal_resolver, file_handler, arch, level)
+  chain = gadget_scheduler.get_chain()
+  timer.stage("schedule")
+  return timer, {"gadgets" : len([x for x in gadgets.foreach()]), "chain_length" : len(chain) if chain != None else None}
+
+def run_in_child(func, func_args, conn):
+  """Runs a single benchmark in a fresh process, so that the peak RSS is only for that benchmark"""
+  try:
+    timer, result = func(*func_args)
+    if stats.enabled: # The children inherit the setting from the parent process
+      result["stats"] = stats.get_stats()
+    result["wall_time"] = timer.total()
+    result["stages"] = timer.stages
+    result["peak_rss_kb"] = peak_rss()
+    if "gadgets" in result and "find_gadgets" in timer.stages:
+      result["gadgets_per_second"] = result["gadgets"] / max(timer.stages["find_gadgets"], 1e-9)
+  except Exception as e:
+    result = {"error" : "{}: {}".format(e.__class__.__name__, e), "traceback" : traceback.format_exc()}
+  conn.send(result)
+  conn.close()
+
+def run_benchmark(func, func_args, repeat):
+  """Runs a benchmark repeat times and keeps the fastest run"""
+  best = None
+  for i in range(repeat):
+    parent_conn, child_conn = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target = run_in_child, args = (func, func_args, child_conn))
+    process.start()
+    result = parent_conn.recv()
+    process.join()
+    if "error" in result:
+      return result
+    if best == None or result["wall_time"] < best["wall_time"]:
+      best = result
+  return best
+
+def get_benchmarks(parser_types, include_large, level):
+  """Returns an ordered dictionary of benchmark name -> (function, arguments)"""
+  benchmarks = collections.OrderedDict()
+  for name, (filename, arch_name, endness) in FIND_BENCHMARKS.items():
+    if name in LARGE_BENCHMARKS and not include_large:
+      continue
+    arch = archinfo.arch_from_id(arch_name, endness)
+    for parser_type in parser_types:
+      benchmarks["find/{}/{}".format(name, parser_type)] = (bench_find, (filename, arch, parser_type, level))
+      benchmarks["classify/{}/{}".format(name, parser_type)] = (bench_classifier, (filename, arch, parser_type, level))
+  for name, (filename, arch_name) in LOAD_BENCHMARKS.items():
+    benchmarks["load/{}".format(name)] = (bench_load, (filename, archinfo.arch_from_id(arch_name), level))
+  for name, (filename, arch_name, endness, goals) in COMPILE_BENCHMARKS.items():
+    arch = archinfo.arch_from_id(arch_name, endness)
+    for parser_type in parser_types:
+      benchmarks["compile/{}/{}".format(name, parser_type)] = (bench_compile, (filename, arch, goals, parser_type, level))
+  return benchmarks
+
+def compare(results, baseline, threshold):
+  """Compares the results against a baseline and returns a list of descriptions of the metrics that regressed by more than
+    the threshold (as a fraction of the baseline value)"""
+  regressions = []
+  for name, result in results["benchmarks"].items():
+    base = baseline["benchmarks"].get(name)
+    if base == None or "error" in base or "error" in result:
+      continue
+    metrics = [(metric, result.get(metric), base.get(metric), larger_is_better) for (metric, larger_is_better) in COMPARED_METRICS]
+    metrics += [("stages/" + stage, result["stages"].get(stage), value, False) for stage, value in base["stages"].items()]
+    for metric, new, old, larger_is_better in metrics:
+      if new == None or old == None or old == 0:
+        continue
+      change = (new - old) / float(old)
+      if (larger_is_better and change < -threshold) or (not larger_is_better and change > threshold):
+        regressions.append("{} {}: {:.4g} -> {:.4g} ({:+.1f}%)".format(name, metric, old, new, change * 100))
+  return regressions
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark the ROP compiler against the example binaries")
+  parser.add_argument('-baseline', type=str, default=None, help='A previously saved results file to compare against')
+  parser.add_argument('-filter', type=str, default=None, help='Only run the benchmarks whose name contains this string')
+  parser.add_argument('-large', required=False, action='store_true', help='Include the (slow) library benchmarks')
+  parser.add_argument('-list', required=False, action='store_true', help='List the benchmarks without running them')
+  parser.add_argument('-o', type=str, default=None, help='File to write the results to')
+  parser.add_argument('-parser_types', type=str, default="cle", help='A comma separated list of the file parsers to benchmark')
+  parser.add_argument('-repeat', type=int, default=1, help='The number of times to run each benchmark (the fastest run is kept)')
+  parser.add_argument('-stats', required=False, action='store_true', help='Include the pipeline counters and timings in the results')
+  parser.add_argument('-threshold', type=float, default=0.1, help='The fractional slowdown that counts as a regression')
+  parser.add_argument('-v', required=False, action='store_true', help='Verbose mode')
+  args = parser.parse_args()
+
+  logging_level = logging.DEBUG if args.v else logging.WARNING
+  if args.stats:
+    stats.enable()
+  benchmarks = get_benchmarks(args.parser_types.split(","), args.large, logging_level)
+  if args.filter != None:
+    benchmarks = collections.OrderedDict([(k, v) for k, v in benchmarks.items() if args.filter in k])
+  if args.list:
+    print "\n".join(benchmarks.keys())
+    sys.exit(0)
+
+  results = {"metadata" : {"time" : time.time(), "python" : platform.python_version(), "platform" : platform.platform()},
+    "benchmarks" : collections.OrderedDict()}
+  for name, (func, func_args) in benchmarks.items():
+    result = run_benchmark(func, func_args, args.repeat)
+    results["benchmarks"][name] = result
+    if "error" in result:
+      sys.stderr.write("{} failed: {}\n".format(name, result["error"]))
+    else:
+      sys.stderr.write("{}: {:.3f}s\n".format(name, result["wall_time"]))
+
+  output = json.dumps(results, indent = 2)
+  if args.o == None:
+    print output
+  else:
+    with open(args.o, "w") as f:
+      f.write(output)
+
+  if args.baseline != None:
+    with open(args.baseline) as f:
+      regressions = compare(results, json.load(f), args.threshold)
+    for regression in regressions:
+      sys.stderr.write("REGRESSION: {}\n".format(regression))
+    sys.exit(1 if len(regressions) > 0 else 0)
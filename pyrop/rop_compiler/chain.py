@@ -0,0 +1,131 @@
+# This file contains the intermediate representation of a ROP chain.  Rather than building the chain by concatenating strings
+# (which copies the whole chain every time a piece is added), the pieces are recorded as a list of slots, and the chain is
+# only turned into a string once, at the end.
+import struct
+import utils
+
+ADDRESS = "address" # The address of a gadget (or function) to return to
+VALUE   = "value"   # A word that will be loaded into a register
+PADDING = "padding" # Filler bytes that the gadget skips over
+DATA    = "data"    # Raw bytes, e.g. a packed value or part of a chain that was built as a string
+
+"""The struct for a word on each (bits, endness)"""
+WORD_STRUCTS = {}
+
+def get_word_struct(arch):
+  key = (arch.bits, arch.memory_endness)
+  if key not in WORD_STRUCTS:
+    WORD_STRUCTS[key] = struct.Struct({'Iend_BE' : '>', 'Iend_LE' : '<'}[arch.memory_endness] + {32 : "I", 64 : "Q"}[arch.bits])
+  return WORD_STRUCTS[key]
+
+class Chain(object):
+  """This class holds a ROP chain as an ordered list of (kind, value, annotation) slots.  Words are stored as integers, and
+    padding as a (size, fill character) tuple, so nothing is packed until to_string is called.  Since chains are mostly
+    built from the last gadget to the first, slots can be added to either end of the chain cheaply."""
+
+  def __init__(self, arch):
+    self.arch = arch
+    self.word_size = arch.bits / 8
+    self.mask = utils.get_mask(arch.bits)
+    self.front = [] # The slots before the back slots, in reverse order
+    self.back = []
+    self.size = 0
+
+  def __len__(self):
+    return self.size
+
+  def __str__(self):
+    return self.to_string()
+
+  def slot_size(self, slot):
+    (kind, value, annotation) = slot
+    if kind == PADDING:
+      return value[0]
+    elif kind == DATA:
+      return len(value)
+    return self.word_size
+
+  def add_slot(self, slot):
+    self.back.append(slot)
+    self.size += self.slot_size(slot)
+
+  def add_address(self, address, annotation = None):
+    self.add_word(ADDRESS, address, annotation)
+
+  def add_value(self, value, annotation = None):
+    self.add_word(VALUE, value, annotation)
+
+  def add_word(self, kind, value, annotation = None):
+    if type(value) == str: # Already packed
+      self.add_slot((DATA, value, annotation))
+    else:
+      self.add_slot((kind, value & self.mask, annotation)) # Negative values are packed as two's complement
+
+  def add_padding(self, size, fill = "Z", annotation = None):
+    if size > 0:
+      self.add_slot((PADDING, (size, fill), annotation))
+
+  def pad_to(self, start, offset, fill = "Z", annotation = None):
+    """Pads the chain until it's offset bytes past the start (a previous length of the chain)"""
+    self.add_padding(start + offset - self.size, fill, annotation)
+
+  def add_bytes(self, data, annotation = None):
+    if len(data) != 0:
+      self.add_slot((DATA, data, annotation))
+
+  def slots(self):
+    return self.front[::-1] + self.back
+
+  def extend(self, other):
+    """Adds another chain (or a string) to the end of this one"""
+    if type(other) == str:
+      self.add_bytes(other)
+    else:
+      self.back.extend(other.slots())
+      self.size += other.size
+    return self
+
+  def prepend(self, other):
+    """Adds another chain (or a string) to the start of this one"""
+    if type(other) == str:
+      if len(other) != 0:
+        self.front.append((DATA, other, None))
+        self.size += len(other)
+    else:
+      self.front.extend(other.slots()[::-1])
+      self.size += other.size
+    return self
+
+  def to_string(self):
+    """Packs the slots into a single string"""
+    word_struct = get_word_struct(self.arch)
+    buf = bytearray(self.size)
+    offset = 0
+    for (kind, value, annotation) in self.slots():
+      if kind == PADDING:
+        (size, fill) = value
+        buf[offset:offset + size] = fill * size
+      elif kind == DATA:
+        size = len(value)
+        buf[offset:offset + size] = value
+      else:
+        size = self.word_size
+        word_struct.pack_into(buf, offset, value)
+      offset += size
+    return str(buf)
+
+  def dump(self):
+    """Returns a human readable listing of the chain, with the offset, kind, and annotation of each slot"""
+    lines = []
+    offset = 0
+    for slot in self.slots():
+      (kind, value, annotation) = slot
+      if kind == PADDING:
+        description = "{} * {!r}".format(value[0], value[1])
+      elif kind == DATA:
+        description = repr(value) if len(value) <= 32 else "{} bytes".format(len(value))
+      else:
+        description = "0x{:x}".format(value)
+      lines.append("0x{:04x}: {:<8} {}{}".format(offset, kind, description, "  # " + str(annotation) if annotation != None else ""))
+      offset += self.slot_size(slot)
+    return "\n".join(lines)
@@ -1,8 +1,8 @@
-import collections, logging, random, sys
+import collections, logging, random, sys, hashlib, struct
 import pyvex, archinfo
 
 from gadget import *
-import utils, extra_archinfo, validator
+import utils, extra_archinfo, stats
 
 class GadgetClassifier(object):
   """This class is used to convert a set of instructions that represent a gadget into a Gadget class of the appropriate type"""
@@ -10,10 +10,19 @@ class GadgetClassifier(object):
   """The number of times to emulate a gadget when classifying it"""
   NUM_EMULATIONS = 5
 
-  def __init__(self, arch, validate_gadgets = False, log_level = logging.WARNING):
-    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+  """The seed used to derive the random values for emulation when one isn't given"""
+  DEFAULT_SEED = 0
+
+  def __init__(self, arch, validate_gadgets = False, log_level = logging.WARNING, seed = None):
+    """The seed can be a number, or a random.Random object to draw one from.  Each window's emulation values are derived from
+      the seed, the window's address, and its bytes, so classifying a window always gives the same gadgets, no matter what
+      order the windows are classified in."""
+    utils.configure_logging()
     self.arch = arch
     self.validate_gadgets = validate_gadgets
+    if isinstance(seed, random.Random):
+      seed = seed.getrandbits(64)
+    self.seed = seed if seed != None else self.DEFAULT_SEED
     self.logger = logging.getLogger(self.__class__.__name__)
     self.logger.setLevel(log_level)
 
@@ -32,15 +41,27 @@ class GadgetClassifier(object):
         return False
     return True
 
+  def get_window_rng(self, code, address):
+    """Returns the random number generator to use when emulating the code at the given address"""
+    digest = hashlib.sha1("{}:{}:".format(self.seed, address) + code).digest()
+    return random.Random(struct.unpack("<Q", digest[:8])[0])
+
   def get_irsbs(self, code, address):
+    if isinstance(code, memoryview): # pyvex needs a string to lift from
+      code = code.tobytes()
+
     irsbs = []
     code_address = address
     while code_address <= address + len(code) - self.arch.instruction_alignment:
+      start = stats.start_timer()
       try:
         irsb = pyvex.IRSB(code[code_address-address:], code_address, self.arch)
         irsbs.append(irsb)
       except: # If decoding fails, we can't use this gadget
+        stats.stop_timer("classifier.lift", start)
+        stats.increment("classifier.lift_failures")
         return [] # So just return an empty list
+      stats.stop_timer("classifier.lift", start)
 
       if (self.arch.name not in extra_archinfo.ENDS_EARLY_ARCHS
         or irsb.jumpkind != 'Ijk_Boring'
@@ -88,16 +109,23 @@ class GadgetClassifier(object):
     return clobber
 
   def create_gadgets_from_instructions(self, code, address):
+    stats.increment("classifier.windows")
+    if isinstance(code, memoryview): # This is the only place the window gets copied
+      code = code.tobytes()
     irsbs = self.get_irsbs(code, address)
     if len(irsbs) == 0:
       return []
 
+    state = EvaluateState(self.arch, self.get_window_rng(code, address))
+    evaluator = PyvexEvaluator(state, self.arch)
     possible_types = None
     stack_offsets = set()
     for i in range(self.NUM_EMULATIONS):
-      state = EvaluateState(self.arch)
-      evaluator = PyvexEvaluator(state, self.arch)
-      if not evaluator.emulate_irsbs(irsbs):
+      state.reset()
+      start = stats.start_timer()
+      emulated = evaluator.emulate_irsbs(irsbs)
+      stats.stop_timer("classifier.emulate", start)
+      if not emulated:
         return []
       state = evaluator.get_state()
 
@@ -126,6 +154,7 @@ class GadgetClassifier(object):
     if len(stack_offsets) != 0 or stack_offset == None: # We require a constant non-negative change in the stack size
       return []
 
+    stats.increment("classifier.candidates", len(possible_types))
     gadgets = []
     for (gadget_type, inputs, outputs, params, clobber) in possible_types:
       if (
@@ -156,6 +185,7 @@ class GadgetClassifier(object):
 
       gadget = gadget_type(self.arch, address, inputs, outputs, params, clobber, stack_offset, ip_in_stack_offset)
       if gadget != None and self.validate_gadgets:
+        import validator # z3 is slow to import, so only load it when validating
         gadget_validator = validator.Validator(self.arch)
         if not gadget_validator.validate_gadget(gadget, irsbs):
           gadget = None
@@ -164,6 +194,7 @@ class GadgetClassifier(object):
         self.logger.debug("Found gadget: %s", str(gadget))
         gadgets.append(gadget)
 
+    stats.increment("classifier.gadgets", len(gadgets))
     return gadgets
 
   def all_acceptable_memory_accesses(self, state, possible_type):
@@ -298,16 +329,19 @@ class GadgetClassifier(object):
     return possible_types_with_clobber
 
 class EvaluateState(object):
+  __slots__ = ('arch', 'rng', 'constant', 'in_regs', 'in_mem', 'out_regs', 'out_mem', 'tmps')
+
   def new_random_number(self):
-    num = random.randint(0, 2 ** (self.arch.bits - 2))
+    num = self.rng.randint(0, 2 ** (self.arch.bits - 2))
     num = (num / self.arch.instruction_alignment) * self.arch.instruction_alignment
     return num
 
   def new_constant(self):
     return self.constant
 
-  def __init__(self, arch):
+  def __init__(self, arch, rng = None):
     self.arch = arch
+    self.rng = rng if rng != None else random
     self.in_regs = collections.defaultdict(self.new_random_number, {})
     self.in_mem  = collections.defaultdict(self.new_random_number, {})
 
@@ -315,6 +349,15 @@ class EvaluateState(object):
     self.out_mem = {}
     self.reset_tmps()
 
+  def reset(self):
+    """Clears the state so it can be reused for another emulation, with new random input values"""
+    for values in [self.in_regs, self.in_mem]:
+      values.clear()
+      values.default_factory = self.new_random_number
+    self.out_regs.clear()
+    self.out_mem.clear()
+    self.tmps.clear()
+
   def reset_tmps(self):
     self.tmps = {}
 
@@ -1,35 +1,140 @@
 import logging, collections, os
-import file_parser
-import cle
+import cPickle as pickle
+import file_parser, utils
+
+cle = utils.LazyModule("cle")
+
+"""The directory to save the metadata of parsed files in, so later runs don't need to load them with cle, or None to not save it"""
+CACHE_DIR = os.environ.get("PYROP_CACHE_DIR")
+
+"""The version of the saved metadata.  Metadata saved with a different version is ignored"""
+METADATA_VERSION = 1
+
+"""An executable segment.  The data is only saved for segments that aren't completely backed by the file"""
+Segment = collections.namedtuple("Segment", ["offset", "vaddr", "filesize", "memsize", "data"])
+
+"""All of the information the parser needs about a file.  All of the addresses are linked addresses (the ones in the file's
+  headers, like the segments' vaddr), which the parser adds its base address to.  The GOT entries are the exception, which
+  find_symbol_in_got returns as they are."""
+Metadata = collections.namedtuple("Metadata", ["segments", "symbols", "plt", "got", "sections", "data_address"])
 
 class CleParser(file_parser.FileParser):
-  """This class parses an executable file using cle"""
+  """This class parses an executable file using cle.  Only the file itself is loaded (not the shared libraries it depends on),
+    and everything the parser needs is read from the loader once, up front.  If a cache directory is set, that information is
+    saved, keyed by the hash of the file, and later runs parsing the same file don't create a loader at all."""
 
-  def __init__(self, filename, base_address = 0, level = logging.WARNING):
+  """Whether to load the file's shared library dependencies as well.  The parser only ever looks at the file itself."""
+  LOAD_LIBS = False
+
+  def __init__(self, filename, base_address = 0, level = logging.WARNING, cache_dir = None):
     super(CleParser, self).__init__(filename, base_address, level)
-    self.ld = cle.Loader(filename)
+    self.cache_dir = cache_dir if cache_dir != None else CACHE_DIR
+    self.metadata = self.load_metadata()
+    if self.metadata == None:
+      self.metadata = self.read_metadata()
+      self.save_metadata()
+
+  def get_cache_filename(self):
+    return os.path.join(self.cache_dir, utils.hash_file(self.filename) + ".cle")
+
+  def load_metadata(self):
+    """Returns the saved metadata for the file, or None if it hasn't been saved"""
+    if self.cache_dir == None:
+      return None
+    filename = self.get_cache_filename()
+    if not os.path.exists(filename):
+      return None
+    try:
+      (version, metadata) = pickle.loads(open(filename, "rb").read())
+    except Exception as e:
+      self.logger.warning("Ignoring the unreadable metadata cache %s: %s", filename, e)
+      return None
+    if version != METADATA_VERSION:
+      return None
+    self.logger.debug("Loaded the metadata for %s from %s", self.filename, filename)
+    return Metadata(*metadata)
+
+  def save_metadata(self):
+    if self.cache_dir == None:
+      return
+    if not os.path.isdir(self.cache_dir):
+      os.makedirs(self.cache_dir)
+    filename = self.get_cache_filename()
+    temp_filename = "{}.{}".format(filename, os.getpid()) # Write then rename, so other processes never see a partial file
+    fd = open(temp_filename, "wb")
+    fd.write(pickle.dumps((METADATA_VERSION, tuple(self.metadata)), pickle.HIGHEST_PROTOCOL))
+    fd.close()
+    os.rename(temp_filename, filename)
+
+  def read_metadata(self):
+    """Loads the file with cle and reads everything the parser needs from it"""
+    ld = cle.Loader(self.filename, auto_load_libs = self.LOAD_LIBS)
+    main_object = ld.main_object
+    to_linked = main_object.linked_base - main_object.mapped_base # Converts the loader's (rebased) addresses to linked ones
+
+    segments = []
+    for seg in main_object.segments:
+      if seg.is_executable:
+        data = None
+        if seg.filesize < seg.memsize: # The part of the segment that isn't in the file has to be read from the loader
+          data = ''.join(main_object.memory.read_bytes(seg.vaddr, seg.memsize))
+        segments.append(Segment(seg.offset, seg.vaddr, seg.filesize, seg.memsize, data))
+
+    plt = {name : address + to_linked for name, address in main_object.plt.items()}
+    names = (set([symbol.name for symbol in main_object.symbols_by_addr.values() if symbol.name]) | set(main_object.imports)
+      | set(plt))
+    symbols = {}
+    for name in names:
+      symbol = main_object.get_symbol(name)
+      if symbol == None:
+        symbols[name] = plt.get(name)
+      elif symbol.linked_addr == 0: # Imports don't have an address in the file, so use their plt entries
+        symbols[name] = plt.get(name)
+      else:
+        symbols[name] = symbol.linked_addr
+
+    got = {}
+    for name in main_object.imports:
+      relocation = next(ld.find_relevant_relocations(name), None)
+      got[name] = relocation.linked_addr if relocation != None else None
+
+    sections = dict([(name, (section.vaddr, section.memsize)) for name, section in main_object.sections_map.items()])
+    data_address = sections['.data'][0] if '.data' in sections else None
+    return Metadata(segments, symbols, plt, got, sections, data_address)
 
   def iter_executable_segments(self):
     """Any iterator that only returns the executable sections in the ELF file"""
-    for seg in self.ld.main_bin.segments:
-      if seg.is_executable:
-        yield seg
+    return iter(self.metadata.segments)
 
   def get_segment_bytes_address(self, seg):
     """Returns a segments bytes and the address of the segment"""
-    return ''.join(self.ld.main_bin.memory.read_bytes(seg.vaddr, seg.memsize)), seg.vaddr + self.base_address
+    if seg.data == None: # The whole segment is backed by the file, so we can map it rather than copying it
+      return self.get_file_view(seg.offset, seg.memsize), seg.vaddr + self.base_address
+    return seg.data, seg.vaddr + self.base_address
 
   def get_symbol_address(self, name, recurse_with_imp = True):
     """Returns the address for a symbol, or None if the symbol can't be found"""
-    symbol = self.ld.main_bin.get_symbol(name)
-    if symbol != None:
-      if symbol.rebased_addr == 0: # For some symbols, it doesn't look in the plt.  Fix that up here.
-        return self.ld.main_bin._plt[name] + self.base_address
-      return symbol.addr + self.base_address
+    address = self.metadata.symbols.get(name)
+    if address != None:
+      return address + self.base_address
     return None
 
+  def iter_symbols(self):
+    """An iterator over (name, address) tuples for every symbol in the file"""
+    for name, address in self.metadata.symbols.iteritems():
+      if address != None:
+        yield name, address + self.base_address
+
+  def get_section_range(self, name):
+    if name not in self.metadata.sections:
+      return None
+    (address, size) = self.metadata.sections[name]
+    return address + self.base_address, size
+
   def get_writable_memory(self):
-    return self.ld.main_bin.sections_map['.data'].vaddr + self.base_address
+    if self.metadata.data_address == None:
+      return None
+    return self.metadata.data_address + self.base_address
 
   def find_symbol_in_got(self, name):
-    return self.ld.find_symbol_got_entry(name)
+    return self.metadata.got.get(name)
@@ -0,0 +1,149 @@
+# This file contains a GadgetList that answers its queries with numpy rather than by looping over the gadget objects.  The
+# gadgets of each type are also stored as columns (one array per attribute), so a search like "the least complex LoadMem
+# from sp into rax that doesn't clobber rbx" becomes a few vectorized comparisons and an argmin.  The gadget objects are
+# still kept (and returned) as in a normal GadgetList, so the two can be used interchangeably.
+import logging
+import numpy
+import gadget as ga, stats
+
+class GadgetColumns(object):
+  """The attributes of one type of gadget that the queries look at, with one row per gadget (in the same order as the
+    GadgetList's list of that type).  Registers are stored as their offsets (or -1 when a gadget doesn't have one), and the
+    registers each gadget clobbers (its outputs and its clobbered registers) as a bitmask, with one bit per register that's
+    used by this type of gadget."""
+
+  def __init__(self, gadgets):
+    self.register_bits = {} # register -> the bit for it in the clobber masks
+    self.register_tuples = {} # tuple of registers -> id, so a whole tuple can be compared at once
+
+    rows = len(gadgets)
+    self.num_inputs = numpy.zeros(rows, dtype = numpy.int64)
+    self.input0 = numpy.full(rows, -1, dtype = numpy.int64)
+    self.input1 = numpy.full(rows, -1, dtype = numpy.int64)
+    self.inputs_id = numpy.zeros(rows, dtype = numpy.int64)
+    self.output0 = numpy.full(rows, -1, dtype = numpy.int64)
+    self.outputs_id = numpy.zeros(rows, dtype = numpy.int64)
+    self.complexity = numpy.zeros(rows, dtype = numpy.float64)
+
+    clobbered = []
+    for row, gadget in enumerate(gadgets):
+      self.num_inputs[row] = len(gadget.inputs)
+      if len(gadget.inputs) > 0:
+        self.input0[row] = gadget.inputs[0]
+      if len(gadget.inputs) > 1:
+        self.input1[row] = gadget.inputs[1]
+      self.inputs_id[row] = self.tuple_id(gadget.inputs)
+      if len(gadget.outputs) > 0:
+        self.output0[row] = gadget.outputs[0]
+      self.outputs_id[row] = self.tuple_id(gadget.outputs)
+      self.complexity[row] = gadget.complexity()
+      clobbered.append([self.register_bit(reg) for reg in set(gadget.outputs + gadget.clobber)])
+
+    self.clobber_mask = numpy.zeros((rows, (len(self.register_bits) + 63) / 64), dtype = numpy.uint64)
+    for row, bits in enumerate(clobbered):
+      for bit in bits:
+        self.clobber_mask[row, bit / 64] |= numpy.uint64(1 << (bit % 64))
+
+  def __len__(self):
+    return len(self.complexity)
+
+  def tuple_id(self, registers):
+    return self.register_tuples.setdefault(registers, len(self.register_tuples))
+
+  def register_bit(self, reg):
+    return self.register_bits.setdefault(reg, len(self.register_bits))
+
+  def all_rows(self):
+    return numpy.ones(len(self), dtype = bool)
+
+  def registers_mask(self, regs):
+    """Returns the clobber mask for a list of registers.  Registers that no gadget of this type clobbers are left out."""
+    mask = numpy.zeros(self.clobber_mask.shape[1], dtype = numpy.uint64)
+    for reg in regs:
+      if reg in self.register_bits:
+        bit = self.register_bits[reg]
+        mask[bit / 64] |= numpy.uint64(1 << (bit % 64))
+    return mask
+
+  def no_clobbers_rows(self, no_clobbers):
+    """Returns which of the gadgets don't clobber any of the registers"""
+    mask = self.registers_mask(no_clobbers)
+    if not mask.any():
+      return self.all_rows()
+    return ~(self.clobber_mask & mask).any(axis = 1)
+
+  def tuple_rows(self, ids, registers):
+    """Returns which of the gadgets have exactly the given tuple of registers (in the ids column)"""
+    if registers not in self.register_tuples:
+      return numpy.zeros(len(self), dtype = bool)
+    return ids == self.register_tuples[registers]
+
+class ColumnarGadgetList(ga.GadgetList):
+  """A GadgetList that searches through its gadgets with numpy.  The columns for a type of gadget are built the first time
+    that type is searched, and thrown away when a gadget of that type is added."""
+
+  def __init__(self, gadgets = None, log_level = logging.WARNING, strategy = ga.MEDIUM, bad_bytes = None):
+    self.columns = {} # gadget type name -> GadgetColumns
+    super(ColumnarGadgetList, self).__init__(gadgets, log_level, strategy, bad_bytes)
+
+  def add_gadget(self, gadget, merge_aliases = True):
+    super(ColumnarGadgetList, self).add_gadget(gadget, merge_aliases)
+    self.columns.pop(self.gadget_type_name(gadget.__class__), None)
+
+  def merge(self, gadget_lists):
+    super(ColumnarGadgetList, self).merge(gadget_lists)
+    self.columns.clear()
+
+  def get_columns(self, type_name):
+    if type_name not in self.columns:
+      stats.increment("columnar_gadget_list.columns_built")
+      self.columns[type_name] = GadgetColumns(self.gadgets[type_name])
+    return self.columns[type_name]
+
+  def foreach_type(self, gadget_type, no_clobbers = None, input_registers = None):
+    if no_clobbers == None and input_registers == None:
+      return super(ColumnarGadgetList, self).foreach_type(gadget_type)
+    type_name = self.gadget_type_name(gadget_type)
+    columns = self.get_columns(type_name)
+    rows = columns.all_rows()
+    if no_clobbers != None:
+      rows &= columns.no_clobbers_rows(no_clobbers)
+    if input_registers != None:
+      rows &= columns.tuple_rows(columns.inputs_id, tuple(input_registers))
+    gadgets = self.gadgets[type_name]
+    return (gadgets[row] for row in numpy.flatnonzero(rows))
+
+  def foreach_type_output(self, gadget_type, output, no_clobbers = None):
+    if no_clobbers == None:
+      return super(ColumnarGadgetList, self).foreach_type_output(gadget_type, output)
+    type_name = self.gadget_type_name(gadget_type)
+    columns = self.get_columns(type_name)
+    rows = columns.output0 == (output if output != None else -1)
+    rows &= columns.no_clobbers_rows(no_clobbers)
+    gadgets = self.gadgets[type_name]
+    return (gadgets[row] for row in numpy.flatnonzero(rows))
+
+  def find_gadget(self, gadget_type, input_registers = None, output_registers = None, no_clobber = None):
+    """This method will find the best gadget (lowest complexity) given the search criteria"""
+    stats.increment("gadget_list.find_gadget")
+    type_name = self.gadget_type_name(gadget_type)
+    columns = self.get_columns(type_name)
+    stats.increment("gadget_list.gadgets_examined", len(columns))
+
+    rows = columns.all_rows()
+    if input_registers != None: # Match the first input, and the second one too if the gadget has one
+      rows &= columns.input0 == input_registers[0]
+      second = columns.num_inputs == 1
+      if len(input_registers) > 1:
+        second |= columns.input1 == input_registers[1]
+      rows &= second
+    if output_registers != None:
+      rows &= columns.tuple_rows(columns.outputs_id, tuple(output_registers))
+    if no_clobber != None:
+      rows &= columns.no_clobbers_rows(no_clobber)
+
+    if not rows.any():
+      stats.increment("gadget_list.synthesis_attempts")
+      return self.create_new_gadgets(gadget_type, input_registers, output_registers, no_clobber)
+    # argmin returns the first of the equally complex gadgets, the same one the GadgetList's loop would
+    return self.gadgets[type_name][numpy.argmin(numpy.where(rows, columns.complexity, numpy.inf))]
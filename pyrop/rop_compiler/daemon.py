@@ -0,0 +1,277 @@
+# This file contains a long running compile server.  The server keeps the parsed files and their gadgets in memory between
+# requests, so an exploit script can recompile its ROP chains (e.g. after leaking an address) without parsing the files and
+# finding their gadgets again each time.  Each request and response is a single line of JSON, sent over a Unix or TCP socket.
+import logging, json, binascii, time, collections, socket, SocketServer, os
+import ropme, multifile_handler, scheduler, gadget as ga, stats as pipeline_stats, utils
+
+archinfo = utils.LazyModule("archinfo") # Clients only need it when they don't give an arch
+
+"""The names of the gadget search strategies that requests can ask for"""
+STRATEGIES = { "best" : ga.BEST, "first" : ga.FIRST, "medium" : ga.MEDIUM }
+
+def to_str(value):
+  """The json module returns unicode strings, but the rest of the compiler expects str's (e.g. for the bad bytes)"""
+  if isinstance(value, unicode):
+    return value.encode('latin-1')
+  if isinstance(value, list):
+    return [to_str(item) for item in value]
+  if isinstance(value, dict):
+    return {to_str(key) : to_str(item) for key, item in value.items()}
+  return value
+
+def parse_address(address):
+  if isinstance(address, str):
+    return int(address, 16)
+  return address if address != None else 0
+
+class CompileSession(object):
+  """This class holds the parsed files and found gadgets for one set of files.  The gadgets are found without any bad bytes,
+    and filtered for each request's bad bytes, so requests with different bad bytes can share them."""
+
+  def __init__(self, files, libraries, arch, level = logging.WARNING, parser_type = None, validate_gadgets = False,
+      max_gadgets_per_signature = None):
+    self.logger = logging.getLogger(self.__class__.__name__)
+    self.logger.setLevel(level)
+    self.level = level
+
+    self.files = files
+    self.libraries = libraries
+    self.arch = arch
+    self.validate_gadgets = validate_gadgets
+    self.max_gadgets_per_signature = max_gadgets_per_signature
+    self.file_handler = multifile_handler.MultifileHandler(files, libraries, arch, level, parser_type)
+    self.gadgets = None
+    self.search_state = scheduler.SearchState()
+    self.filtered = None # (bad bytes, gadgets without the bad bytes in their address, search state) for the last bad bytes used
+    self.num_requests = 0
+
+  def get_gadgets(self, bad_bytes = None):
+    """Returns the gadget list to use for the bad bytes, and the scheduler search state for that list"""
+    if self.gadgets == None:
+      self.gadgets = self.file_handler.find_gadgets(self.validate_gadgets, max_per_signature = self.max_gadgets_per_signature)
+    if bad_bytes == None or len(bad_bytes) == 0:
+      return self.gadgets, self.search_state
+
+    # Avoiding the bad bytes can switch a gadget to one of its aliases, so only the last filtered list is guaranteed to be valid
+    if self.filtered == None or self.filtered[0] != tuple(bad_bytes):
+      self.filtered = (tuple(bad_bytes), self.filter_gadgets(bad_bytes), scheduler.SearchState())
+    return self.filtered[1:]
+
+  def filter_gadgets(self, bad_bytes):
+    """Returns a gadget list with the gadgets from each file that can avoid the bad bytes.  The merged list only has one file's
+      copy of the gadgets that are in several files (see MultifileHandler.find_gadgets), so each file's gadgets are filtered
+      instead, keeping the first copy of each gadget whose address doesn't have any bad bytes."""
+    gadget_list = ga.GadgetList(log_level = self.level, bad_bytes = bad_bytes)
+    for gadgets in self.file_handler.file_gadgets.values():
+      for gadget in gadgets:
+        if gadget.avoid_bad_bytes(bad_bytes):
+          gadget_list.add_gadget(gadget, False) # Don't add aliases from other files, they'd be rebased with the wrong file
+    return gadget_list
+
+  def rebase(self, base_addresses):
+    """Moves the files to new base addresses, if they've changed"""
+    if base_addresses != self.file_handler.base_addresses:
+      self.file_handler.rebase(base_addresses)
+      self.filtered = None # Which addresses have bad bytes depends on the base addresses
+
+  def compile(self, goal_list, base_addresses = None, bad_bytes = None, strategy = None):
+    """Compiles a ROP chain for the goals, after moving the files to the given base addresses"""
+    self.num_requests += 1
+    if base_addresses != None:
+      self.rebase(base_addresses)
+    gadgets, search_state = self.get_gadgets(bad_bytes)
+    gadgets.set_strategy(strategy if strategy != None else ga.MEDIUM)
+    return ropme.compile_goals(self.files, self.libraries, goal_list, self.arch, self.level, self.validate_gadgets, strategy,
+      bad_bytes, False, False, None, self.max_gadgets_per_signature, self.file_handler, gadgets, search_state)
+
+class CompileServer(object):
+  """This class answers the requests, keeping a session for each of the most recently used sets of files.
+
+    Requests are dictionaries with a command, one of:
+      compile - Compiles a ROP chain.  The request has the files (a list of [binary, gadget file, base address]), libraries,
+        arch, endness, goals (see goal.py), and optionally bad_bytes, strategy (best, first, or medium), validate,
+        max_gadgets_per_signature, and stats.  The response has the chain (hex encoded, or null if it couldn't be compiled).
+      status - Lists the sessions being kept.
+      drop - Drops all of the sessions.
+      shutdown - Stops the server.
+    Responses are dictionaries, with an error key if the request failed."""
+
+  """The default number of sets of files to keep in memory"""
+  MAX_SESSIONS = 4
+
+  def __init__(self, level = logging.WARNING, parser_type = None, max_sessions = None):
+    self.logger = logging.getLogger(self.__class__.__name__)
+    self.logger.setLevel(level)
+    self.level = level
+    self.parser_type = parser_type
+    self.max_sessions = max_sessions if max_sessions != None else self.MAX_SESSIONS
+    self.sessions = collections.OrderedDict() # session key -> CompileSession, least recently used first
+    self.running = True
+
+  def get_session(self, request):
+    files = [(binary, gadget_file, parse_address(base)) for (binary, gadget_file, base) in request["files"]]
+    libraries = request.get("libraries", [])
+    arch = archinfo.arch_from_id(request.get("arch", "AMD64"), request.get("endness", "Iend_LE"))
+    validate_gadgets = request.get("validate", False)
+    max_gadgets_per_signature = request.get("max_gadgets_per_signature")
+
+    # The base addresses aren't part of the key, sessions are just rebased when they change
+    key = (tuple([(binary, gadget_file) for (binary, gadget_file, base) in files]), tuple(libraries), arch.name,
+      arch.memory_endness, validate_gadgets, max_gadgets_per_signature)
+    if key in self.sessions:
+      session = self.sessions.pop(key)
+    else:
+      self.logger.info("Creating a session for %s", ", ".join([binary for (binary, gadget_file) in key[0]]))
+      session = self.create_session(files, libraries, arch, validate_gadgets, max_gadgets_per_signature)
+    self.sessions[key] = session
+    while len(self.sessions) > self.max_sessions:
+      self.sessions.popitem(last = False)
+    return session, [base for (binary, gadget_file, base) in files]
+
+  def create_session(self, files, libraries, arch, validate_gadgets, max_gadgets_per_signature):
+    return CompileSession(files, libraries, arch, self.level, self.parser_type, validate_gadgets, max_gadgets_per_signature)
+
+  def compile(self, request):
+    start = time.time()
+    session, base_addresses = self.get_session(request)
+    strategy = STRATEGIES[request["strategy"].lower()] if request.get("strategy") != None else None
+    collect_stats = request.get("stats", False)
+    if collect_stats:
+      stats_state = pipeline_stats.start_collection()
+    try:
+      chain = session.compile(request["goals"], base_addresses, request.get("bad_bytes"), strategy)
+    finally:
+      if collect_stats:
+        collected = pipeline_stats.finish_collection(stats_state)
+
+    response = {"chain" : binascii.hexlify(chain) if chain != None else None, "time" : time.time() - start}
+    if collect_stats:
+      response["stats"] = collected
+    return response
+
+  def handle(self, request):
+    """Answers a single request, returning the response"""
+    command = request.get("command", "compile")
+    try:
+      if command == "compile":
+        return self.compile(request)
+      elif command == "status":
+        return {"sessions" : [{"files" : [binary for (binary, gadget_file) in key[0]], "requests" : session.num_requests}
+          for key, session in self.sessions.items()]}
+      elif command == "drop":
+        self.sessions.clear()
+        return {}
+      elif command == "shutdown":
+        self.running = False
+        return {}
+      return {"error" : "Unknown command: {}".format(command)}
+    except Exception as e:
+      self.logger.exception("Request failed")
+      return {"error" : "{}: {}".format(e.__class__.__name__, e)}
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+  """Reads requests (one JSON object per line) from a connection until it's closed, answering each one in turn"""
+
+  def handle(self):
+    for line in iter(self.rfile.readline, ""):
+      if line.strip() == "":
+        continue
+      try:
+        request = to_str(json.loads(line))
+      except ValueError as e:
+        response = {"error" : "Invalid request: {}".format(e)}
+      else:
+        response = self.server.compile_server.handle(request)
+      self.wfile.write(json.dumps(response) + "\n")
+      self.wfile.flush()
+      if not self.server.compile_server.running:
+        break
+
+class TCPServer(SocketServer.TCPServer):
+  allow_reuse_address = True
+
+def create_server(compile_server, port = None, socket_path = None):
+  """Creates a socket server for the compile server, listening on a Unix socket if a path is given, or on localhost otherwise.
+    Requests are answered one at a time, so the sessions never need locking."""
+  if socket_path != None:
+    if os.path.exists(socket_path):
+      os.unlink(socket_path)
+    server = SocketServer.UnixStreamServer(socket_path, RequestHandler)
+  else:
+    server = TCPServer(("127.0.0.1", port), RequestHandler)
+  server.compile_server = compile_server
+  return server
+
+def serve(compile_server, port = None, socket_path = None):
+  server = create_server(compile_server, port, socket_path)
+  try:
+    while compile_server.running:
+      server.handle_request()
+  finally:
+    server.server_close()
+    if socket_path != None and os.path.exists(socket_path):
+      os.unlink(socket_path)
+
+class DaemonClient(object):
+  """This class sends requests to a running compile server.  The address is either the path of a Unix socket, or a (host,
+    port) tuple."""
+
+  def __init__(self, address):
+    self.address = address
+    self.sock = self.fd = None
+
+  def connect(self):
+    if isinstance(self.address, str):
+      self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+      self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.sock.connect(self.address)
+    self.fd = self.sock.makefile("rb")
+
+  def close(self):
+    if self.sock != None:
+      self.fd.close()
+      self.sock.close()
+      self.sock = self.fd = None
+
+  def request(self, request):
+    if self.sock == None:
+      self.connect()
+    self.sock.sendall(json.dumps(request) + "\n")
+    line = self.fd.readline()
+    if line == "":
+      self.close()
+      raise RuntimeError("The compile server closed the connection")
+    return to_str(json.loads(line))
+
+  def rop(self, files, libraries, goal_list, arch = None, bad_bytes = None, strategy = None, validate_gadgets = False,
+      max_gadgets_per_signature = None, stats = None):
+    """Compiles a ROP chain on the server.  The arguments are the same as ropme.rop, except that the strategy is a name (best,
+      first, or medium)"""
+    arch = ropme.get_arch(arch)
+    request = {"command" : "compile", "files" : [list(f) for f in files], "libraries" : libraries, "arch" : arch.name,
+      "endness" : arch.memory_endness, "goals" : goal_list, "bad_bytes" : bad_bytes, "strategy" : strategy,
+      "validate" : validate_gadgets, "max_gadgets_per_signature" : max_gadgets_per_signature, "stats" : stats != None}
+    response = self.request(request)
+    if "error" in response:
+      raise RuntimeError(response["error"])
+    if stats != None:
+      stats.update(response["stats"])
+    return binascii.unhexlify(response["chain"]) if response["chain"] != None else None
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description="Run a server that compiles ROP chains, keeping the gadgets in memory between requests")
+  parser.add_argument('-max_sessions', type=int, default=None, help='The number of sets of files to keep in memory')
+  parser.add_argument('-parser_type', type=str, default="cle", help='The type of file parser (cle, pyelf, radare)')
+  parser.add_argument('-port', type=int, default=8731, help='The localhost port to listen on')
+  parser.add_argument('-socket', type=str, default=None, help='The path of a Unix socket to listen on (instead of a port)')
+  parser.add_argument('-v', required=False, action='store_true', help='Verbose mode')
+  args = parser.parse_args()
+
+  logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+  logging_level = logging.DEBUG if args.v else logging.WARNING
+  compile_server = CompileServer(logging_level, args.parser_type, args.max_sessions)
+  print "Listening on {}".format(args.socket if args.socket != None else "127.0.0.1:{}".format(args.port))
+  serve(compile_server, args.port, args.socket)
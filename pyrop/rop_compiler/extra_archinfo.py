@@ -21,6 +21,24 @@ func_calling_convention = collections.defaultdict(list, {
 
 MPROTECT_SYSCALL = { "AMD64" : 10 }
 
+# Byte patterns of the instructions that end most gadgets (returns and the like), in both endiannesses where it matters.  These
+# are only used as a heuristic for deciding which regions of a binary to scan first.
+RETURN_PATTERNS = collections.defaultdict(list, {
+  "X86"    : ["\xc3", "\xc2"],                                                 # ret, ret imm16
+  "AMD64"  : ["\xc3", "\xc2"],                                                 # ret, ret imm16
+  "ARMEL"  : ["\xbd\xe8", "\xe8\xbd", "\x1e\xff\x2f\xe1", "\xe1\x2f\xff\x1e"], # pop {...}, bx lr
+  "MIPS32" : ["\x03\xe0\x00\x08", "\x08\x00\xe0\x03"],                       # jr ra
+  "MIPS64" : ["\x03\xe0\x00\x08", "\x08\x00\xe0\x03"],                       # jr ra
+  "PPC32"  : ["\x4e\x80\x00\x20", "\x20\x00\x80\x4e"],                       # blr
+  "PPC64"  : ["\x4e\x80\x00\x20", "\x20\x00\x80\x4e"],                       # blr
+})
+
+# Byte patterns for popping a register off the stack, for the architectures where that's a single short instruction
+POP_PATTERNS = collections.defaultdict(dict, {
+  "X86"   : { "eax" : "\x58", "ecx" : "\x59", "edx" : "\x5a", "ebx" : "\x5b", "esi" : "\x5e", "edi" : "\x5f" },
+  "AMD64" : { "rdi" : "\x5f", "rsi" : "\x5e", "rdx" : "\x5a", "rcx" : "\x59", "r8" : "\x41\x58", "r9" : "\x41\x59" },
+})
+
 syscall_calling_convention = {
   "AMD64" : [ "rdi", "rsi", "rdx", "r10", "r8", "r9" ]
 }
@@ -32,3 +32,17 @@ def get_finder_from_name(name = "file"):
 def default_finder():
   import memory_finder
   return memory_finder.MemoryFinder
+
+def get_gadget_list_from_name(name = "object"):
+  if name == None:
+    return default_gadget_list()
+  elif name.lower().find("object") != -1:
+    return default_gadget_list()
+  elif name.lower().find("columnar") != -1 or name.lower().find("numpy") != -1:
+    import columnar_gadget_list
+    return columnar_gadget_list.ColumnarGadgetList
+  raise RuntimeError("Unknown gadget list: %s" % name)
+
+def default_gadget_list():
+  import gadget
+  return gadget.GadgetList
@@ -1,20 +1,27 @@
 import logging, collections
-import gadget as ga, finder
+import gadget as ga, finder, utils
 
 class FileFinder(finder.Finder):
   """This class parses an previously dumped gadget list and recreates the gadgets"""
 
   def __init__(self, name, arch, base_address = 0, level = logging.WARNING, dummy = None):
-    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    utils.configure_logging()
     super(FileFinder, self).__init__(name, arch, base_address, level)
     self.fd = open(name, "rb")
 
   def __del__(self):
     self.fd.close()
 
-  def find_gadgets(self, dummy = False, bad_bytes = None):
+  def find_gadgets(self, dummy = False, bad_bytes = None, oracle = None, planner = None, budget = None, retention = None,
+      scan_cache = None):
     """Restores the gadgets from the saved gadget list"""
     gadget_list = ga.from_string(self.fd.read(), self.level, self.base_address, bad_bytes, finder.FILTER_FUNC)
+    if retention != None:
+      retention.add_gadgets(gadget_list.foreach())
+      retention.log_summary(self.name)
+      gadget_list = ga.GadgetList(retention.gadgets(), self.level, bad_bytes = bad_bytes)
+    if oracle != None: # Let the oracle know about these gadgets, so we don't bother scanning the other files if we don't need to
+      oracle.add_gadgets(gadget_list.foreach())
     self.logger.debug("Found %d (%d LoadMem) gadgets", len([x for x in gadget_list.foreach()]), len([x for x in gadget_list.foreach_type(ga.LoadMem)]))
     return gadget_list
 
@@ -1,17 +1,31 @@
-import logging
-import factories
+import logging, mmap
+import factories, utils
 
 class FileParser(object):
   """This class parses an executable file to obtain information about it"""
 
   def __init__(self, filename, base_address = 0, level = logging.WARNING):
-    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    utils.configure_logging()
     self.logger = logging.getLogger(self.__class__.__name__)
     self.logger.setLevel(level)
     self.level = level
 
     self.base_address = base_address
     self.filename = filename
+    self.file_map = None
+
+  def set_base_address(self, base_address):
+    """Changes the address the file is loaded at"""
+    self.base_address = base_address
+
+  def get_file_view(self, offset, size):
+    """Returns a read-only view of part of the file.  The file is mmap'd rather than read, so no bytes are copied until
+      something actually reads from the view"""
+    if self.file_map == None:
+      fd = open(self.filename, "rb")
+      self.file_map = mmap.mmap(fd.fileno(), 0, access = mmap.ACCESS_READ)
+      fd.close()
+    return memoryview(buffer(self.file_map, offset, size))
 
   def iter_executable_segments(self):
     """Any iterator that only returns the executable sections in the ELF file"""
@@ -25,6 +39,15 @@ class FileParser(object):
     """Returns the address for a symbol, or None if the symbol can't be found"""
     raise RuntimeError("Not Implemented")
 
+  def iter_symbols(self):
+    """An iterator over (name, address) tuples for every symbol in the file, or None if the parser can't enumerate its
+      symbols (in which case it's queried one symbol at a time instead)"""
+    return None
+
+  def get_section_range(self, name):
+    """Returns a tuple of the address and size of a section, or None if the file doesn't have the section"""
+    return None
+
   def get_writable_memory(self):
     """Returns a writable area of memory"""
     raise RuntimeError("Not Implemented")
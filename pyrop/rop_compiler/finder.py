@@ -1,6 +1,5 @@
-import archinfo
-import logging, collections
-import factories
+import logging, collections, sys, os
+import factories, gadget as ga, stats, utils, scan_cache as sc
 
 """A function to filter gadgets on when they are first created"""
 FILTER_FUNC = None
@@ -13,7 +12,7 @@ class Finder(object):
     'ARMEL' : 20 }
 
   def __init__(self, name, arch, base_address = 0, level = logging.WARNING):
-    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    utils.configure_logging()
     self.logger = logging.getLogger(self.__class__.__name__)
     self.logger.setLevel(level)
     self.level = level
@@ -22,12 +21,35 @@ class Finder(object):
     self.arch = arch
     self.name = name
 
-  def find_gadgets(self, validate = False):
-    """Finds gadgets in the specified file"""
+  def set_base_address(self, base_address):
+    """Changes the address the file is loaded at.  Only gadgets found after the change are affected"""
+    self.base_address = base_address
+
+  def find_gadgets(self, validate = False, bad_bytes = None, oracle = None, planner = None, budget = None, retention = None,
+      scan_cache = None):
+    """Finds gadgets in the specified file.  If a retention policy is given, only the gadgets it keeps are returned"""
     raise RuntimeError("Not Implemented")
 
+  def iter_gadgets(self, validate = False, bad_bytes = None):
+    """A generator that yields the gadgets in the specified file.  Finders that can find gadgets incrementally should override
+      this, so that callers can start using (or stop looking for) gadgets before the whole file is processed"""
+    for gadget in self.find_gadgets(validate, bad_bytes).foreach():
+      yield gadget
+
+  def iter_gadget_batches(self, validate = False, bad_bytes = None, batch_size = 1000):
+    """A generator that yields lists of up to batch_size gadgets as they're found"""
+    batch = []
+    for gadget in self.iter_gadgets(validate, bad_bytes):
+      batch.append(gadget)
+      if len(batch) >= batch_size:
+        yield batch
+        batch = []
+    if len(batch) != 0:
+      yield batch
+
 if __name__ == "__main__":
   import argparse
+  import archinfo
 
   parser = argparse.ArgumentParser(description="Run the gadget locator on the supplied binary")
   parser.add_argument('filename', type=str, default=None, help='The file (executable/library) to load gadgets from')
@@ -36,6 +58,9 @@ if __name__ == "__main__":
   parser.add_argument('-finder_type', type=str, default="mem", help='The type of gadget finder (memory, file)')
   parser.add_argument('-o', type=str, default=None, help='File to write the gadgets to')
   parser.add_argument('-parser_type', type=str, default="cle", help='The type of file parser (cle, pyelf, radare)')
+  parser.add_argument('-scan_cache', type=str, default=None, help='A file to reuse the gadgets of unchanged pages from (if it'
+    + ' exists), and to save the pages of this scan to (memory finder only)')
+  parser.add_argument('-stats', required=False, action='store_true', help='Print counters and timings for the scan to stderr')
   parser.add_argument('-v', required=False, action='store_true', help='Verbose mode')
   parser.add_argument('-validate', required=False, action='store_true', help='Validate gadgets with z3')
   args = parser.parse_args()
@@ -44,13 +69,32 @@ if __name__ == "__main__":
   logging_level = logging.DEBUG if args.v else logging.WARNING
   arch = archinfo.arch_from_id(args.arch, 'Iend_BE' if args.big_endian else 'Iend_LE')
   finder = finder_type(args.filename, arch, 0, logging_level, args.parser_type)
-  gadget_list = finder.find_gadgets(args.validate)
+  if args.stats:
+    stats.enable()
+
+  if args.scan_cache != None:
+    scan_cache = sc.ScanCache(logging_level)
+    if os.path.exists(args.scan_cache):
+      scan_cache.load(open(args.scan_cache, "rb").read())
+    batches = [list(finder.find_gadgets(args.validate, scan_cache = scan_cache).foreach())]
+  else:
+    batches = finder.iter_gadget_batches(args.validate)
 
   if args.o == None:
-    for gadget in gadget_list.foreach():
-      print gadget
+    for batch in batches:
+      for gadget in batch:
+        print gadget
   else:
-    fd = open(args.o, "w")
-    fd.write(gadget_list.to_string())
+    fd = open(args.o, "wb")
+    for batch in batches:
+      ga.write_gadgets(fd, batch)
+    fd.close()
+
+  if args.scan_cache != None:
+    fd = open(args.scan_cache, "wb")
+    fd.write(scan_cache.to_string())
     fd.close()
 
+  if args.stats:
+    sys.stderr.write(stats.format_stats() + "\n")
+
@@ -1,16 +1,28 @@
-import math, struct, collections, logging, sys
-import archinfo
-import z3
+import math, struct, collections, logging, sys, bisect
 import cPickle as pickle
-import utils, extra_archinfo
+import cStringIO
+import utils, extra_archinfo, stats, chain as cm, register_graph
 
-def from_string(data, log_level = logging.WARNING, address_offset = None, bad_bytes = None, filter_func = None):
-  gadgets_dict = pickle.loads(data)
-  gadgets_list = [item for sublist in gadgets_dict.values() for item in sublist] # Flatten list of lists
+archinfo = utils.LazyModule("archinfo") # Only needed to load gadget files
+z3 = utils.LazyModule("z3")             # Only needed to validate gadgets
+
+def write_gadgets(fd, gadgets):
+  """Appends a batch of gadgets to a gadget file.  A file written as a series of batches can be read with from_string, the
+    same as one written with GadgetList.to_string"""
+  pickle.dump(list(gadgets), fd, pickle.HIGHEST_PROTOCOL)
 
-  # Turn the names of the arch back into archinfo classes (Which aren't pickle-able)
-  for gadget in gadgets_list:
-    gadget.arch = archinfo.arch_from_id(gadget.arch)
+def from_string(data, log_level = logging.WARNING, address_offset = None, bad_bytes = None, filter_func = None):
+  unpickler = pickle.Unpickler(cStringIO.StringIO(data))
+  gadgets_dict = unpickler.load()
+  if isinstance(gadgets_dict, dict): # A whole GadgetList written by to_string
+    gadgets_list = [item for sublist in gadgets_dict.values() for item in sublist] # Flatten list of lists
+  else: # A series of batches written by write_gadgets
+    gadgets_list = gadgets_dict
+    while True:
+      try:
+        gadgets_list.extend(unpickler.load())
+      except EOFError:
+        break
 
   # Filter the gadgets if necessary
   if filter_func != None:
@@ -20,10 +32,12 @@ def from_string(data, log_level = logging.WARNING, address_offset = None, bad_by
   if address_offset != None:
     gl.adjust_base_address(address_offset)
 
-  if bad_bytes != None:
+  if bad_bytes != None and gl.arch != None:
     just_good_gadgets = GadgetList(log_level = log_level, bad_bytes = bad_bytes)
-    for gadget in gl.foreach():
-      if not gadget.has_bad_address(bad_bytes):
+    gadgets = list(gl.foreach())
+    bad_addresses = utils.get_bad_byte_filter(bad_bytes, gl.arch).find_bad_addresses([gadget.address for gadget in gadgets])
+    for gadget, bad_address in zip(gadgets, bad_addresses):
+      if not bad_address or gadget.avoid_bad_bytes(bad_bytes): # Try the gadget's equivalent addresses if this one is bad
         just_good_gadgets.add_gadget(gadget)
     gl = just_good_gadgets
 
@@ -43,6 +57,14 @@ class GadgetList(object):
     self.arch = None
     self.gadgets = collections.defaultdict(list, {})
     self.gadgets_per_output = collections.defaultdict(lambda : collections.defaultdict(list, []), {})
+    self.equivalence_classes = {} # gadget signature -> the gadget representing every gadget with that signature
+    self.bad_byte_plans = {}      # (input reg, register, value, protected registers) -> steps to set the register to the value
+    self.load_consts = collections.defaultdict(list)     # (register, value) -> the LoadConst gadgets, sorted by complexity
+    self.load_const_complexities = collections.defaultdict(list) # (register, value) -> the complexities of those gadgets
+    self.load_const_values = collections.defaultdict(set) # register -> the values the LoadConst gadgets can set it to
+    self.load_registers_memo = {} # see get_load_registers_gadgets
+    self.synthesized = {}         # see create_new_gadgets
+    self.register_graph = None    # see get_register_graph
     if gadgets != None:
       self.add_gadgets(gadgets)
 
@@ -54,25 +76,75 @@ class GadgetList(object):
 
   def setup_logging(self, log_level):
     self.log_level = log_level
-    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    utils.configure_logging()
     self.logger = logging.getLogger(self.__class__.__name__)
     self.logger.setLevel(log_level)
 
   def to_string(self):
-    """Turns the gadget list into a pickle'd object. This method transforms the gadget list in the process, and thus this instance
-      should not be used afterwards."""
+    """Turns the gadget list into a pickle'd object"""
+    return pickle.dumps(self.gadgets, pickle.HIGHEST_PROTOCOL)
+
+  def __getstate__(self):
+    """Pickles the gadgets along with the indexes, so a gadget list built in a worker process can be sent back and merged
+      without adding each gadget again.  The memos aren't sent, and neither are the signatures (which hold the id of the
+      arch in this process), the representative gadgets are just sent as a list."""
+    return {"log_level" : self.log_level, "strategy" : self.strategy, "bad_bytes" : self.bad_bytes,
+      "gadgets" : dict(self.gadgets),
+      "gadgets_per_output" : {type_name : dict(outputs) for type_name, outputs in self.gadgets_per_output.items()},
+      "representatives" : self.equivalence_classes.values(),
+      "load_consts" : dict(self.load_consts), "load_const_complexities" : dict(self.load_const_complexities),
+      "load_const_values" : dict(self.load_const_values)}
+
+  def __setstate__(self, state):
+    self.__init__(log_level = state["log_level"], strategy = state["strategy"], bad_bytes = state["bad_bytes"])
+    self.gadgets.update(state["gadgets"])
+    for type_name, outputs in state["gadgets_per_output"].items():
+      self.gadgets_per_output[type_name].update(outputs)
+    for gadget in state["representatives"]:
+      self.equivalence_classes[gadget.signature()] = gadget
+    self.load_consts.update(state["load_consts"])
+    self.load_const_complexities.update(state["load_const_complexities"])
+    self.load_const_values.update(state["load_const_values"])
     for gadget in self.foreach():
-      gadget.arch = gadget.arch.name
-    return pickle.dumps(self.gadgets)
+      self.arch = gadget.arch
+      break
+
+  def add_gadget(self, gadget, merge_aliases = True):
+    """Adds a gadget to the list.  If the list already has a gadget that does exactly the same thing, the new gadget's address
+      is added as an alias of that gadget instead (or just dropped, if merge_aliases is False), so searches only need to look at
+      one gadget from each equivalence class."""
+    signature = gadget.signature()
+    if signature != None:
+      representative = self.equivalence_classes.get(signature)
+      if representative is gadget: # Already in the list
+        return
+      if representative != None:
+        stats.increment("gadget_list.duplicates")
+        if not merge_aliases:
+          return
+        representative.add_aliases(gadget.all_addresses())
+        if self.bad_bytes != None:
+          representative.avoid_bad_bytes(self.bad_bytes)
+        return
+      self.equivalence_classes[signature] = gadget
 
-  def add_gadget(self, gadget):
     type_name = self.gadget_type_name(gadget.__class__)
     self.gadgets[type_name].append(gadget)
+    if len(self.load_registers_memo) != 0: # A new gadget may give a better answer
+      self.load_registers_memo.clear()
+    if len(self.synthesized) != 0:
+      self.synthesized.clear()
+    if len(self.bad_byte_plans) != 0:
+      self.bad_byte_plans.clear()
+    if type_name == MoveReg.__name__:
+      self.register_graph = None
 
     output = None
     if len(gadget.outputs) > 0:
       output = gadget.outputs[0]
     self.gadgets_per_output[type_name][output].append(gadget)
+    if type_name == LoadConst.__name__:
+      self.index_load_consts(gadget.outputs[0], gadget.params[0], [gadget])
     if type(self.arch) == type(None):
       self.arch = gadget.arch
 
@@ -80,13 +152,57 @@ class GadgetList(object):
     for gadget in gadgets:
       self.add_gadget(gadget)
 
+  def index_load_consts(self, register, value, gadgets):
+    """Adds LoadConst gadgets that set the register to the value to the index, keeping each list sorted by complexity"""
+    load_consts = self.load_consts[(register, value)]
+    complexities = self.load_const_complexities[(register, value)]
+    for gadget in gadgets:
+      complexity = gadget.complexity()
+      index = bisect.bisect_right(complexities, complexity) # After the equally complex gadgets, so they stay in order
+      complexities.insert(index, complexity)
+      load_consts.insert(index, gadget)
+    self.load_const_values[register].add(value)
+
   def adjust_base_address(self, address_offset):
     for gadget in self.foreach():
-      gadget.address += address_offset
+      gadget.adjust_base_address(address_offset)
 
-  def copy_gadgets(self, gadget_list):
+  def copy_gadgets(self, gadget_list, merge_aliases = True):
     for gadget in gadget_list.foreach():
-      self.add_gadget(gadget)
+      self.add_gadget(gadget, merge_aliases)
+
+  def merge(self, gadget_lists):
+    """Adds all of the gadgets from other gadget lists (e.g. one for each file) at once, by extending this list's indexes with
+      each of theirs, rather than adding the gadgets one at a time.  Like copy_gadgets with merge_aliases False, a gadget that
+      does exactly the same thing as one already in the list is dropped."""
+    for gadget_list in gadget_lists:
+      duplicates = gadget_list.equivalence_classes.viewkeys() & self.equivalence_classes.viewkeys()
+      stats.increment("gadget_list.duplicates", len(duplicates))
+      dropped = set([id(gadget_list.equivalence_classes[signature]) for signature in duplicates])
+      def keep(gadgets):
+        return gadgets if len(dropped) == 0 else [gadget for gadget in gadgets if id(gadget) not in dropped]
+
+      for signature, gadget in gadget_list.equivalence_classes.iteritems():
+        self.equivalence_classes.setdefault(signature, gadget)
+      for type_name, gadgets in gadget_list.gadgets.items():
+        gadgets = keep(gadgets)
+        if len(gadgets) != 0:
+          self.gadgets[type_name].extend(gadgets)
+      for type_name, outputs in gadget_list.gadgets_per_output.items():
+        for output, gadgets in outputs.items():
+          gadgets = keep(gadgets)
+          if len(gadgets) != 0:
+            self.gadgets_per_output[type_name][output].extend(gadgets)
+      for (register, value), gadgets in gadget_list.load_consts.items():
+        gadgets = keep(gadgets)
+        if len(gadgets) != 0:
+          self.index_load_consts(register, value, gadgets)
+      if type(self.arch) == type(None):
+        self.arch = gadget_list.arch
+    self.load_registers_memo.clear()
+    self.synthesized.clear()
+    self.bad_byte_plans.clear()
+    self.register_graph = None
 
   def gadget_type_name(self, gadget_type):
     """Get the gadget class name without any of the leading module names"""
@@ -98,6 +214,8 @@ class GadgetList(object):
         yield gadget
 
   def foreach_type(self, gadget_type, no_clobbers = None, input_registers = None):
+    if input_registers != None: # The gadgets store their registers as tuples
+      input_registers = tuple(input_registers)
     for gadget in self.gadgets[self.gadget_type_name(gadget_type)]:
       if ((no_clobbers == None or not gadget.clobbers_registers(no_clobbers)) and
           (input_registers == None or gadget.inputs == input_registers)):
@@ -110,8 +228,13 @@ class GadgetList(object):
 
   def find_gadget(self, gadget_type, input_registers = None, output_registers = None, no_clobber = None):
     """This method will find the best gadget (lowest complexity) given the search criteria"""
+    stats.increment("gadget_list.find_gadget")
+    if output_registers != None: # The gadgets store their registers as tuples
+      output_registers = tuple(output_registers)
     best = best_complexity = None
-    for gadget in self.foreach_type(gadget_type):
+    gadgets = self.gadgets[self.gadget_type_name(gadget_type)]
+    stats.increment("gadget_list.gadgets_examined", len(gadgets))
+    for gadget in gadgets:
       if ((input_registers == None # Not looking for a gadget with a specific register as input
           or (gadget.inputs[0] == input_registers[0] # Only looking for one specific input
             and (len(gadget.inputs) == 1 or gadget.inputs[1] == input_registers[1]))) # Also looking to match the second input
@@ -122,6 +245,7 @@ class GadgetList(object):
           best_complexity = best.complexity()
 
     if best == None:
+      stats.increment("gadget_list.synthesis_attempts")
       return self.create_new_gadgets(gadget_type, input_registers, output_registers, no_clobber)
     return best
 
@@ -132,39 +256,186 @@ class GadgetList(object):
     return self.find_gadget(LoadMem, [self.arch.registers['sp'][0]], [register], no_clobber)
 
   def find_load_const_gadget(self, register, value, no_clobber = None):
-    """This method finds the best gadget (lowest complexity) to load a register ith a constant value"""
-    for gadget in self.foreach_type_output(LoadConst, register, no_clobber):
-      if gadget.params[0] == value:
+    """This method finds the best gadget (lowest complexity) to load a register with a constant value"""
+    if value not in self.load_const_values[register]:
+      return None
+    for gadget in self.load_consts[(register, value)]:
+      if no_clobber == None or not gadget.clobbers_registers(no_clobber):
         return gadget
     return None
 
-  def create_load_registers_chain_with_bad_bytes(self, next_address, input_reg, registers, no_clobber = None):
-    bad_registers = {}
+  def get_load_const_values(self, register):
+    """Returns the set of values that a LoadConst gadget can set the register to"""
+    return self.load_const_values[register]
 
-    # Sort out the bad registers
-    for register, value in registers:
-      if utils.address_contains_bad_byte(value, self.bad_bytes, self.arch):
-        bad_registers[register] = value
-        del bad_registers[register]
-
-    print "Need to find custom load gadgets for registers", bad_registers
-    sys.exit(0)
+  def build_load_registers_chain_with_bad_bytes(self, next_address, input_reg, registers, no_clobber = None):
+    """Creates a chain to set the registers when some of the values contain bad bytes (and thus can't be put on the stack).
+      The registers with good values are loaded first, then each of the bad values is synthesized from good ones."""
+    if no_clobber == None:
+      no_clobber = []
+    bad_byte_filter = utils.get_bad_byte_filter(self.bad_bytes, self.arch)
+    good_registers = {reg : value for reg, value in registers.items() if not bad_byte_filter.contains_bad_byte(value)}
+    bad_registers = {reg : value for reg, value in registers.items() if reg not in good_registers}
+
+    steps = []
+    if len(good_registers) != 0:
+      gadgets = self.get_load_registers_gadgets(input_reg, good_registers, no_clobber)
+      if gadgets == None:
+        return None, None
+      steps = [(gadget, good_registers) for gadget in gadgets]
+
+    protected = list(no_clobber) + good_registers.keys() # The registers that the synthesized values can't clobber
+    for register, value in sorted(bad_registers.items()):
+      plan = self.synthesize_register_value(input_reg, register, value, protected)
+      if plan == None:
+        self.logger.warning("Unable to set %s to 0x%x without using bad bytes", self.tr(register), value)
+        return None, None
+      steps.extend(plan)
+      protected.append(register)
+    return self.build_steps_chain(steps, next_address)
 
   def create_load_registers_chain(self, next_address, input_reg, registers, no_clobber = None):
+    """Returns a tuple of a chain (as a string) that sets the registers to the values and then returns to next_address, and
+      the address of the chain's first gadget.  Returns (None, None) if the registers can't be set."""
+    chain, next_address = self.build_load_registers_chain(next_address, input_reg, registers, no_clobber)
+    return (chain.to_string() if chain != None else None), next_address
+
+  def build_load_registers_chain(self, next_address, input_reg, registers, no_clobber = None):
+    """The same as create_load_registers_chain, except that the chain is returned as a Chain (see chain.py)"""
     if any(map(lambda value: utils.address_contains_bad_byte(value, self.bad_bytes, self.arch), registers.values())):
-      return create_load_registers_chain_with_bad_bytes(next_address, input_reg, registers, no_clobber)
+      return self.build_load_registers_chain_with_bad_bytes(next_address, input_reg, registers, no_clobber)
 
     gadgets = self.get_load_registers_gadgets(input_reg, registers, no_clobber)
     if gadgets == None:
       return None, None
+    return self.build_steps_chain([(gadget, registers) for gadget in gadgets], next_address)
+
+  def chain_steps(self, steps, next_address):
+    """Chains together a list of (gadget, {register : value}) steps, where the dictionary holds the values the gadget loads"""
+    chain, next_address = self.build_steps_chain(steps, next_address)
+    return chain.to_string(), next_address
 
-    chain = ""
-    for gadget in gadgets[::-1]:
+  def build_steps_chain(self, steps, next_address):
+    chain = cm.Chain(self.arch)
+    for gadget, registers in steps[::-1]:
+      gadget_chain = cm.Chain(self.arch)
       gadget_registers = map(lambda x: registers[x] if x in registers else 0x5A5A5A5A5A5A5A5A, gadget.outputs) # Fill in all "Z" for any missing registers
-      chain = gadget.chain(next_address, gadget_registers) + chain
+      gadget.add_to_chain(gadget_chain, next_address, gadget_registers)
+      chain.prepend(gadget_chain)
       next_address = gadget.address
     return chain, next_address
 
+###########################################################################################################
+## Synthesizing Values With Bad Bytes #####################################################################
+###########################################################################################################
+
+  def synthesize_register_value(self, input_reg, register, value, protected):
+    """Finds the cheapest list of (gadget, {register : value}) steps that sets the register to a value containing bad bytes,
+      without any bad bytes on the stack and without clobbering the protected registers.  Returns None if there isn't one."""
+    protected = [reg for reg in protected if reg != register]
+    key = (input_reg, register, value, frozenset(protected))
+    if key not in self.bad_byte_plans:
+      stats.increment("gadget_list.bad_byte_syntheses")
+      plans = [self.synthesize_from_load_const(register, value, protected),
+        self.synthesize_from_add_const(input_reg, register, value, protected)]
+      for gadget_type, split in [(XorGadget, self.split_xor), (AddGadget, self.split_add), (SubGadget, self.split_sub)]:
+        plans.append(self.synthesize_from_arithmetic(input_reg, register, value, protected, gadget_type, split))
+      plans = filter(None, plans)
+      best = None
+      if len(plans) != 0:
+        best = min(plans, key = lambda plan: self.chain_complexity([gadget for gadget, registers in plan]))
+      self.bad_byte_plans[key] = best
+    return self.bad_byte_plans[key]
+
+  def synthesize_from_load_const(self, register, value, protected):
+    gadget = self.find_load_const_gadget(register, value, protected)
+    return [(gadget, {})] if gadget != None else None
+
+  def synthesize_from_add_const(self, input_reg, register, value, protected):
+    """Sets a register to value - constant (from the stack, or with a LoadConst gadget), then adds the constant to it"""
+    bad_byte_filter = utils.get_bad_byte_filter(self.bad_bytes, self.arch)
+    best = None
+    for add_gadget in self.foreach_type_output(AddConstGadget, register, protected):
+      source = add_gadget.inputs[0]
+      loaded_value = utils.mask(value - add_gadget.params[0], self.arch.bits)
+      if source != register and source in protected:
+        continue
+      gadgets = None
+      if loaded_value in self.get_load_const_values(source):
+        const_gadget = self.find_load_const_gadget(source, loaded_value, protected)
+        gadgets = [const_gadget] if const_gadget != None else None
+      if gadgets == None and not bad_byte_filter.contains_bad_byte(loaded_value):
+        gadgets = self.get_load_registers_gadgets(input_reg, {source : loaded_value}, protected)
+      if gadgets != None:
+        plan = [(gadget, {source : loaded_value}) for gadget in gadgets] + [(add_gadget, {})]
+        best = self.cheaper_plan(best, plan)
+    return best
+
+  def synthesize_from_arithmetic(self, input_reg, register, value, protected, gadget_type, split):
+    """Splits the value into two values without bad bytes that combine to the value, loads them into the registers, then
+      uses an arithmetic gadget to combine them"""
+    parts = split(value)
+    if parts == None:
+      return None
+    best = None
+    for gadget in self.foreach_type_output(gadget_type, register, protected):
+      (left_reg, right_reg) = gadget.inputs
+      if left_reg == right_reg or any([reg != register and reg in protected for reg in gadget.inputs]):
+        continue
+      registers = {left_reg : parts[0], right_reg : parts[1]}
+      gadgets = self.get_load_registers_gadgets(input_reg, registers, protected)
+      if gadgets != None:
+        plan = [(load_gadget, registers) for load_gadget in gadgets] + [(gadget, {})]
+        best = self.cheaper_plan(best, plan)
+    return best
+
+  def cheaper_plan(self, best, plan):
+    if best == None or self.chain_complexity([g for g, r in plan]) < self.chain_complexity([g for g, r in best]):
+      return plan
+    return best
+
+  def split_value(self, value, choose_byte):
+    """Splits a value into two values without bad bytes, one byte at a time (least significant first).  choose_byte takes a
+      byte of the value, the carry from the previous byte, and a candidate byte for the second value, and returns the byte of
+      the first value and the carry to the next byte."""
+    bad_byte_filter = utils.get_bad_byte_filter(self.bad_bytes, self.arch)
+    good_bytes = [byte for byte in range(256) if not bad_byte_filter.is_bad_value[byte]]
+    first = second = carry = 0
+    for shift in range(0, self.arch.bits, 8):
+      value_byte = (value >> shift) & 0xff
+      for second_byte in good_bytes:
+        (first_byte, next_carry) = choose_byte(value_byte, carry, second_byte)
+        if not bad_byte_filter.is_bad_value[first_byte]:
+          break
+      else:
+        return None
+      first |= first_byte << shift
+      second |= second_byte << shift
+      carry = next_carry
+
+    # Multiple byte bad patterns may span the bytes chosen above
+    if bad_byte_filter.contains_bad_byte(first) or bad_byte_filter.contains_bad_byte(second):
+      return None
+    return (first, second)
+
+  def split_xor(self, value):
+    """Returns (a, b) such that a ^ b == value"""
+    return self.split_value(value, lambda value_byte, carry, byte: (value_byte ^ byte, 0))
+
+  def split_add(self, value):
+    """Returns (a, b) such that a + b == value"""
+    def choose_byte(value_byte, carry, byte):
+      first_byte = (value_byte - byte - carry) & 0xff
+      return (first_byte, (first_byte + byte + carry) >> 8)
+    return self.split_value(value, choose_byte)
+
+  def split_sub(self, value):
+    """Returns (a, b) such that a - b == value"""
+    def choose_byte(value_byte, carry, byte):
+      total = value_byte + byte + carry
+      return (total & 0xff, total >> 8)
+    return self.split_value(value, choose_byte)
+
   def find_best_load_multiple_gadget(self, input_reg, registers, no_clobber):
     # Sort the list so the compare will work
     registers = list(registers)
@@ -198,10 +469,20 @@ class GadgetList(object):
     return False
 
   def get_load_registers_gadgets(self, input_reg, registers, no_clobber = None):
-    gadgets = []
+    """Returns a list of gadgets that load the registers from the stack (or set them with LoadConst gadgets), or None if
+      there isn't one.  The answer only depends on which values a LoadConst gadget can set, so it's memoized on those."""
     if no_clobber == None:
       no_clobber = []
-
+    key = (input_reg, self.strategy, tuple(sorted(set(no_clobber))), tuple(sorted([(reg, value if value in
+      self.load_const_values[reg] else None) for reg, value in registers.items()])))
+    if key in self.load_registers_memo:
+      stats.increment("gadget_list.load_registers_memo_hits")
+    else:
+      self.load_registers_memo[key] = self.find_load_registers_gadgets(input_reg, registers, no_clobber)
+    gadgets = self.load_registers_memo[key]
+    return list(gadgets) if gadgets != None else None # The callers add to the list they get back
+
+  def find_load_registers_gadgets(self, input_reg, registers, no_clobber):
     if len(registers) > 1:
       # Look for a LoadMultiple gadget that exactly matches our request
       best = self.find_best_load_multiple_gadget(input_reg, registers.keys(), no_clobber)
@@ -262,10 +543,10 @@ class GadgetList(object):
       if best != None:
         return best
 
-      # Last chance, call find_gadget for each register and try to make a chain. find_gadget will try to synthesize a gadget
-      # from smaller gadgets if it can
+      # Last chance, find a gadget to set each register (from the stack or with a LoadConst gadget) and try to make a chain.
+      # find_gadget will try to synthesize a gadget from smaller gadgets if it can
       for register in registers.keys():
-        gadget = self.find_gadget(LoadMem, [input_reg], [register], no_clobber)
+        gadget = self.find_load_register_gadget(input_reg, register, registers[register], no_clobber)
         if gadget == None:
           continue
 
@@ -287,25 +568,57 @@ class GadgetList(object):
 
     elif len(registers) == 1: # Look for a LoadMem gadget
       register, value = registers.items()[0]
-
-      gadget = self.find_gadget(LoadMem, [input_reg], [register], no_clobber)
-      const_gadget = self.find_load_const_gadget(register, value, no_clobber)
-      if gadget == None or (const_gadget != None and const_gadget.complexity() < gadget.complexity()):
-        gadget = const_gadget
-
+      gadget = self.find_load_register_gadget(input_reg, register, value, no_clobber)
       if gadget != None:
         return [gadget]
 
     return None
 
+  def find_load_register_gadget(self, input_reg, register, value, no_clobber):
+    """Returns the cheaper of the best gadget to load the register from the stack and the best LoadConst gadget that sets it
+      to the value, or None if there isn't either"""
+    gadget = self.find_gadget(LoadMem, [input_reg], [register], no_clobber)
+    const_gadget = self.find_load_const_gadget(register, value, no_clobber)
+    if gadget == None or (const_gadget != None and const_gadget.complexity() < gadget.complexity()):
+      gadget = const_gadget
+    return gadget
+
 ###########################################################################################################
 ## Synthesizing Gadgets ###################################################################################
 ###########################################################################################################
 
   def create_new_gadgets(self, gadget_type, inputs, outputs, no_clobbers):
-    if hasattr(self, self.gadget_type_name(gadget_type)):
-      return getattr(self, self.gadget_type_name(gadget_type))(inputs, outputs, no_clobbers)
-    return None
+    """Combines smaller gadgets into one of the given type.  The result (even if there isn't one) is memoized until the next
+      gadget is added to the list."""
+    type_name = self.gadget_type_name(gadget_type)
+    if not hasattr(self, type_name):
+      return None
+    key = (type_name, tuple(inputs) if inputs != None else None, tuple(outputs) if outputs != None else None,
+      frozenset(no_clobbers) if no_clobbers != None else None)
+    if key in self.synthesized:
+      stats.increment("gadget_list.synthesis_memo_hits")
+    else:
+      self.synthesized[key] = getattr(self, type_name)(inputs, outputs, no_clobbers)
+    return self.synthesized[key]
+
+  def get_register_graph(self):
+    """Returns the graph of the moves between registers (see register_graph.py), which is built from the MoveReg gadgets the
+      first time it's needed"""
+    if self.register_graph == None:
+      self.register_graph = register_graph.RegisterGraph(self.foreach_type(MoveReg))
+    return self.register_graph
+
+  def find_best_loads(self, input_reg, no_clobbers):
+    """Returns a dictionary of register -> the least complex LoadMem gadget that sets it (from input_reg, or from any
+      register if it's None) without clobbering the no_clobbers registers"""
+    loads = {}
+    for load_mem in self.foreach_type(LoadMem, no_clobbers):
+      if input_reg != None and load_mem.inputs[0] != input_reg:
+        continue
+      register = load_mem.outputs[0]
+      if register not in loads or load_mem.complexity() < loads[register].complexity():
+        loads[register] = load_mem
+    return loads
 
   def LoadMem(self, inputs, outputs, no_clobbers):
     gadget = self.LoadMemFromMoveReg(inputs, outputs[0], no_clobbers)
@@ -314,27 +627,30 @@ class GadgetList(object):
     return gadget
 
   def LoadMemFromMoveReg(self, inputs, output, no_clobbers):
-    best_move = best_load = None
+    """Loads another register, then moves the value into the output with one or more MoveReg gadgets"""
+    loads = self.find_best_loads(inputs[0] if inputs != None and len(inputs) > 0 else None, no_clobbers)
+    best_moves = best_load = None
     best_complexity = sys.maxint
-    for move_gadget in self.foreach_type_output(MoveReg, output, no_clobbers):
-      for load_mem in self.foreach_type_output(LoadMem, move_gadget.inputs[0], no_clobbers):
-        if inputs == None or len(inputs) < 1 or load_mem.inputs[0] == inputs[0]:
-          complexity = move_gadget.complexity() + load_mem.complexity()
-          if complexity < best_complexity:
-            best_complexity = complexity
-            (best_move, best_load) = (move_gadget, load_mem)
-    if best_move != None:
-      self.logger.debug("Creating new LoadMem[{}] from: {}{}".format(self.tr(output), best_move, best_load))
-      return CombinedGadget([best_load, best_move], [output])
+    for register, (moves_complexity, moves) in sorted(self.get_register_graph().paths_to(output, no_clobbers).items()):
+      if register in loads:
+        complexity = moves_complexity + loads[register].complexity()
+        if complexity < best_complexity:
+          best_complexity = complexity
+          (best_moves, best_load) = (moves, loads[register])
+    if best_moves != None:
+      self.logger.debug("Creating new LoadMem[{}] from: {}{}".format(self.tr(output), best_load, "".join(map(str, best_moves))))
+      return CombinedGadget([best_load] + best_moves, [output])
     return None
 
   def LoadMemFromLoadMemJump(self, inputs, output, no_clobbers):
     best_load_mem_jump = best_load_mem = None
     best_complexity = sys.maxint
+    loads = self.find_best_loads(None, no_clobbers)
     for load_mem_jump in self.foreach_type_output(LoadMemJump, output, no_clobbers):
       if not (inputs == None or len(inputs) < 1 or load_mem_jump.inputs[0] == inputs[0]):
         continue
-      for load_mem in self.foreach_type_output(LoadMem, load_mem_jump.inputs[1], no_clobbers):
+      load_mem = loads.get(load_mem_jump.inputs[1])
+      if load_mem != None:
         complexity = load_mem_jump.complexity() + load_mem.complexity()
         if complexity < best_complexity:
           best_complexity = complexity
@@ -348,7 +664,36 @@ class GadgetList(object):
 ## Gadget Classess ########################################################################################
 ###########################################################################################################
 
+"""Gadgets refer to their arch by an index into this list, rather than each holding a reference to an archinfo object"""
+ARCHES = []
+ARCH_IDS = {} # (arch name, endness) -> index in ARCHES
+
+def intern_arch(arch, endness = None):
+  """Returns the id of an arch, adding it to the registry if an equivalent arch isn't there already.  The arch can either be an
+    archinfo object, or the name of one (as stored in gadget files)"""
+  if isinstance(arch, basestring):
+    key = (arch, endness)
+    if key not in ARCH_IDS:
+      ARCH_IDS[key] = intern_arch(archinfo.arch_from_id(arch, endness) if endness != None else archinfo.arch_from_id(arch))
+    return ARCH_IDS[key]
+
+  key = (arch.name, arch.memory_endness)
+  if key not in ARCH_IDS:
+    ARCHES.append(arch)
+    ARCH_IDS[key] = len(ARCHES) - 1
+  return ARCH_IDS[key]
+
 class GadgetBase(object):
+  __slots__ = ()
+
+  @property
+  def arch(self):
+    return ARCHES[self.arch_id]
+
+  @arch.setter
+  def arch(self, arch):
+    self.arch_id = intern_arch(arch)
+
   def clobbers_register(self, reg):
     raise RuntimeError("Not Implemented")
 
@@ -358,19 +703,49 @@ class GadgetBase(object):
   def complexity(self):
     raise RuntimeError("Not Implemented")
 
-  def chain(self, next_address, input_values = None):
+  def chain(self, next_address = None, input_values = None):
+    """Returns the ROP chain (as a string) for this gadget, which returns to next_address and loads the input values"""
+    chain = cm.Chain(self.arch)
+    self.add_to_chain(chain, next_address, input_values)
+    return chain.to_string()
+
+  def add_to_chain(self, chain, next_address = None, input_values = None):
+    """Adds this gadget's slots to a Chain (see chain.py)"""
     raise RuntimeError("Not Implemented")
 
   def has_bad_address(self, bad_bytes):
     return utils.address_contains_bad_byte(self.address, bad_bytes, self.arch)
 
+  def signature(self):
+    """Returns a key that is the same for all the gadgets that do the same thing, or None if the gadget can't be deduplicated"""
+    return None
+
+  def all_addresses(self):
+    return [self.address]
+
+  def avoid_bad_bytes(self, bad_bytes):
+    """Makes sure the gadget's address doesn't contain any bad bytes.  Returns False if it can't"""
+    return not self.has_bad_address(bad_bytes)
+
+  def adjust_base_address(self, address_offset):
+    self.address += address_offset
+
 class CombinedGadget(GadgetBase):
   """This class wraps multiple gadgets which are combined to create a single ROP primitive"""
+  __slots__ = ('gadgets', 'arch_id', 'outputs')
+
   def __init__(self, gadgets, outputs):
     self.gadgets = gadgets
-    self.arch = gadgets[0].arch
-    self.address = gadgets[0].address
-    self.outputs = outputs
+    self.arch_id = gadgets[0].arch_id
+    self.outputs = tuple(outputs)
+
+  @property
+  def address(self):
+    return self.gadgets[0].address # Follows the first gadget, so cached combined gadgets stay valid when the file is rebased
+
+  def adjust_base_address(self, address_offset):
+    for gadget in self.gadgets:
+      gadget.adjust_base_address(address_offset)
 
   def __str__(self):
     return "CombinedGadget([{}])".format(", ".join([str(g) for g in self.gadgets]))
@@ -384,33 +759,52 @@ class CombinedGadget(GadgetBase):
   def clobbers_registers(self, regs):
     return any([g.clobbers_registers(regs) for g in self.gadgets])
 
-  def chain(self, next_address, input_values = None):
+  def add_to_chain(self, chain, next_address = None, input_values = None):
     types = [type(g) for g in self.gadgets]
     if types == [LoadMem, LoadMemJump]:
-      chain = self.gadgets[0].chain(self.gadgets[1].address, [next_address])
-      chain += self.gadgets[1].chain(0x5959595959595959, input_values)
-      return chain
+      self.gadgets[0].add_to_chain(chain, self.gadgets[1].address, [next_address])
+      self.gadgets[1].add_to_chain(chain, 0x5959595959595959, input_values)
+      return
 
-    chain = ""
     for i in range(len(self.gadgets)):
       next_gadget_address = next_address
       if i + 1 < len(self.gadgets):
         next_gadget_address = self.gadgets[i+1].address
-      chain += self.gadgets[i].chain(next_gadget_address, input_values)
-    return chain
+      self.gadgets[i].add_to_chain(chain, next_gadget_address, input_values)
 
 class Gadget(GadgetBase):
   """This class wraps a set of instructions and holds the associated metadata that makes up a gadget"""
+  __slots__ = ('arch_id', 'address', 'inputs', 'outputs', 'params', 'clobber', 'stack_offset', 'ip_in_stack_offset', 'aliases')
 
   def __init__(self, arch, address, inputs, outputs, params, clobber, stack_offset, ip_in_stack_offset):
     self.arch = arch
     self.address = address
-    self.inputs = inputs
-    self.outputs = outputs
-    self.params = params
-    self.clobber = clobber
+    self.inputs = tuple(inputs)
+    self.outputs = tuple(outputs)
+    self.params = tuple(params)
+    self.clobber = tuple(clobber)
     self.stack_offset = stack_offset
     self.ip_in_stack_offset = ip_in_stack_offset
+    self.aliases = None # The addresses of other gadgets that do exactly the same thing, or None if there aren't any
+
+  def __getstate__(self):
+    arch = self.arch
+    return ((arch.name, arch.memory_endness), self.address, self.inputs, self.outputs, self.params, self.clobber,
+      self.stack_offset, self.ip_in_stack_offset, self.aliases)
+
+  def __setstate__(self, state):
+    if isinstance(state, dict): # Gadget files saved before gadgets were slotted store the __dict__, with the arch's name
+      state = ((state['arch'], None), state['address'], state['inputs'], state['outputs'], state['params'], state['clobber'],
+        state['stack_offset'], state['ip_in_stack_offset'])
+    if len(state) == 8: # Saved before gadgets had aliases
+      state = tuple(state) + (None,)
+    ((arch_name, endness), self.address, inputs, outputs, params, clobber, self.stack_offset, self.ip_in_stack_offset,
+      self.aliases) = state
+    self.arch_id = intern_arch(arch_name, endness)
+    self.inputs = tuple(inputs)
+    self.outputs = tuple(outputs)
+    self.params = tuple(params)
+    self.clobber = tuple(clobber)
 
   def __str__(self):
     outputs = ", ".join([self.arch.translate_register_name(x) for x in self.outputs])
@@ -431,6 +825,38 @@ class Gadget(GadgetBase):
     return "{}(Address: 0x{:x}, Complexity {}, Stack 0x{:x}, Ip {}{}{}{}{})".format(self.__class__.__name__,
       self.address, round(self.complexity(), 2), self.stack_offset, ip, outputs, inputs, clobber, params)
 
+  def signature(self):
+    return (self.__class__, self.arch_id, self.inputs, self.outputs, self.params, self.clobber, self.stack_offset,
+      self.ip_in_stack_offset)
+
+  def all_addresses(self):
+    if self.aliases == None:
+      return [self.address]
+    return [self.address] + self.aliases
+
+  def add_aliases(self, addresses):
+    """Records the addresses of equivalent gadgets"""
+    addresses = [address for address in addresses if address != self.address]
+    if len(addresses) != 0:
+      if self.aliases == None:
+        self.aliases = []
+      self.aliases.extend(addresses)
+
+  def avoid_bad_bytes(self, bad_bytes):
+    """Switches the gadget to an equivalent address without any bad bytes, if its current address has any"""
+    if not self.has_bad_address(bad_bytes):
+      return True
+    for i, alias in enumerate(self.aliases or []):
+      if not utils.address_contains_bad_byte(alias, bad_bytes, self.arch):
+        (self.address, self.aliases[i]) = (alias, self.address)
+        return True
+    return False
+
+  def adjust_base_address(self, address_offset):
+    self.address += address_offset
+    if self.aliases != None:
+      self.aliases = [alias + address_offset for alias in self.aliases]
+
   def _is_stack_reg(self, reg):
     return reg == self.arch.registers['sp'][0]
 
@@ -473,12 +899,12 @@ class Gadget(GadgetBase):
 
     return len(self.clobber) + complexity
 
-  def chain(self, next_address, input_values = None):
+  def add_to_chain(self, chain, next_address = None, input_values = None):
     """Default ROP Chain generation, uses no parameters"""
-    chain = self.ip_in_stack_offset * "I"
-    chain += utils.ap(next_address, self.arch)
-    chain += (self.stack_offset - len(chain)) * "J"
-    return chain
+    start = len(chain)
+    chain.add_padding(self.ip_in_stack_offset, "I", self)
+    chain.add_address(next_address, self)
+    chain.pad_to(start, self.stack_offset, "J", self)
 
   def get_constraint(self):
     constraint, antialias_constraint = self.get_gadget_constraint()
@@ -540,41 +966,48 @@ class Gadget(GadgetBase):
 ###########################################################################################################
 
 class Jump(Gadget):
-  def chain(self, next_address = None, input_values = None):
-    return self.stack_offset * "K" # No parameters or IP in stack, just fill the stack offset
+  __slots__ = ()
+
+  def add_to_chain(self, chain, next_address = None, input_values = None):
+    chain.add_padding(self.stack_offset, "K", self) # No parameters or IP in stack, just fill the stack offset
 
   def get_gadget_constraint(self):
     return z3.Not(self.get_output0() == self.get_input0()), None
 
 class MoveReg(Gadget):
+  __slots__ = ()
+
   def get_gadget_constraint(self):
     return z3.Not(self.get_output0() == self.get_input0()), None
 
 class LoadConst(Gadget):
+  __slots__ = ()
+
   def get_gadget_constraint(self):
     return z3.Not(self.get_output0() == self.get_param0()), None
 
 class LoadMem(Gadget):
-  def chain(self, next_address, input_values = None):
-    chain = ""
+  __slots__ = ()
+
+  def add_to_chain(self, chain, next_address = None, input_values = None):
+    start = len(chain)
     input_from_stack = self._is_stack_reg(self.inputs[0]) and input_values[0] != None
 
     # If our input value is coming from the stack, and it's supposed to come before the next PC address, add it to the chain now
     if input_from_stack and (self.ip_in_stack_offset == None or self.params[0] < self.ip_in_stack_offset):
-      chain += self.params[0] * "L"
-      chain += utils.ap(input_values[0], self.arch)
+      chain.pad_to(start, self.params[0], "L", self)
+      chain.add_value(input_values[0], self)
 
     if self.ip_in_stack_offset != None:
-      chain += (self.ip_in_stack_offset - len(chain)) * "M"
-      chain += utils.ap(next_address, self.arch)
+      chain.pad_to(start, self.ip_in_stack_offset, "M", self)
+      chain.add_address(next_address, self)
 
     # If our input value is coming from the stack, and it's supposed to come after the next PC address, add it to the chain now
     if input_from_stack and self.ip_in_stack_offset != None and self.params[0] > self.ip_in_stack_offset:
-      chain += (self.params[0] - len(chain)) * "N"
-      chain += utils.ap(input_values[0], self.arch)
+      chain.pad_to(start, self.params[0], "N", self)
+      chain.add_value(input_values[0], self)
 
-    chain += (self.stack_offset - len(chain)) * "O"
-    return chain
+    chain.pad_to(start, self.stack_offset, "O", self)
 
   def get_gadget_constraint(self):
     mem_value = utils.z3_get_memory(self.get_mem_before(), self.get_input0() + self.get_param0(), self.arch.bits, self.arch)
@@ -582,6 +1015,8 @@ class LoadMem(Gadget):
 
 class LoadMemJump(LoadMem):
   """This gadget loads memory then jumps to a register (Used often in ARM)"""
+  __slots__ = ()
+
   def get_gadget_constraint(self):
     load_constraint, antialias_constraint = super(LoadMemJump, self).get_gadget_constraint()
     jump_constraint = z3.Not(self.get_reg_after(self.arch.registers['ip'][0]) == self.get_input1())
@@ -589,6 +1024,8 @@ class LoadMemJump(LoadMem):
 
 class LoadMultiple(LoadMem):
   """This gadget loads multiple registers at once"""
+  __slots__ = ()
+
   def get_gadget_constraint(self):
     load_mem_constraint = None
     for i in range(len(self.outputs)):
@@ -600,7 +1037,8 @@ class LoadMultiple(LoadMem):
         load_mem_constraint = z3.Or(load_mem_constraint, new_constraint)
     return load_mem_constraint, None
 
-  def chain(self, next_address, input_values):
+  def add_to_chain(self, chain, next_address = None, input_values = None):
+    start = len(chain)
     ip_added = False
 
     # if the registers and ip are on the stack, we have to intermingle them
@@ -611,33 +1049,33 @@ class LoadMultiple(LoadMem):
         regs_to_params.append((self.params[i], self.outputs[i], i))
       regs_to_params.sort()
 
-      chain = ""
       for param, reg, output_idx in regs_to_params:
         before_ip_on_stack = self.ip_in_stack_offset == None or param < self.ip_in_stack_offset
 
         # If our input value is coming from the stack, and it's supposed to come before the next PC address, add it to the chain now
         if before_ip_on_stack:
-          chain += (param - len(chain)) * "P"
-          chain += utils.ap(input_values[output_idx], self.arch)
+          chain.pad_to(start, param, "P", self)
+          chain.add_value(input_values[output_idx], self)
 
         if self.ip_in_stack_offset != None and not ip_added and not before_ip_on_stack:
-          chain += (self.ip_in_stack_offset - len(chain)) * "Q"
-          chain += utils.ap(next_address, self.arch)
+          chain.pad_to(start, self.ip_in_stack_offset, "Q", self)
+          chain.add_address(next_address, self)
           ip_added = True
 
         # If our input value is coming from the stack, and it's supposed to come after the next PC address, add it to the chain now
         if not before_ip_on_stack:
-          chain += (param - len(chain)) * "R"
-          chain += utils.ap(input_values[output_idx], self.arch)
+          chain.pad_to(start, param, "R", self)
+          chain.add_value(input_values[output_idx], self)
 
     # if the IP hasn't already been set, add it now
     if self.ip_in_stack_offset != None and not ip_added:
-      chain += (self.ip_in_stack_offset - len(chain)) * "S"
-      chain += utils.ap(next_address, self.arch)
-    chain += (self.stack_offset - len(chain)) * "T"
-    return chain
+      chain.pad_to(start, self.ip_in_stack_offset, "S", self)
+      chain.add_address(next_address, self)
+    chain.pad_to(start, self.stack_offset, "T", self)
 
 class StoreMem(Gadget):
+  __slots__ = ()
+
   def get_gadget_constraint(self):
     address = self.get_input0() + self.get_param0()
     mem_value = utils.z3_get_memory(self.get_mem_after(), address, self.arch.bits, self.arch)
@@ -647,19 +1085,27 @@ class StoreMem(Gadget):
     return store_constraint, antialias_constraint
 
 class Arithmetic(Gadget):
+  __slots__ = ()
+
   def get_gadget_constraint(self):
     return z3.Not(self.get_output0() == self.binop(self.get_input0(), self.get_input1())), None
 
 class ArithmeticConst(Gadget):
+  __slots__ = ()
+
   def get_gadget_constraint(self):
     return z3.Not(self.get_output0() == self.binop(self.get_input0(), self.get_param0())), None
 
 class ArithmeticLoad(Gadget):
+  __slots__ = ()
+
   def get_gadget_constraint(self):
     mem_value = utils.z3_get_memory(self.get_mem_before(), self.get_input0() + self.get_param0(), self.arch.bits, self.arch)
     return z3.Not(self.get_output0() == self.binop(mem_value, self.get_input1())), None
 
 class ArithmeticStore(Gadget):
+  __slots__ = ()
+
   def get_gadget_constraint(self):
     address = self.get_input0() + self.get_param0()
     in_mem_value = utils.z3_get_memory(self.get_mem_before(), address, self.arch.bits, self.arch)
@@ -671,80 +1117,118 @@ class ArithmeticStore(Gadget):
 
 # Split up the Arithmetic gadgets, so they're easy to search for when you are searching for a specific one
 class AddGadget(Arithmetic):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x + y
 
 class AddConstGadget(ArithmeticConst):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x + y
 
 class SubGadget(Arithmetic):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x - y
 
 class MulGadget(Arithmetic):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x * y
 
 class AndGadget(Arithmetic):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x & y
 
 class OrGadget(Arithmetic):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x | y
 
 class XorGadget(Arithmetic):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x ^ y
 
 
 # Split up the Arithmetic Load gadgets, so they're easy to search for when you are searching for a specific one
 class LoadAddGadget(ArithmeticLoad):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x + y
 
 class LoadSubGadget(ArithmeticLoad):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x - y
 
 class LoadMulGadget(ArithmeticLoad):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x * y
 
 class LoadAndGadget(ArithmeticLoad):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x & y
 
 class LoadOrGadget(ArithmeticLoad):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x | y
 
 class LoadXorGadget(ArithmeticLoad):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x ^ y
 
 # Split up the Arithmetic Store gadgets, so they're easy to search for when you are searching for a specific one
 class StoreAddGadget(ArithmeticStore):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x + y
 
 class StoreSubGadget(ArithmeticStore):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x - y
 
 class StoreMulGadget(ArithmeticStore):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x * y
 
 class StoreAndGadget(ArithmeticStore):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x & y
 
 class StoreOrGadget(ArithmeticStore):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x | y
 
 class StoreXorGadget(ArithmeticStore):
+  __slots__ = ()
+
   @classmethod
   def binop(self,x,y): return x ^ y
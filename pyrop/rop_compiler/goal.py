@@ -1,5 +1,5 @@
 # This file wraps the goal interface, i.e. how you tell the ROP compiler what you want your ROP chain to do.
-import json, logging, binascii, factories
+import json, logging, binascii, factories, utils
 
 class Goal(object):
   """This class is the parent Goal class, where any common methods can be placedd"""
@@ -61,7 +61,7 @@ class GoalResolver(object):
   """
 
   def __init__(self, file_handler, goal_list, level = logging.WARNING):
-    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    utils.configure_logging()
     self.logger = logging.getLogger(self.__class__.__name__)
     self.logger.setLevel(level)
     self.file_handler = file_handler
@@ -1,36 +1,141 @@
 import logging, collections
-import classifier as cl, gadget as ga, finder, factories, utils
+import classifier as cl, gadget as ga, finder, factories, utils, stats
 
 class MemoryFinder(finder.Finder):
   """This class parses a file to obtain any gadgets inside their executable sections"""
 
+  """The number of addresses to scan between checking the sufficiency oracle and scan budget"""
+  ORACLE_CHECK_INTERVAL = 0x400
+
   def __init__(self, name, arch, base_address = 0, level = logging.WARNING, parser_type = None):
     super(MemoryFinder, self).__init__(name, arch, base_address, level)
     self.parser = factories.get_parser_from_name(parser_type)(name, base_address, level)
 
-  def find_gadgets(self, validate = False, bad_bytes = None):
+  def set_base_address(self, base_address):
+    super(MemoryFinder, self).set_base_address(base_address)
+    self.parser.set_base_address(base_address)
+
+  def find_gadgets(self, validate = False, bad_bytes = None, oracle = None, planner = None, budget = None, retention = None,
+      scan_cache = None):
     """Finds gadgets in the specified file"""
+    gadgets = self.iter_gadgets(validate, bad_bytes, oracle, planner, budget, scan_cache)
+    if retention != None: # Filter the gadgets as they're found, so the unwanted ones never build up
+      retention.add_gadgets(gadgets)
+      retention.log_summary(self.name)
+      gadgets = retention.gadgets()
     gadget_list = ga.GadgetList(log_level = self.level, bad_bytes = bad_bytes)
-    for segment in self.parser.iter_executable_segments():
-      self.get_gadgets_for_segment(segment, gadget_list, validate, bad_bytes)
+    gadget_list.add_gadgets(gadgets)
     self.logger.debug("Found %d gadgets in %s", len([x for x in gadget_list.foreach()]), self.name)
     return gadget_list
 
-  def get_gadgets_for_segment(self, segment, gadget_list, validate, bad_bytes):
-    """Iteratively step through an executable section looking for gadgets at each address"""
-    data, seg_address = self.parser.get_segment_bytes_address(segment)
-    if self.base_address == 0 and seg_address == 0:
-      self.logger.warning("No base address given for library or PIE executable.  Addresses may be wrong")
+  def get_segment_regions(self):
+    """Returns a region for each executable segment, as tuples of (segment number, data, segment address, start, end)"""
+    regions = []
+    for segment_number, segment in enumerate(self.parser.iter_executable_segments()):
+      data, seg_address = self.parser.get_segment_bytes_address(segment)
+      data = memoryview(data) # Slicing a memoryview doesn't copy, so each window below is just a view into the segment
+      if self.base_address == 0 and seg_address == 0:
+        self.logger.warning("No base address given for library or PIE executable.  Addresses may be wrong")
+      regions.append((segment_number, data, seg_address, 0, len(data)))
+    return regions
+
+  def iter_gadgets(self, validate = False, bad_bytes = None, oracle = None, planner = None, budget = None, scan_cache = None):
+    """A generator that yields gadgets as soon as they're found, rather than waiting for the whole file to be scanned.  If a
+      sufficiency oracle is given, the scan stops once the oracle reports that enough gadgets have been found.  If a region
+      planner is given, the most promising regions of the file are scanned first, and if a budget is given, the scan stops
+      once the budget is used up.  If a scan cache is given, the gadgets of any pages that were already scanned (e.g. in a
+      previous build of the file) are taken from the cache, and the newly scanned pages are added to it."""
+    regions = self.get_segment_regions()
+    if planner != None:
+      high_yield_ranges = filter(None, map(self.parser.get_section_range, planner.HIGH_YIELD_SECTIONS))
+      regions = [region for segment in regions for region in planner.iter_regions(*segment[:3])]
+      regions = planner.order(self.name, regions, high_yield_ranges)
 
     classifier = cl.GadgetClassifier(self.arch, validate, log_level = self.level)
-    for i in range(0, len(data), self.arch.instruction_alignment):
-      address = self.base_address + seg_address + i
-      if bad_bytes != None and utils.address_contains_bad_byte(address, bad_bytes, self.arch):
-        continue
-      end = i + self.MAX_GADGET_SIZE[self.arch.name]
-      code = data[i:end]
-      gadgets = classifier.create_gadgets_from_instructions(code, address)
-      if finder.FILTER_FUNC != None:
-        gadgets = finder.FILTER_FUNC(gadgets)
-      gadget_list.add_gadgets(gadgets)
+    bad_byte_filter = utils.get_bad_byte_filter(bad_bytes, self.arch) if bad_bytes != None else None
+    alignment = self.arch.instruction_alignment
+    for region in regions:
+      (segment_number, data, seg_address, start, end) = region
+      region_useful = 0 # Only the count is kept, so the region's gadgets don't all stay in memory
+      pages = [(start, end)] if scan_cache == None else scan_cache.split_pages(self.arch, data, start, end)
+      next_check = start
+      for (page_start, page_end) in pages:
+        page_address = self.base_address + seg_address + page_start
+        key = page_gadgets = None
+        if scan_cache != None:
+          key = scan_cache.page_key(self.arch, data, page_start, page_end, validate)
+          (reused, stale) = scan_cache.lookup(key, page_address, self.name)
+          if reused != None:
+            if self.is_scan_done(oracle, budget):
+              return
+            stats.increment("scan_cache.reused_pages")
+            for address in stale: # The addresses whose gadgets may have changed when the page moved
+              i = address - self.base_address - seg_address
+              reused.extend(classifier.create_gadgets_from_instructions(data[i:i + self.MAX_GADGET_SIZE[self.arch.name]], address))
+            if bad_byte_filter != None:
+              reused = [gadget for gadget in reused if not bad_byte_filter.contains_bad_byte(gadget.address)]
+            if finder.FILTER_FUNC != None:
+              reused = finder.FILTER_FUNC(reused)
+            stats.increment("scan_cache.reused_gadgets", len(reused))
+            for gadget in reused:
+              if oracle != None:
+                oracle.add_gadget(gadget)
+              if planner != None and planner.is_useful(gadget):
+                region_useful += 1
+              yield gadget
+            continue
+          stats.increment("scan_cache.scanned_pages")
+          page_gadgets = []
+
+        i = page_start
+        while i < page_end:
+          if i >= next_check:
+            next_check = i + self.ORACLE_CHECK_INTERVAL
+            if self.is_scan_done(oracle, budget):
+              return
+
+          address = self.base_address + seg_address + i
+          if bad_byte_filter != None:
+            # Skip past all the addresses that share the bad byte, rounding up to keep the instructions aligned
+            skip = bad_byte_filter.next_candidate(address) - address
+            if skip == 0 and bad_byte_filter.contains_bad_byte(address): # A multiple byte bad pattern
+              skip = alignment
+            if skip != 0:
+              skip = ((skip + alignment - 1) / alignment) * alignment
+              stats.increment("finder.bad_byte_addresses", (min(skip, page_end - i) + alignment - 1) / alignment)
+              i += skip
+              continue
+
+          stats.increment("finder.addresses")
+          if budget != None:
+            budget.consume()
+          code = data[i:i + self.MAX_GADGET_SIZE[self.arch.name]]
+          gadgets = classifier.create_gadgets_from_instructions(code, address)
+          if page_gadgets != None:
+            page_gadgets.extend(scan_cache.snapshot(gadgets))
+          if finder.FILTER_FUNC != None:
+            gadgets = finder.FILTER_FUNC(gadgets)
+          stats.increment("finder.gadgets", len(gadgets))
+          for gadget in gadgets:
+            if oracle != None:
+              oracle.add_gadget(gadget)
+            if planner != None and planner.is_useful(gadget):
+              region_useful += 1
+            yield gadget
+          i += alignment
+
+        # Pages scanned with bad bytes are missing the gadgets at the skipped addresses, so they can't be reused
+        if page_gadgets != None and bad_byte_filter == None:
+          scan_cache.record(key, page_address, page_gadgets, self.name)
+
+      if planner != None: # Only complete regions get here, so a partial scan never makes a region look worse than it is
+        planner.record(self.name, region, region_useful)
+
+    if scan_cache != None and bad_byte_filter == None: # Every page was recorded, so the file's older pages can be dropped
+      scan_cache.complete(self.name)
 
+  def is_scan_done(self, oracle, budget):
+    if (oracle != None and oracle.is_sufficient()) or (budget != None and budget.is_exhausted()):
+      self.logger.debug("Stopping the scan of %s early", self.name)
+      return True
+    return False
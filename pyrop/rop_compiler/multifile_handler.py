@@ -1,39 +1,107 @@
-import logging
-import factories
+import logging, os, collections, multiprocessing
+import factories, symbol_index, stats, retention, gadget as ga, utils
+
+# The state shared with the worker processes of MultifileHandler.find_gadgets_in_parallel, which inherit it when they're forked
+scan_state = None
+
+def find_file_gadgets(index):
+  """Finds the gadgets in one of the files, in a worker process.  The file is parsed in the worker, and just the gadget list
+    (and the stats and scan cache pages, if they're being collected) are sent back."""
+  (file_handler, validate_gadgets, bad_bytes, budget, max_per_signature, scan_cache) = scan_state
+  stats.reset() # Only send back this file's stats, rather than the ones inherited from the parent
+  if scan_cache != None:
+    scan_cache.current.clear()
+    scan_cache.completed.clear()
+  gadget_list = file_handler.find_file_gadgets(index, validate_gadgets, bad_bytes, None, None, budget, max_per_signature,
+    scan_cache)
+  return (gadget_list, stats.get_stats() if stats.enabled else None,
+    scan_cache.get_scan() if scan_cache != None else None)
 
 class MultifileHandler(object):
-  """This class parses a set of executable file to obtain information about it"""
+  """This class parses a set of executable file to obtain information about it.  The files and libraries are only parsed when
+    they're first needed, and when there are multiple files, their gadgets are found in parallel."""
 
-  def __init__(self, files, libraries, arch, level = logging.WARNING, parser_type = None):
-    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+  def __init__(self, files, libraries, arch, level = logging.WARNING, parser_type = None, symbol_index_file = None,
+      processes = None, gadget_list_type = None):
+    utils.configure_logging()
     self.logger = logging.getLogger(self.__class__.__name__)
     self.logger.setLevel(level)
     self.level = level
     self.arch = arch
-
-    parser_class = factories.get_parser_from_name(parser_type)
-
-    self.files = []
-    for binary_file, gadget_file, base_address in files:
-      finder = parser = None
-      parser = parser_class(binary_file, base_address, level)
+    self.parser_type = parser_type
+    self.processes = processes # The number of processes to find gadgets in, or None for one per file (up to the cpu count)
+    self.gadget_list_type = gadget_list_type # The GadgetList to return the gadgets in (see factories.py), or None for the default
+
+    self.files = [(binary_file, gadget_file) for (binary_file, gadget_file, base_address) in files]
+    self.base_addresses = [base_address for (binary_file, gadget_file, base_address) in files]
+    self.parsers = [None] * len(files) # Created by get_parser
+    self.finders = [None] * len(files) # Created by get_finder
+    self.file_gadgets = collections.OrderedDict() # file name -> the gadgets found in that file
+    self.libraries = list(libraries)
+
+    # Index the symbols in all of the files and libraries, so each symbol only needs to be resolved once
+    self.symbol_index_file = symbol_index_file
+    if symbol_index_file != None and os.path.exists(symbol_index_file):
+      self.symbol_index = symbol_index.from_string(open(symbol_index_file, "rb").read(), level)
+    else:
+      self.symbol_index = symbol_index.SymbolIndex(level)
+    for index, (name, gadget_file) in enumerate(self.files):
+      self.symbol_index.add_lazy_object(name, lambda index = index: self.get_parser(index), self.base_addresses[index])
+    for lib in self.libraries:
+      if lib not in [name for (name, gadget_file) in self.files]: # Offsets don't depend on the base, so reuse the file's entry
+        self.symbol_index.add_lazy_object(lib, lambda lib = lib: self.create_parser(lib, 0), 0)
+
+  def create_parser(self, filename, base_address):
+    """Parses a file.  The parser's module (and the library behind it) isn't imported until the first file is parsed"""
+    return factories.get_parser_from_name(self.parser_type)(filename, base_address, self.level)
+
+  def get_parser(self, index):
+    """Returns the parser for one of the files, parsing the file the first time it's needed"""
+    if self.parsers[index] == None:
+      self.parsers[index] = self.create_parser(self.files[index][0], self.base_addresses[index])
+    return self.parsers[index]
+
+  def get_finder(self, index):
+    """Returns the gadget finder for one of the files, which reads the gadget file if one was given, and scans the file
+      otherwise"""
+    if self.finders[index] == None:
+      (binary_file, gadget_file) = self.files[index]
       if gadget_file != None:
-        finder = factories.get_finder_from_name("file")(gadget_file, arch, base_address, level, parser_type)
+        finder_class, filename = factories.get_finder_from_name("file"), gadget_file
       else:
-        finder = factories.get_finder_from_name("mem")(binary_file, arch, base_address, level, parser_type)
-      self.files.append((binary_file, parser, finder))
-
-    self.libraries = {}
-    for lib in libraries:
-      self.libraries[lib] = parser_class(lib, 0, level)
+        finder_class, filename = factories.get_finder_from_name("mem"), binary_file
+      self.finders[index] = finder_class(filename, self.arch, self.base_addresses[index], self.level, self.parser_type)
+    return self.finders[index]
+
+  def rebase(self, base_addresses):
+    """Moves the files to new base addresses (e.g. once the address of a library has been leaked), without parsing them or
+      finding their gadgets again.  base_addresses is a list with the new base address of each file, in the same order as the
+      files list.  Any gadgets already found are moved as well."""
+    for i, ((name, gadget_file), base_address) in enumerate(zip(self.files, base_addresses)):
+      address_offset = base_address - self.base_addresses[i]
+      if address_offset == 0:
+        continue
+      self.logger.debug("Rebasing %s to 0x%x", name, base_address)
+      self.base_addresses[i] = base_address # The parser and finder are created with this base, if they haven't been yet
+      if self.parsers[i] != None:
+        self.parsers[i].set_base_address(base_address)
+      if self.finders[i] != None:
+        self.finders[i].set_base_address(base_address)
+      self.symbol_index.set_base_address(name, base_address)
+      for gadget in self.file_gadgets.get(name, []):
+        gadget.adjust_base_address(address_offset)
+
+  def save_symbol_index(self, filename = None):
+    """Writes the symbol index to disk, so that later runs don't need to resolve the same symbols again"""
+    if filename == None:
+      filename = self.symbol_index_file
+    fd = open(filename, "wb")
+    fd.write(self.symbol_index.to_string())
+    fd.close()
 
   def get_symbol_address(self, symbol_name):
     """Returns the address for a symbol, or None if the symbol can't be found"""
-    for (name, parser, finder) in self.files:
-      symbol_address = parser.get_symbol_address(symbol_name)
-      if symbol_address != None:
-        return symbol_address
-    return None
+    return self.symbol_index.get_symbol_address(symbol_name, [name for (name, gadget_file) in self.files])
 
   def get_symbols_address(self, names):
     addresses = {}
@@ -43,43 +111,96 @@ class MultifileHandler(object):
 
   def get_writable_memory(self):
     """Returns an area of writable memory that we know the address (i.e. one of the ones specified in the files list)"""
-    for (name, parser, finder) in self.files:
-      addr = parser.get_writable_memory()
+    for index in range(len(self.files)):
+      addr = self.get_parser(index).get_writable_memory()
       if addr != None:
         return addr
     raise RuntimeError("Couldn't find a .data section when looking for writable memory")
 
-  def find_gadgets(self, validate_gadgets = False, bad_bytes = None):
-    """Finds gadgets in the specified file"""
-    all_gadget_list = None
-    for (name, parser, finder) in self.files:
-      new_gadget_list = finder.find_gadgets(validate_gadgets, bad_bytes)
-      if all_gadget_list == None:
-        all_gadget_list = new_gadget_list
-      else:
-        all_gadget_list.copy_gadgets(new_gadget_list)
+  def find_gadgets(self, validate_gadgets = False, bad_bytes = None, oracle = None, planner = None, budget = None,
+      max_per_signature = None, scan_cache = None):
+    """Finds gadgets in the specified file.  If a sufficiency oracle is given, the scanning stops as soon as it reports that
+      enough gadgets have been found.  The region planner, scan budget, and scan cache are passed on to the gadget finders.  If
+      max_per_signature is given, only that many gadgets are kept from each file for each (type, inputs, outputs).  Gadgets
+      from different files are never merged as aliases of each other, so that each file can be rebased independently."""
+    start = stats.start_timer()
+    if oracle == None and planner == None and self.get_num_processes() > 1:
+      gadget_lists = self.find_gadgets_in_parallel(validate_gadgets, bad_bytes, budget, max_per_signature, scan_cache)
+    else: # The oracle and planner learn from each file in turn, so the files have to be scanned one at a time
+      gadget_lists = []
+      for index, (name, gadget_file) in enumerate(self.files):
+        if oracle != None and len(gadget_lists) != 0 and oracle.is_sufficient():
+          self.logger.debug("Found enough gadgets, skipping %s", name)
+          continue
+        gadget_lists.append(self.find_file_gadgets(index, validate_gadgets, bad_bytes, oracle, planner, budget,
+          max_per_signature, scan_cache))
+
+    for gadget_list in gadget_lists[1:]:
+      stats.increment("multifile_handler.merged_gadgets", sum(map(len, gadget_list.gadgets.values())))
+    all_gadget_list = gadget_lists[0] if len(gadget_lists) != 0 else None
+    if all_gadget_list != None and self.gadget_list_type != None:
+      all_gadget_list = factories.get_gadget_list_from_name(self.gadget_list_type)(log_level = self.level,
+        strategy = all_gadget_list.strategy, bad_bytes = all_gadget_list.bad_bytes)
+      all_gadget_list.merge(gadget_lists)
+    elif all_gadget_list != None:
+      all_gadget_list.merge(gadget_lists[1:])
+    stats.stop_timer("multifile_handler.find_gadgets", start)
     return all_gadget_list
 
+  def find_file_gadgets(self, index, validate_gadgets, bad_bytes, oracle, planner, budget, max_per_signature, scan_cache):
+    """Finds the gadgets in one of the files"""
+    policy = None
+    if max_per_signature != None:
+      policy = retention.RetentionPolicy(max_per_signature, bad_bytes, self.level)
+    gadget_list = self.get_finder(index).find_gadgets(validate_gadgets, bad_bytes, oracle, planner, budget, policy,
+      scan_cache)
+    self.file_gadgets[self.files[index][0]] = list(gadget_list.foreach())
+    return gadget_list
+
+  def get_num_processes(self):
+    if multiprocessing.current_process().daemon: # e.g. a rop_batch worker, which isn't allowed to start processes
+      return 1
+    if self.processes != None:
+      return min(self.processes, len(self.files))
+    return min(multiprocessing.cpu_count(), len(self.files))
+
+  def find_gadgets_in_parallel(self, validate_gadgets, bad_bytes, budget, max_per_signature, scan_cache):
+    """Finds the gadgets in each of the files in a separate process, returning a gadget list for each file"""
+    global scan_state
+    scan_state = (self, validate_gadgets, bad_bytes, budget, max_per_signature, scan_cache)
+    try:
+      pool = multiprocessing.Pool(self.get_num_processes())
+      try:
+        results = pool.map(find_file_gadgets, range(len(self.files)))
+      finally:
+        pool.close()
+        pool.join()
+    finally:
+      scan_state = None
+
+    gadget_lists = []
+    for (name, gadget_file), (gadget_list, collected, scan) in zip(self.files, results):
+      if collected != None:
+        stats.merge(collected)
+      if scan != None:
+        scan_cache.add_scan(scan)
+      self.file_gadgets[name] = list(gadget_list.foreach())
+      gadget_lists.append(gadget_list) # Already indexed in the worker, so it can be merged without adding each gadget again
+    return gadget_lists
+
   def resolve_symbol_from_got(self, base_name, target_name):
     """Gets the offset from one symbol to another in a library, and the address of the symbol in the GOT.  This info can be
       used to determine the target symbol's address if one can read the given symbol in the GOT."""
 
     # First, get the address of the base in the GOT
-    main_binary = self.files[0][1]
-    symbol_in_got = main_binary.find_symbol_in_got(base_name)
+    symbol_in_got = self.symbol_index.find_symbol_in_got(base_name, self.files[0][0])
 
     # Now, get the offset from the base to the target in libc
-    base_in_libc = target_in_libc = None
-    for name, parser in self.libraries.items():
-      base_in_libc = parser.get_symbol_address(base_name)
-      target_in_libc = parser.get_symbol_address(target_name)
-      if base_in_libc != None and target_in_libc != None:
-        break
-
-    if base_in_libc == None and target_in_libc == None:
+    offset = self.symbol_index.get_relative_offset(base_name, target_name, self.libraries)
+    if offset == None:
       return (None, None)
 
-    return symbol_in_got, (target_in_libc - base_in_libc)
+    return symbol_in_got, offset
 
 if __name__ == "__main__":
   import argparse
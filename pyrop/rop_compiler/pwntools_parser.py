@@ -1,6 +1,6 @@
 import logging, collections, os
 import file_parser
-from pwn import *
+from pwn import ELF
 
 class PwntoolsParser(file_parser.FileParser):
   """This class parses an executable file using radare"""
@@ -11,6 +11,10 @@ class PwntoolsParser(file_parser.FileParser):
     if base_address != 0:
       self.elf.address = base_address
 
+  def set_base_address(self, base_address):
+    super(PwntoolsParser, self).set_base_address(base_address)
+    self.elf.address = base_address
+
   def iter_executable_segments(self):
     """Any iterator that only returns the executable sections in the ELF file"""
     for seg in self.elf.executable_segments:
@@ -18,7 +22,7 @@ class PwntoolsParser(file_parser.FileParser):
 
   def get_segment_bytes_address(self, seg):
     """Returns a segments bytes and the address of the segment"""
-    return seg.data(), seg.header.p_vaddr + self.base_address # vaddr doesn't respect elf.address
+    return self.get_file_view(seg.header.p_offset, seg.header.p_filesz), seg.header.p_vaddr + self.base_address # vaddr doesn't respect elf.address
 
   def get_symbol_address(self, name, recurse_with_imp = True):
     """Returns the address for a symbol, or None if the symbol can't be found"""
@@ -26,6 +30,16 @@ class PwntoolsParser(file_parser.FileParser):
       return self.elf.symbols[name]
     return None
 
+  def iter_symbols(self):
+    """An iterator over (name, address) tuples for every symbol in the file"""
+    return self.elf.symbols.iteritems()
+
+  def get_section_range(self, name):
+    section = self.elf.get_section_by_name(name)
+    if section == None:
+      return None
+    return section.header.sh_addr + self.base_address, section.header.sh_size # sh_addr doesn't respect elf.address
+
   def get_writable_memory(self):
     return self.elf.get_section_by_name('.data').header.sh_addr + self.base_address # sh_addr doesn't respect elf.address
 
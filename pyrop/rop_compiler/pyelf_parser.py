@@ -12,6 +12,7 @@ class PyelfParser(file_parser.FileParser):
     super(PyelfParser, self).__init__(filename, base_address, level)
     self.fd = open(filename, "rb")
     self.elffile = ELFFile(self.fd)
+    self.dynamic_segment = self.get_dynamic_segment(self.elffile)
 
   def __del__(self):
     self.fd.close()
@@ -24,7 +25,7 @@ class PyelfParser(file_parser.FileParser):
 
   def get_segment_bytes_address(self, segment):
     """Returns a segments bytes and the address of the segment"""
-    return segment.data(), segment.header.p_vaddr + self.base_address
+    return self.get_file_view(segment.header.p_offset, segment.header.p_filesz), segment.header.p_vaddr + self.base_address
 
   def get_dynamic_segment(self, elffile):
     """Finds the dynamic segment in an ELFFile"""
@@ -36,7 +37,7 @@ class PyelfParser(file_parser.FileParser):
 
   def get_symbol_address(self, name):
     containers = [self.elffile.get_section_by_name('.symtab'), self.elffile.get_section_by_name('.dynsym'),
-      self.get_dynamic_segment(self.elffile)]
+      self.dynamic_segment]
     for container in containers:
       if container and (isinstance(container, SymbolTableSection) or isinstance(container, DynamicSegment)):
         symbol_address = self.find_symbol(container, name)
@@ -44,16 +45,33 @@ class PyelfParser(file_parser.FileParser):
           return symbol_address
     return None
 
+  def iter_symbols(self):
+    """An iterator over (name, address) tuples for every symbol in the file"""
+    containers = [self.elffile.get_section_by_name('.symtab'), self.elffile.get_section_by_name('.dynsym'),
+      self.dynamic_segment]
+    has_dynamic = self.dynamic_segment != None
+    for container in containers:
+      if container and (isinstance(container, SymbolTableSection) or isinstance(container, DynamicSegment)):
+        for symbol in container.iter_symbols():
+          if symbol.entry.st_value != 0:
+            yield symbol.name, (self.base_address if has_dynamic else 0) + symbol.entry.st_value
+
   def find_symbol(self, container, name):
     """Given an ELFFile and a section/segment, this function searches the ELFFile to determine the address of a function"""
     for symbol in container.iter_symbols():
       if symbol.name == name and symbol.entry.st_value != 0:
-        if self.get_dynamic_segment(self.elffile) != None: # if the file has a dynamic section, it's probably ASLR
+        if self.dynamic_segment != None: # if the file has a dynamic section, it's probably ASLR
           return self.base_address + symbol.entry.st_value # so include the address.  Note, this isn't the best heuristic though.
         else:
           return symbol.entry.st_value # otherwise, the offset is absolute and we don't need it
     return None
 
+  def get_section_range(self, name):
+    section = self.elffile.get_section_by_name(name)
+    if section == None:
+      return None
+    return section.header.sh_addr + self.base_address, section.header.sh_size
+
   def get_writable_memory(self):
     data_section = self.elffile.get_section_by_name(".data") # Just return the start of the .data section
     return data_section.header.sh_addr + self.base_address
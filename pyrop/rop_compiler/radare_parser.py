@@ -14,16 +14,12 @@ class RadareParser(file_parser.FileParser):
       msg = "Could not open %s", filename
       self.logger.critical(msg)
       raise RuntimeError(msg)
-    self.fd = open(filename, "r")
 
     self.b = r_bin.RBin()
     self.b.iobind(io)
     self.b.load(filename, 0, 0, 0, self.desc.fd, False)
     self.baddr = self.b.get_baddr()
 
-  def __del__(self):
-    self.fd.close()
-
   def iter_executable_segments(self):
     """Any iterator that only returns the executable sections in the ELF file"""
     EXECUTABLE_SEGMENT = 0x11
@@ -33,8 +29,7 @@ class RadareParser(file_parser.FileParser):
 
   def get_segment_bytes_address(self, seg):
     """Returns a segments bytes and the address of the segment"""
-    self.fd.seek(seg.paddr)
-    return self.fd.read(seg.size), seg.vaddr + self.base_address
+    return self.get_file_view(seg.paddr, seg.size), seg.vaddr + self.base_address
 
   def get_symbol_address(self, name, recurse_with_imp = True):
     """Returns the address for a symbol, or None if the symbol can't be found"""
@@ -45,6 +40,24 @@ class RadareParser(file_parser.FileParser):
       return self.get_symbol_address("imp.{}".format(name), False)
     return None
 
+  def iter_symbols(self):
+    """An iterator over (name, address) tuples for every symbol in the file"""
+    imports = []
+    for symbol in self.b.get_symbols():
+      yield symbol.name, int(symbol.vaddr) + self.base_address
+      if symbol.name.startswith("imp."):
+        imports.append(symbol)
+
+    # get_symbol_address falls back to the import stub when a symbol isn't defined, so do the same here
+    for symbol in imports:
+      yield symbol.name[len("imp."):], int(symbol.vaddr) + self.base_address
+
+  def get_section_range(self, name):
+    for seg in self.b.get_sections():
+      if seg.name == name:
+        return seg.vaddr + self.base_address, seg.size
+    return None
+
   def get_writable_memory(self):
     WRITABLE_SEGMENT = 0x12
     for seg in self.b.get_sections():
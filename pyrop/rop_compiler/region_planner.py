@@ -0,0 +1,99 @@
+# This file decides the order the regions of a file are scanned in, so that a partial scan finds as many useful gadgets as it can
+import logging, collections, time
+import cPickle as pickle
+import gadget as ga, extra_archinfo
+
+class ScanBudget(object):
+  """This class limits how long a gadget scan may run, by wall time and/or by the number of addresses classified"""
+
+  def __init__(self, max_seconds = None, max_addresses = None):
+    self.max_seconds = max_seconds
+    self.max_addresses = max_addresses
+    self.start_time = None
+    self.addresses = 0
+
+  def consume(self, num_addresses = 1):
+    if self.start_time == None:
+      self.start_time = time.time()
+    self.addresses += num_addresses
+
+  def is_exhausted(self):
+    if self.max_addresses != None and self.addresses >= self.max_addresses:
+      return True
+    return self.max_seconds != None and self.start_time != None and time.time() - self.start_time >= self.max_seconds
+
+class RegionPlanner(object):
+  """This class splits the executable segments of a file into fixed size regions and orders them by how many useful gadgets
+    they're likely to contain.  Regions that produced useful gadgets in a previous scan come first, followed by regions with
+    lots of function epilogues (pops of the registers the goals need, and returns), and sections that are known to be dense in
+    gadgets.  Regions that previously produced no useful gadgets are scanned last."""
+
+  """The size of each region that the executable segments are split into"""
+  REGION_SIZE = 0x1000
+
+  """Sections whose regions are worth scanning early"""
+  HIGH_YIELD_SECTIONS = ['.plt', '.init', '.fini']
+
+  """The highest complexity gadget that counts as useful when recording a region's yield"""
+  USEFUL_COMPLEXITY = 4
+
+  def __init__(self, arch, registers = None, history = None, level = logging.WARNING):
+    self.logger = logging.getLogger(self.__class__.__name__)
+    self.logger.setLevel(level)
+
+    self.arch = arch
+    self.sp = arch.registers['sp'][0]
+    self.registers = set(registers) if registers != None else set()
+    self.history = history if history != None else {} # (file name, segment number, region offset) -> useful gadgets found
+
+    # Byte patterns for returns, and for pops of the registers the goals need
+    self.patterns = [(pattern, 1) for pattern in extra_archinfo.RETURN_PATTERNS[arch.name]]
+    for reg_name, pattern in extra_archinfo.POP_PATTERNS[arch.name].items():
+      if arch.registers[reg_name][0] in self.registers:
+        self.patterns.append((pattern, 4))
+
+  def to_string(self):
+    """Turns the scan history into a pickle'd object, so later scans of the same file can use it"""
+    return pickle.dumps(self.history)
+
+  def load_history(self, data):
+    self.history.update(pickle.loads(data))
+
+  def iter_regions(self, segment_number, data, seg_address):
+    """Splits a segment into regions. Each region is a tuple of (segment number, segment data, segment address, start, end)"""
+    for start in range(0, len(data), self.REGION_SIZE):
+      yield (segment_number, data, seg_address, start, min(start + self.REGION_SIZE, len(data)))
+
+  def score(self, name, region, high_yield_ranges):
+    (segment_number, data, seg_address, start, end) = region
+    key = (name, segment_number, start)
+    if key in self.history: # We've scanned this region before, so we know exactly how useful it is
+      return (2, self.history[key]) if self.history[key] > 0 else (-1, 0)
+
+    region_address = seg_address + start
+    for (range_address, range_size) in high_yield_ranges:
+      if region_address < range_address + range_size and range_address < seg_address + end:
+        return (1, 0)
+
+    code = data[start:end].tobytes()
+    return (0, sum([code.count(pattern) * weight for (pattern, weight) in self.patterns]))
+
+  def order(self, name, regions, high_yield_ranges = None):
+    """Returns the regions sorted so that the most promising ones come first"""
+    if high_yield_ranges == None:
+      high_yield_ranges = []
+    scored = [(self.score(name, region, high_yield_ranges), i, region) for i, region in enumerate(regions)]
+    scored.sort(key = lambda (score, i, region): (score[0], score[1], -i), reverse = True) # Keep file order for ties
+    return [region for (score, i, region) in scored]
+
+  def is_useful(self, gadget):
+    if gadget.complexity() > self.USEFUL_COMPLEXITY:
+      return False
+    return (isinstance(gadget, ga.StoreMem) or isinstance(gadget, ga.Jump)
+      or (isinstance(gadget, ga.LoadMem) and gadget.inputs[0] == self.sp)
+      or any([reg in self.registers for reg in gadget.outputs]))
+
+  def record(self, name, region, num_useful):
+    """Records how many useful gadgets (see is_useful) a region produced, for ordering later scans"""
+    (segment_number, data, seg_address, start, end) = region
+    self.history[(name, segment_number, start)] = num_useful
@@ -0,0 +1,47 @@
+# This file contains a graph of the ways to move a value from one register to another with MoveReg gadgets.  When there
+# isn't a gadget that loads a register directly, the GadgetList loads some other register and moves the value over, possibly
+# through several other registers.  Rather than searching the MoveReg gadgets for each request, the cheapest path into each
+# register is found once, and again only for the sets of registers that the moves aren't allowed to clobber.
+import collections, heapq, itertools
+import stats
+
+class RegisterGraph(object):
+  """This class holds a directed graph with an edge from each MoveReg gadget's input register to its output register,
+    weighted by the gadget's complexity.  The cheapest paths between every pair of registers are found when the graph is
+    created, since most requests don't have to avoid clobbering any registers."""
+
+  def __init__(self, moves):
+    self.incoming = collections.defaultdict(list) # register -> (source register, move gadget, complexity) for the edges into it
+    for move in moves:
+      (source, destination) = (move.inputs[0], move.outputs[0])
+      if source != destination:
+        self.incoming[destination].append((source, move, move.complexity()))
+
+    self.paths = {} # (register, registers that can't be clobbered) -> see find_paths_to
+    for register in self.incoming.keys():
+      self.paths[(register, frozenset())] = self.find_paths_to(register, frozenset())
+
+  def paths_to(self, register, no_clobbers = None):
+    """Returns a dictionary of source register -> (complexity, list of move gadgets) for the cheapest way to move a value from
+      each register that can reach the given register, without using any gadgets that clobber the no_clobbers registers"""
+    key = (register, frozenset(no_clobbers if no_clobbers != None else []))
+    if key not in self.paths:
+      self.paths[key] = self.find_paths_to(register, key[1])
+    return self.paths[key]
+
+  def find_paths_to(self, register, no_clobbers):
+    """Runs Dijkstra's algorithm backwards from the register, along the edges whose gadgets don't clobber the registers"""
+    stats.increment("register_graph.paths_searched")
+    paths = {}
+    tie_breaker = itertools.count() # Keeps equally complex paths in the order they're found
+    heap = [(0, next(tie_breaker), register, [])]
+    while len(heap) != 0:
+      (complexity, tie, current, moves) = heapq.heappop(heap)
+      if current in paths:
+        continue
+      paths[current] = (complexity, moves)
+      for (source, move, move_complexity) in self.incoming.get(current, []):
+        if source not in paths and (len(no_clobbers) == 0 or not move.clobbers_registers(no_clobbers)):
+          heapq.heappush(heap, (complexity + move_complexity, next(tie_breaker), source, [move] + moves))
+    del paths[register]
+    return paths
@@ -0,0 +1,81 @@
+# This file limits how many gadgets are kept from a file, so the gadgets for many large files can be held in memory at once
+import logging, collections, bisect
+import gadget as ga, stats
+
+class RetentionPolicy(object):
+  """This class keeps only the best few gadgets for each (type, inputs, outputs) signature (plus the params, for gadgets
+    that load or add a constant).  The scheduler only ever uses the lowest complexity gadgets for a signature, so the rest
+    just take up memory and slow down the searches.  Gadgets are ranked by whether their address is free of bad bytes, then
+    by complexity.  Gadgets that do exactly the same thing as a kept gadget are recorded as its aliases, rather than taking
+    up one of the signature's slots."""
+
+  """The default number of gadgets to keep for each signature"""
+  MAX_PER_SIGNATURE = 4
+
+  """The gadget types whose params are the values they produce, so gadgets with different params aren't interchangeable"""
+  VALUE_GADGET_TYPES = (ga.LoadConst, ga.ArithmeticConst)
+
+  def __init__(self, max_per_signature = None, bad_bytes = None, level = logging.WARNING):
+    self.logger = logging.getLogger(self.__class__.__name__)
+    self.logger.setLevel(level)
+
+    self.max_per_signature = max_per_signature if max_per_signature != None else self.MAX_PER_SIGNATURE
+    self.bad_bytes = bad_bytes
+    self.kept = collections.OrderedDict() # (type, inputs, outputs) -> sorted list of (rank, gadget number, gadget)
+    self.representatives = {}             # gadget.signature() -> the kept gadget with that signature
+    self.num_gadgets = 0
+    self.dropped = collections.defaultdict(int) # gadget type name -> number of gadgets dropped
+
+  def rank(self, gadget):
+    has_bad_address = self.bad_bytes != None and not gadget.avoid_bad_bytes(self.bad_bytes)
+    return (has_bad_address, gadget.complexity())
+
+  def add_gadget(self, gadget):
+    """Considers a gadget for retention.  Returns whether it was kept"""
+    self.num_gadgets += 1
+    full_signature = gadget.signature()
+    if full_signature != None and full_signature in self.representatives:
+      representative = self.representatives[full_signature]
+      if representative is not gadget:
+        representative.add_aliases(gadget.all_addresses())
+      return True
+
+    signature = (gadget.__class__, gadget.inputs, gadget.outputs)
+    if isinstance(gadget, self.VALUE_GADGET_TYPES):
+      signature += (gadget.params,)
+    if signature not in self.kept:
+      self.kept[signature] = []
+    kept = self.kept[signature]
+    entry = (self.rank(gadget), self.num_gadgets, gadget) # The gadget number keeps the order stable for equal ranks
+    if len(kept) >= self.max_per_signature and entry >= kept[-1]:
+      self.drop(gadget)
+      return False
+
+    bisect.insort(kept, entry)
+    if full_signature != None:
+      self.representatives[full_signature] = gadget
+    if len(kept) > self.max_per_signature:
+      (rank, number, worst) = kept.pop()
+      self.representatives.pop(worst.signature(), None)
+      self.drop(worst)
+    return True
+
+  def add_gadgets(self, gadgets):
+    for gadget in gadgets:
+      self.add_gadget(gadget)
+
+  def drop(self, gadget):
+    name = gadget.__class__.__name__
+    self.dropped[name] += 1
+    stats.increment("retention.dropped." + name)
+
+  def gadgets(self):
+    """Returns the kept gadgets"""
+    return [gadget for kept in self.kept.values() for (rank, number, gadget) in kept]
+
+  def num_dropped(self):
+    return sum(self.dropped.values())
+
+  def log_summary(self, name):
+    self.logger.debug("Kept %d of %d gadgets from %s (dropped %s)", self.num_gadgets - self.num_dropped(), self.num_gadgets,
+      name, ", ".join(["{} {}".format(count, type_name) for type_name, count in sorted(self.dropped.items())]) or "none")
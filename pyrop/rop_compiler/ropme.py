@@ -1,9 +1,17 @@
 # This file contains a few convenience methods that wrap the ROP compiling process that can be used by exploit scripts.
-import logging
-import archinfo
-import goal, scheduler, multifile_handler, gadget
+import logging, time, traceback, multiprocessing, os
+import goal, scheduler, multifile_handler, gadget, sufficiency, region_planner, template, scan_cache as sc, utils
+import stats as pipeline_stats
 
-def rop(files, libraries, goal_list, arch = archinfo.ArchAMD64(), log_level = logging.WARNING, validate_gadgets = False, strategy = None, bad_bytes = None):
+archinfo = utils.LazyModule("archinfo") # Slow to import, and only needed when the caller doesn't give an arch
+
+def get_arch(arch):
+  """Returns the arch to compile for, which defaults to AMD64"""
+  return arch if arch != None else archinfo.ArchAMD64()
+
+def rop(files, libraries, goal_list, arch = None, log_level = logging.WARNING, validate_gadgets = False, strategy = None, bad_bytes = None,
+    stop_early = False, prioritize = False, scan_budget = None, stats = None, max_gadgets_per_signature = None,
+    scan_cache_file = None, gadget_list_type = None, planner_history_file = None):
   """Takes a goal resolver and creates a rop chain for it.  The arguments are as follows:
   $files - a list of tuples of the form (binary filename, gadget filename, load address).  The binary filename is the name of the
     file to generate a ROP chain for.  The gadget filename is a file that has been previously generated which contains the previously
@@ -12,7 +20,7 @@ def rop(files, libraries, goal_list, arch = archinfo.ArchAMD64(), log_level = lo
   $libraries - a list of path's to the libraries to resolve symbols in.  Primarily this is useful for libc.  This list differs from
     the files list in that the entries in this list will not be used to find gadgets (and thus their address is not needed).
   $goal_list - a list of goals to attempt to compile a ROP chain for.  See goal.py for the format of the items in this list.
-  $arch - the archinfo class representing the architecture of the binary
+  $arch - the archinfo class representing the architecture of the binary, or None for AMD64
   $log_level - the level of logging to display during the ROP compiling process.  Note that pyvex logs a large amount of info to
     stderr during the compilation process and will not be affected by this value (sorry).
   $validate_gadgets - whether the gadgets should be verified using z3.  While this ensures that the ROP chain will work as expected,
@@ -21,17 +29,166 @@ def rop(files, libraries, goal_list, arch = archinfo.ArchAMD64(), log_level = lo
     gadget that matches the desired type, BEST scans the found gadgets for the best one that matches the desired type, and MEDIUM
     is a compromise between the two.  In practice, the default (MEDIUM) should work for most things.
   $bad_bytes - a list of strings that a gadget will be rejected for if it contains them
+  $stop_early - whether to stop searching for gadgets as soon as the gadgets needed for the goals have been found, rather than
+    scanning the entire file.  This makes compiling against large libraries much faster, at the cost of possibly missing
+    better gadgets later in the file.
+  $prioritize - whether to scan the regions of the files most likely to contain the needed gadgets first, rather than scanning
+    the files in order.  This is most useful combined with stop_early or scan_budget.
+  $scan_budget - the maximum number of seconds to spend scanning the files for gadgets, or None to scan them completely
+  $max_gadgets_per_signature - the number of gadgets to keep from each file for each combination of gadget type, input
+    registers, and output registers (the lowest complexity ones are kept), or None to keep them all.  This bounds the memory
+    used for large libraries.
+  $stats - a dictionary to fill in with the counters and timings collected while compiling (see stats.py), or None to not
+    collect them.  Collecting them adds a small amount of overhead.
+  $scan_cache_file - a file holding the gadgets found in each page of a previous scan (see scan_cache.py), or None.  Pages of
+    the files that haven't changed since that scan (e.g. in a new build of the same program) reuse the saved gadgets rather
+    than being scanned again.  The file is created if it doesn't exist, and updated with the pages of this scan.
+  $planner_history_file - a file holding how many useful gadgets each region of the files produced in previous scans, or
+    None.  When prioritize is set, the regions that produced useful gadgets before are scanned first, and the ones that
+    didn't are scanned last.  The file is created if it doesn't exist, and updated with the regions scanned in this run.
+  $gadget_list_type - the kind of GadgetList to search the gadgets with (see factories.py), or None for the default.  The
+    "columnar" gadget list stores the gadgets in numpy arrays, which makes searching large sets of gadgets much faster.
   """
-  file_handler = multifile_handler.MultifileHandler(files, libraries, arch, log_level)
+  if stats != None:
+    stats_state = pipeline_stats.start_collection()
+  try:
+    return compile_goals(files, libraries, goal_list, get_arch(arch), log_level, validate_gadgets, strategy, bad_bytes,
+      stop_early, prioritize, scan_budget, max_gadgets_per_signature, scan_cache_file = scan_cache_file,
+      gadget_list_type = gadget_list_type, planner_history_file = planner_history_file)
+  finally:
+    if stats != None:
+      stats.update(pipeline_stats.finish_collection(stats_state))
+
+def compile_goals(files, libraries, goal_list, arch, log_level, validate_gadgets, strategy, bad_bytes, stop_early, prioritize,
+    scan_budget, max_gadgets_per_signature, file_handler = None, gadgets = None, search_state = None, scan_cache_file = None,
+    gadget_list_type = None, planner_history_file = None):
+  """Compiles the goals into a ROP chain (see rop for the arguments).  A previously created file handler, gadget list, and
+    scheduler search state (for that gadget list) can be passed in to skip parsing the files and finding the gadgets again."""
+  if file_handler == None:
+    file_handler = multifile_handler.MultifileHandler(files, libraries, arch, log_level, gadget_list_type = gadget_list_type)
   goal_resolver = goal.GoalResolver(file_handler, goal_list, log_level)
 
-  gadgets = file_handler.find_gadgets(validate_gadgets, bad_bytes)
+  if gadgets == None:
+    oracle = planner = budget = None
+    if stop_early or prioritize:
+      oracle = sufficiency.SufficiencyOracle.from_goals(goal_resolver.get_goals(), arch, file_handler, level = log_level)
+    if prioritize:
+      planner = region_planner.RegionPlanner(arch, oracle.registers, level = log_level)
+      if planner_history_file != None and os.path.exists(planner_history_file):
+        planner.load_history(open(planner_history_file, "rb").read())
+    if scan_budget != None:
+      budget = region_planner.ScanBudget(max_seconds = scan_budget)
+    scan_cache = None
+    if scan_cache_file != None:
+      scan_cache = sc.ScanCache(log_level)
+      if os.path.exists(scan_cache_file):
+        scan_cache.load(open(scan_cache_file, "rb").read())
+    gadgets = file_handler.find_gadgets(validate_gadgets, bad_bytes, oracle if stop_early else None, planner, budget,
+      max_gadgets_per_signature, scan_cache)
+    if scan_cache != None:
+      fd = open(scan_cache_file, "wb")
+      fd.write(scan_cache.to_string())
+      fd.close()
+    if planner != None and planner_history_file != None:
+      fd = open(planner_history_file, "wb")
+      fd.write(planner.to_string())
+      fd.close()
   if strategy != None:
     gadgets.set_strategy(strategy)
-  gadget_scheduler = scheduler.Scheduler(gadgets, goal_resolver, file_handler, arch, log_level, bad_bytes)
+  gadget_scheduler = scheduler.Scheduler(gadgets, goal_resolver, file_handler, arch, log_level, bad_bytes, search_state)
   return gadget_scheduler.get_chain()
 
-def rop_to_shellcode(files, libraries, shellcode_address, arch = archinfo.ArchAMD64(), log_level = logging.WARNING, validate_gadgets = False, bad_bytes = None):
+"""How far each file is moved (times its position in the files list, plus one) for the second compile of rop_template"""
+TEMPLATE_PROBE_SHIFT = 0x1000000
+
+def rop_template(files, libraries, goal_list, arch = None, log_level = logging.WARNING, validate_gadgets = False,
+    strategy = None, bad_bytes = None, max_gadgets_per_signature = None):
+  """Compiles the goals into a relocatable ChainTemplate (see template.py), which can be instantiated for new base addresses
+  of the files without compiling the chain again.  The arguments are the same as rop.  The chain is compiled for the base
+  addresses in the files list, and again with each file moved by a different amount, and the words that moved are the ones
+  that get relocated.  Raises a RuntimeError if the chain can't be made relocatable (e.g. when the gadgets that get chosen
+  depend on the base addresses).
+  """
+  arch = get_arch(arch)
+  file_handler = multifile_handler.MultifileHandler(files, libraries, arch, log_level)
+  gadgets = file_handler.find_gadgets(validate_gadgets, bad_bytes, max_per_signature = max_gadgets_per_signature)
+  search_state = scheduler.SearchState()
+  bases = list(file_handler.base_addresses)
+  probe_bases = [base + (TEMPLATE_PROBE_SHIFT * (i + 1)) for i, base in enumerate(bases)]
+
+  chains = []
+  for base_addresses in [bases, probe_bases]:
+    file_handler.rebase(base_addresses)
+    chain = compile_goals(files, libraries, goal_list, arch, log_level, validate_gadgets, strategy, bad_bytes, False, False,
+      None, None, file_handler, gadgets, search_state)
+    if chain == None:
+      return None
+    chains.append(chain)
+  file_handler.rebase(bases)
+  return template.ChainTemplate.from_probes(arch, chains[0], bases, chains[1], probe_bases)
+
+# The state shared with the worker processes of rop_batch, which inherit it when they're forked
+batch_state = None
+
+def rop_batch(files, libraries, goal_lists, arch = None, log_level = logging.WARNING, validate_gadgets = False,
+    strategy = None, bad_bytes = None, max_gadgets_per_signature = None, processes = None, collect_stats = False):
+  """Compiles a ROP chain for each of several lists of goals against the same files.  The files are parsed and their gadgets
+  are found once, and the gadget searches are shared between the goal lists.  The arguments are the same as rop, except:
+  $goal_lists - a list of goal lists, each of which is compiled into its own ROP chain
+  $processes - the number of processes to compile the goal lists in, or None to compile them all in this process.  The first
+    goal list is always compiled in this process, so that the worker processes start with the shared searches already done.
+  $collect_stats - whether to collect the counters and timings for each goal list (see stats.py)
+  Returns a list with a dictionary for each goal list, with the chain (or None), the time taken, the error if the chain
+  couldn't be compiled, and the stats if they were collected.
+  """
+  global batch_state
+  if len(goal_lists) == 0:
+    return []
+  arch = get_arch(arch)
+  file_handler = multifile_handler.MultifileHandler(files, libraries, arch, log_level)
+  gadgets = file_handler.find_gadgets(validate_gadgets, bad_bytes, max_per_signature = max_gadgets_per_signature)
+  if strategy != None:
+    gadgets.set_strategy(strategy)
+  batch_state = (files, libraries, goal_lists, arch, log_level, validate_gadgets, bad_bytes, file_handler, gadgets,
+    scheduler.SearchState(), collect_stats)
+
+  try:
+    results = [compile_batch_goals(0)]
+    if processes == None or processes <= 1 or len(goal_lists) <= 2:
+      results += [compile_batch_goals(i) for i in range(1, len(goal_lists))]
+    else:
+      pool = multiprocessing.Pool(processes)
+      try:
+        results += pool.map(compile_batch_goals, range(1, len(goal_lists)))
+      finally:
+        pool.close()
+        pool.join()
+  finally:
+    batch_state = None
+  return results
+
+def compile_batch_goals(index):
+  """Compiles one of the goal lists from rop_batch"""
+  (files, libraries, goal_lists, arch, log_level, validate_gadgets, bad_bytes, file_handler, gadgets, search_state,
+    collect_stats) = batch_state
+  result = {}
+  if collect_stats:
+    stats_state = pipeline_stats.start_collection()
+  start = time.time()
+  try:
+    result["chain"] = compile_goals(files, libraries, goal_lists[index], arch, log_level, validate_gadgets, None, bad_bytes,
+      False, False, None, None, file_handler, gadgets, search_state)
+  except Exception as e:
+    result["chain"] = None
+    result["error"] = "{}: {}".format(e.__class__.__name__, e)
+    logging.getLogger("rop_batch").debug(traceback.format_exc())
+  finally:
+    result["time"] = time.time() - start
+    if collect_stats:
+      result["stats"] = pipeline_stats.finish_collection(stats_state)
+  return result
+
+def rop_to_shellcode(files, libraries, shellcode_address, arch = None, log_level = logging.WARNING, validate_gadgets = False, bad_bytes = None):
   """Convience method to create a goal_resolver for a shellcode address goal then find a rop chain for it"""
   goal_list = [["shellcode", hex(shellcode_address)]]
   return rop(files, libraries, goal_list, arch, log_level, validate_gadgets, bad_bytes)
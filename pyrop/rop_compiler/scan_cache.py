@@ -0,0 +1,118 @@
+# This file lets a scan of a new version of a file reuse the gadgets found when scanning a previous version.  The executable
+# segments are split into pages, and each page's gadgets are saved along with a hash of its contents.  When a later scan comes
+# across a page with the same contents (at the same address or not), the saved gadgets are moved to the page's new address
+# rather than classifying every address in it again.  Only the pages that changed need to be classified.
+import logging, hashlib, copy, os
+import cPickle as pickle
+import gadget as ga, extra_archinfo, finder
+
+class ScanCache(object):
+  """This class holds the gadgets found in each page of the previously scanned files, keyed by the page's contents.  A page is
+    hashed along with the MAX_GADGET_SIZE bytes after it, since the gadgets at the end of a page include those bytes.
+
+    Rather than splitting the segments at fixed offsets, each page ends just after the first return instruction that's at least
+    PAGE_SIZE bytes into it.  That way, when a build inserts or removes code, the pages after the change still start at the same
+    instructions as before, and only the pages around the change hash differently.
+
+    Each page is saved with the name of the file it was found in (without the directory, since each build of a program is
+    usually in a different one).  Once a scan has looked at every page of a file, the file's pages from the previous scans are
+    dropped, so the cache only holds the pages of the latest build of each file rather than every page that was ever seen."""
+
+  """The minimum size of a page"""
+  PAGE_SIZE = 0x1000
+
+  """The maximum size of a page, for code that doesn't have any returns in it"""
+  MAX_PAGE_SIZE = 0x4000
+
+  """The gadget types whose params can depend on the gadget's address (e.g. a pc relative lea), so they're classified again
+    when a page is reused at a different address"""
+  ADDRESS_DEPENDENT_TYPES = (ga.LoadConst, ga.ArithmeticConst)
+
+  def __init__(self, level = logging.WARNING):
+    self.logger = logging.getLogger(self.__class__.__name__)
+    self.logger.setLevel(level)
+
+    self.previous = {} # page hash -> (page address, pickle'd gadgets, file name) from the previous scans
+    self.current = {}  # page hash -> (page address, pickle'd gadgets, file name) from this scan
+    self.completed = set() # The names of the files that this scan looked at every page of
+
+  def to_string(self):
+    """Turns the pages into a pickle'd object, so the next scan can reuse them.  The pages from the previous scans are kept for
+      the files that this scan didn't look at every page of (e.g. it stopped early, or the gadgets came from a gadget file)."""
+    pages = {key : page for key, page in self.previous.items() if page[2] not in self.completed}
+    pages.update(self.current)
+    return pickle.dumps(pages, pickle.HIGHEST_PROTOCOL)
+
+  def load(self, data):
+    for key, page in pickle.loads(data).items():
+      if len(page) == 3: # Pages saved before they recorded their file can't be dropped, so they're just scanned again
+        self.previous[key] = page
+
+  def file_name(self, name):
+    return os.path.basename(name) if name != None else None
+
+  def complete(self, name):
+    """Records that this scan looked at every page of a file (without skipping any addresses)"""
+    self.completed.add(self.file_name(name))
+
+  def get_scan(self):
+    """Returns the pages and completed files of this scan, e.g. to send them back from a worker process to add_scan"""
+    return (self.current, self.completed)
+
+  def add_scan(self, scan):
+    (pages, completed) = scan
+    self.current.update(pages)
+    self.completed.update(completed)
+
+  def split_pages(self, arch, data, start, end):
+    """Splits the range [start, end) of a segment into pages, returned as a list of (start, end) tuples"""
+    patterns = extra_archinfo.RETURN_PATTERNS[arch.name]
+    alignment = arch.instruction_alignment
+    code = data[start:end].tobytes()
+    pages = []
+    page_start = start
+    while page_start < end:
+      search_start = page_start - start + self.PAGE_SIZE
+      page_end = page_start + self.MAX_PAGE_SIZE
+      for pattern in patterns:
+        offset = code.find(pattern, search_start)
+        if offset != -1:
+          page_end = min(page_end, start + offset + len(pattern))
+      page_end = min(((page_end + alignment - 1) / alignment) * alignment, end)
+      pages.append((page_start, page_end))
+      page_start = page_end
+    return pages
+
+  def page_key(self, arch, data, start, end, validate):
+    """Returns the hash of a page's contents, plus the bytes after it that the gadgets at the end of the page can use"""
+    hasher = hashlib.sha1("{}:{}:{}:".format(arch.name, arch.memory_endness, bool(validate)))
+    hasher.update(data[start:end + finder.Finder.MAX_GADGET_SIZE[arch.name]].tobytes())
+    return hasher.digest()
+
+  def lookup(self, key, page_address, name = None):
+    """Returns the gadgets found in a page with the same contents in a previous scan, moved to this page's address, along with
+      the addresses of any gadgets that need to be classified again.  Returns (None, None) if the page hasn't been seen."""
+    if key not in self.previous:
+      return (None, None)
+    (old_address, data, old_name) = self.previous[key]
+    self.current[key] = (old_address, data, self.file_name(name)) # The saved gadgets are still at the old address
+    gadgets = pickle.loads(data)
+    address_offset = page_address - old_address
+    if address_offset == 0:
+      return (gadgets, [])
+
+    stale = set([gadget.address for gadget in gadgets if isinstance(gadget, self.ADDRESS_DEPENDENT_TYPES)])
+    reused = []
+    for gadget in gadgets:
+      if gadget.address not in stale:
+        gadget.adjust_base_address(address_offset)
+        reused.append(gadget)
+    return (reused, sorted([address + address_offset for address in stale]))
+
+  def snapshot(self, gadgets):
+    """Copies newly found gadgets, so that any later changes to them (e.g. adding aliases) don't end up in the cache"""
+    return [copy.copy(gadget) for gadget in gadgets]
+
+  def record(self, key, page_address, gadgets, name = None):
+    """Saves the gadgets found in a page (as returned by snapshot) of the named file"""
+    self.current[key] = (page_address, pickle.dumps(gadgets, pickle.HIGHEST_PROTOCOL), self.file_name(name))
@@ -1,16 +1,24 @@
 # This file contains the logic to combine a set of gadgets and implement the desired goals
 import struct, logging, collections
-import archinfo
-import goal as go, gadget as ga, utils, extra_archinfo
+import goal as go, gadget as ga, utils, extra_archinfo, stats, chain as cm
 
 PAGE_MASK = 0xfffffffffffff000
 PROT_RWX = 7
 
+class SearchState(object):
+  """This class holds the results of the gadget searches that don't depend on the goals, so that they can be shared by the
+    schedulers for several sets of goals that are compiled with the same gadget list"""
+
+  def __init__(self):
+    self.write_memory_chains = None
+    self.store_mem_gadgets = collections.defaultdict(dict)
+
 class Scheduler(object):
   """This class takes a set of gadgets and combines them together to implement the given goals"""
 
-  def __init__(self, gadget_list, goal_resolver, file_handler, arch, level = logging.WARNING, bad_bytes = None):
-    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+  def __init__(self, gadget_list, goal_resolver, file_handler, arch, level = logging.WARNING, bad_bytes = None,
+      search_state = None):
+    utils.configure_logging()
     self.logger = logging.getLogger(self.__class__.__name__)
     self.logger.setLevel(level)
 
@@ -19,11 +27,11 @@ class Scheduler(object):
     self.gadget_list = gadget_list
     self.file_handler = file_handler
 
-    self.write_memory_chains = None
-    self.store_mem_gadgets = collections.defaultdict(dict)
+    self.search_state = search_state if search_state != None else SearchState()
     self.alignment = self.arch.bits / 8
 
     self.chain = None
+    self.chain_ir = None # The chain as a Chain (see chain.py), which can be dumped with annotations for debugging
     self.goals = goal_resolver.get_goals()
     self.writable_memory = self.file_handler.get_writable_memory()
 
@@ -54,7 +62,12 @@ class Scheduler(object):
   def get_chain(self):
     """Returns the compiled ROP chain"""
     if self.chain == None:
-      self.chain = self.chain_gadgets()
+      start = stats.start_timer()
+      self.chain_ir = self.chain_gadgets()
+      self.chain = self.chain_ir.to_string()
+      stats.stop_timer("scheduler.chain_gadgets", start)
+      if self.logger.isEnabledFor(logging.DEBUG):
+        self.logger.debug("Compiled chain:\n%s", self.chain_ir.dump())
     return self.chain
 
   def print_gadgets(self, caption, gadgets):
@@ -64,8 +77,8 @@ class Scheduler(object):
 
   def find_store_mem_gadgets(self, addr_reg, value_reg):
     """This method finds a gadget that writes the value in one register to the address in another"""
-    if value_reg in self.store_mem_gadgets[addr_reg]:
-      return self.store_mem_gadgets[addr_reg][value_reg]
+    if value_reg in self.search_state.store_mem_gadgets[addr_reg]:
+      return self.search_state.store_mem_gadgets[addr_reg][value_reg]
 
     best = None
     for gadget in self.gadget_list.foreach_type(ga.StoreMem):
@@ -74,7 +87,7 @@ class Scheduler(object):
         and (best == None or best.complexity() > gadget.complexity())): # and it's got a better complexity than the current one
           best = gadget
 
-    self.store_mem_gadgets[addr_reg][value_reg] = best
+    self.search_state.store_mem_gadgets[addr_reg][value_reg] = best
     if best != None:
       self.logger.debug("Found StoreMem(%s, %s) Gadget:%s", self.reg_name(addr_reg), self.reg_name(value_reg), best)
     return best
@@ -94,7 +107,7 @@ class Scheduler(object):
   def find_write_memory_gadgets(self):
     """This method determines a set of gadget sequences that will write a value to memory"""
 
-    self.write_memory_chains = []
+    self.search_state.write_memory_chains = []
     for addr_reg in self.get_all_registers():
       # First find a gadget to set the address register
       load_addr_gadget = self.gadget_list.find_load_stack_gadget(addr_reg)
@@ -115,16 +128,16 @@ class Scheduler(object):
         if store_mem_gadget != None:
           chain = [load_addr_gadget, load_value_gadget, store_mem_gadget]
           complexity = self.combined_complexity(chain)
-          self.write_memory_chains.append((chain, complexity))
+          self.search_state.write_memory_chains.append((chain, complexity))
 
   def get_write_memory_gadget(self, avoid_registers = None):
     """This method iterates over write_memory_chains and finds the best gadget chain to write memory with, while excluding any
       specified registers"""
-    if self.write_memory_chains == None:
+    if self.search_state.write_memory_chains == None:
       self.find_write_memory_gadgets()
 
     best = best_complexity = None
-    for (chain, complexity) in self.write_memory_chains:
+    for (chain, complexity) in self.search_state.write_memory_chains:
       if best_complexity == None or best_complexity > complexity:
         if avoid_registers == None or not self.chain_clobbers_registers(chain, avoid_registers):
           best_complexity = complexity
@@ -158,7 +171,7 @@ class Scheduler(object):
       ",".join([hex(x) if type(x)!=str else x for x in goal.arguments]), hex(end_address) if end_address != None else end_address)
 
     # Holds the ROP chain generated throughout the function
-    chain = ""
+    chain = cm.Chain(self.arch)
 
     # Resolve any string arguments to where we're going to write those arguments too
     argument_strings = {}
@@ -176,22 +189,22 @@ class Scheduler(object):
     # Get a chain to set all the registers
     first_address = goal.address
     if len(register_values) != 0:
-      chain, first_address = self.gadget_list.create_load_registers_chain(goal.address, self.sp, register_values)
+      chain, first_address = self.gadget_list.build_load_registers_chain(goal.address, self.sp, register_values)
       if chain == None:
         return None, None
 
     # Add the function's address (and the LR gadget to set the gadget after this function if this architecture requires it)
     if 'lr' not in self.arch.registers and end_address != None:
-      chain += utils.ap(end_address, self.arch)
+      chain.add_address(end_address, "return address of " + goal.name)
 
     # Add the stack arguments
     for arg in stack_arguments:
-      chain += utils.ap(arg, self.arch)
+      chain.add_value(arg, "stack argument of " + goal.name)
 
     # Write any string arguments to memory
     for arg, address in argument_strings.items():
       arg_chain, first_address = self.create_write_memory_chain(arg, address, first_address, "\x00")
-      chain = arg_chain + chain
+      chain.prepend(arg_chain)
 
     return (chain, first_address)
 
@@ -255,9 +268,9 @@ class Scheduler(object):
 
       # Create a chain to set all the registers, while avoiding clobbering our jump register
       if len(register_values) != 0:
-        arg_chain, arg_chain_address = self.gadget_list.create_load_registers_chain(jump_gadget.address, self.sp, register_values, [jump_reg])
+        arg_chain, arg_chain_address = self.gadget_list.build_load_registers_chain(jump_gadget.address, self.sp, register_values, [jump_reg])
       else:
-        arg_chain, arg_chain_address = "", jump_gadget.address
+        arg_chain, arg_chain_address = cm.Chain(self.arch), jump_gadget.address
 
       if arg_chain != None:
         break
@@ -271,20 +284,21 @@ class Scheduler(object):
       [set_read_addr_gadget, read_gadget, set_add_reg_gadget, add_jump_reg_gadget, jump_gadget])
 
     # Build the chain
-    chain = set_read_addr_gadget.chain(read_gadget.address, [address - read_gadget.params[0]]) # set the read address
-    chain += read_gadget.chain(set_add_reg_gadget.address)                                     # read the address in the GOT
-    chain += set_add_reg_gadget.chain(add_jump_reg_gadget.address, [offset])                   # set the offset from the base to the target
-    chain += add_jump_reg_gadget.chain(arg_chain_address)                                      # add the offset
-    chain += arg_chain                                                                         # set the arguments for the function
+    chain = cm.Chain(self.arch)
+    set_read_addr_gadget.add_to_chain(chain, read_gadget.address, [address - read_gadget.params[0]]) # set the read address
+    read_gadget.add_to_chain(chain, set_add_reg_gadget.address)                                      # read the address in the GOT
+    set_add_reg_gadget.add_to_chain(chain, add_jump_reg_gadget.address, [offset])                    # set the offset from the base to the target
+    add_jump_reg_gadget.add_to_chain(chain, arg_chain_address)                                       # add the offset
+    chain.extend(arg_chain)                                                                          # set the arguments for the function
 
     # Add the jump to the function, and the stack based return address (if this architecture uses it)
-    chain += jump_gadget.chain()
+    jump_gadget.add_to_chain(chain)
     if 'lr' not in self.arch.registers and end_address != None:
-      chain += utils.ap(end_address, self.arch)
+      chain.add_address(end_address, "return address")
 
     # Last, add the stack arguments
     for arg in stack_arguments:
-      chain += utils.ap(arg, self.arch)
+      chain.add_value(arg, "stack argument")
 
     return (chain, set_read_addr_gadget.address)
 
@@ -340,11 +354,12 @@ class Scheduler(object):
     load_addr_gadget, load_value_gadget, store_mem_gadget = self.get_write_memory_gadget()
 
     # Next create the chain to setup the address and value to be written
-    chain = load_addr_gadget.chain(load_value_gadget.address, [address - store_mem_gadget.params[0]])
-    chain += load_value_gadget.chain(store_mem_gadget.address, [buf])
+    chain = cm.Chain(self.arch)
+    load_addr_gadget.add_to_chain(chain, load_value_gadget.address, [address - store_mem_gadget.params[0]])
+    load_value_gadget.add_to_chain(chain, store_mem_gadget.address, [buf])
 
     # Finally, create the chain to write to memory
-    chain += store_mem_gadget.chain(next_address)
+    store_mem_gadget.add_to_chain(chain, next_address)
 
     return (chain, load_addr_gadget.address)
 
@@ -355,13 +370,13 @@ class Scheduler(object):
 
   def create_write_memory_chain(self, buf, address, next_address, padding = "K"):
     """This function returns a ROP chain implemented to write a buffer to a given address"""
-    chain = ""
+    chain = cm.Chain(self.arch)
     addr = address
     buf = self.align_to_8bytes(buf, padding)
     for i in range(0, len(buf), self.alignment):
       # Iteratively create the ROP chain for each byte chunk of the buffer
       single_write_chain, next_address = self.create_write_regsize_memory_chain(buf[i:i+self.alignment], addr, next_address)
-      chain = single_write_chain + chain
+      chain.prepend(single_write_chain)
       addr += self.alignment
     return chain, next_address
 
@@ -378,7 +393,7 @@ class Scheduler(object):
     chain, next_address = self.create_write_memory_chain(goal.shellcode, shellcode_address, next_address)
 
     # Combine the two to write our shellcode to memory and execute it
-    return (chain + shellcode_chain), next_address
+    return chain.extend(shellcode_chain), next_address
 
   def create_execve_chain(self, goal):
     """This function returns a ROP chain implemented for a ExecveGoal.  It first writes the arguments for execve, then calls
@@ -391,28 +406,29 @@ class Scheduler(object):
     function_goal = go.FunctionGoal(goal.name, goal.address, [argument_addresses[0], argv_address, 0])
     function_chain, next_address = self.create_function_chain(function_goal, 0x4444444444444444)
 
-    chain = ""
+    chain = cm.Chain(self.arch)
     for i in range(len(argument_addresses)):
       packed_args_address = utils.ap(argument_addresses[i], self.arch)
       argv_chain, next_address = self.create_write_memory_chain(packed_args_address, argv_address, next_address, "\x00")
       argv_address += len(packed_args_address)
-      chain = argv_chain + chain
+      chain.prepend(argv_chain)
 
     null_chain, next_address = self.create_write_memory_chain("\x00", argv_address, next_address, "\x00")
-    chain = null_chain + chain
+    chain.prepend(null_chain)
 
     for i in range(len(goal.arguments)):
       arg_chain, next_address = self.create_write_memory_chain(goal.arguments[i], argument_addresses[i], next_address, "\x00")
-      chain = arg_chain + chain
+      chain.prepend(arg_chain)
 
-    return (chain + function_chain), next_address
+    return chain.extend(function_chain), next_address
 
   def chain_gadgets(self):
     """This function returns a ROP chain implemented for the given goals."""
-    chain = ""
+    chain = cm.Chain(self.arch)
     next_address = 0x4444444444444444
     for i in range(len(self.goals) - 1, -1, -1):
       goal = self.goals[i]
+      stats.increment("scheduler.goals")
       if type(goal) == go.FunctionGoal:
         goal_chain, next_address = self.create_function_chain(goal, next_address)
         self.logger.debug("Function call to %s's first gadget is at 0x%x", goal.name, next_address)
@@ -428,7 +444,9 @@ class Scheduler(object):
       if goal_chain == None:
         raise RuntimeError("Unable to create goal: {}".format(goal))
 
-      chain = goal_chain + chain
+      chain.prepend(goal_chain)
 
-    return utils.ap(next_address, self.arch) + chain
+    first_address = cm.Chain(self.arch)
+    first_address.add_address(next_address, "first gadget")
+    return chain.prepend(first_address)
 
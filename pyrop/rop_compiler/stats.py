@@ -0,0 +1,76 @@
+# This file contains counters and timers for the stages of the ROP compiler (lifting, emulation, validation, gadget searching,
+# and scheduling).  Collection is disabled by default, in which case each of the functions below returns immediately.
+import time, collections
+
+enabled = False
+counters = collections.defaultdict(int)
+timers = collections.defaultdict(float)
+
+def enable():
+  global enabled
+  enabled = True
+
+def disable():
+  global enabled
+  enabled = False
+
+def reset():
+  counters.clear()
+  timers.clear()
+
+def start_collection():
+  """Starts collecting the stats for a single call (e.g. one compile) from scratch.  Returns the state to pass to
+    finish_collection, which puts back whatever was being collected before."""
+  state = (enabled, get_stats())
+  reset()
+  enable()
+  return state
+
+def finish_collection(state):
+  """Returns the stats collected since start_collection, and restores the previous stats and whether they were enabled.  If
+    the caller was already collecting stats, the stats from this call are added to theirs."""
+  global enabled
+  collected = get_stats()
+  (was_enabled, previous) = state
+  reset()
+  enabled = True # merge only adds to the stats while they're enabled
+  merge(previous)
+  if was_enabled:
+    merge(collected)
+  enabled = was_enabled
+  return collected
+
+def increment(name, amount = 1):
+  if enabled:
+    counters[name] += amount
+
+def start_timer():
+  """Returns the start time to pass to stop_timer, or None if stats aren't being collected"""
+  if enabled:
+    return time.time()
+  return None
+
+def stop_timer(name, start):
+  if start != None:
+    timers[name] += time.time() - start
+    counters[name + ".calls"] += 1
+
+def get_stats():
+  """Returns the collected stats as a dictionary of the form {'counters' : {name : count}, 'timers' : {name : seconds}}"""
+  return {"counters" : dict(counters), "timers" : dict(timers)}
+
+def merge(collected):
+  """Adds the stats from a dictionary returned by get_stats (e.g. in a worker process) to the ones being collected"""
+  if enabled:
+    for name, count in collected["counters"].items():
+      counters[name] += count
+    for name, seconds in collected["timers"].items():
+      timers[name] += seconds
+
+def format_stats(collected = None):
+  """Returns the collected stats (or a dictionary previously returned by get_stats) as a human readable string"""
+  if collected == None:
+    collected = get_stats()
+  lines = ["{:<45} {:>12}".format(name, count) for name, count in sorted(collected["counters"].items())]
+  lines += ["{:<45} {:>11.3f}s".format(name, seconds) for name, seconds in sorted(collected["timers"].items())]
+  return "\n".join(lines)
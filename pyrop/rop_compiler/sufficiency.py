@@ -0,0 +1,163 @@
+# This file decides when a gadget scan has found enough gadgets to compile a set of goals, so the scan can stop early
+import logging, collections
+import goal as go, gadget as ga, extra_archinfo
+
+class SufficiencyOracle(object):
+  """This class tracks which of the primitives needed by a set of goals have been covered by the gadgets found so far.  The
+    primitives tracked are loading each of the calling convention registers from the stack (directly, through any number of
+    MoveReg gadgets, or with a LoadMemJump), writing memory (when a goal needs to write strings or shellcode), jumping to a
+    register (when a goal calls a function), and reading a function's address from the GOT, adding an offset to it, and
+    jumping to it (when a goal can only find the function it calls that way).  Once every primitive is covered by gadgets of
+    an acceptable complexity, the finders can stop scanning.  When there aren't any primitives to track, the oracle can't
+    tell whether the gadgets found so far are enough, so it never stops the scan."""
+
+  """The highest complexity gadget that is considered acceptable for a primitive"""
+  MAX_COMPLEXITY = 4
+
+  def __init__(self, arch, registers, needs_write_memory = False, max_complexity = None, level = logging.WARNING,
+      needs_jump = False, needs_got_call = False):
+    self.logger = logging.getLogger(self.__class__.__name__)
+    self.logger.setLevel(level)
+
+    self.arch = arch
+    self.sp = arch.registers['sp'][0]
+    self.registers = set(registers)
+    self.needs_write_memory = needs_write_memory
+    self.needs_jump = needs_jump
+    self.needs_got_call = needs_got_call
+    self.max_complexity = max_complexity if max_complexity != None else self.MAX_COMPLEXITY
+    self.never_sufficient = len(self.registers) == 0 and not (needs_write_memory or needs_jump or needs_got_call)
+
+    self.load_complexity = {}                         # register -> complexity of the best LoadMem from the stack
+    self.load_mem_jumps = collections.defaultdict(set)  # register -> set of registers the LoadMemJump gadgets jump to
+    self.moves = collections.defaultdict(set)           # register -> set of registers that can be moved into it
+    self.stores = set()                                 # (address register, value register) pairs of the StoreMem gadgets
+    self.jumps = set()                                  # registers the Jump gadgets jump to
+    self.memory_loads = collections.defaultdict(set)    # register -> set of address registers it can be read from memory with
+    self.adds = collections.defaultdict(set)            # register -> set of registers that can be added to (or subtracted from) it
+    self.loadable = None                                # the registers that can_load says yes to, see get_loadable
+    self.sufficient = False
+
+  @classmethod
+  def from_goals(cls, goals, arch, file_handler = None, max_complexity = None, level = logging.WARNING):
+    """Creates an oracle for the primitives needed by a list of Goal objects (as returned by GoalResolver.get_goals)"""
+    calling_convention = [arch.registers[name][0] for name in extra_archinfo.func_calling_convention[arch.name]]
+    num_args = 0
+    needs_write_memory = needs_jump = needs_got_call = False
+    for goal in goals:
+      if isinstance(goal, go.ShellcodeAddressGoal) or isinstance(goal, go.ShellcodeGoal):
+        # Shellcode goals call mprotect (3 args) or syscall (4 args), or fall back on reading mprotect's address from the GOT
+        addresses = file_handler.get_symbols_address(["mprotect", "syscall"]) if file_handler != None else {}
+        if addresses.get("mprotect") != None:
+          num_args = max(num_args, 3)
+        elif addresses.get("syscall") != None:
+          num_args = max(num_args, 4)
+        else:
+          num_args = max(num_args, 3)
+          needs_got_call = True
+        needs_jump = True
+        if isinstance(goal, go.ShellcodeGoal):
+          needs_write_memory = True
+      elif isinstance(goal, go.ExecveGoal):
+        num_args = max(num_args, 3)
+        needs_write_memory = needs_jump = True
+      elif isinstance(goal, go.FunctionGoal):
+        num_args = max(num_args, len(goal.arguments))
+        needs_jump = True
+        if any([type(arg) == str for arg in goal.arguments]):
+          needs_write_memory = True
+
+    registers = calling_convention[:num_args]
+    if 'lr' in arch.registers: # The scheduler sets the link register to return from function calls
+      registers.append(arch.registers['lr'][0])
+
+    return cls(arch, registers, needs_write_memory, max_complexity, level, needs_jump, needs_got_call)
+
+  def add_gadgets(self, gadgets):
+    for gadget in gadgets:
+      self.add_gadget(gadget)
+
+  def add_gadget(self, gadget):
+    """Records any of the primitives that the gadget provides"""
+    complexity = gadget.complexity()
+    if complexity > self.max_complexity:
+      return
+
+    gadget_type = type(gadget)
+    if gadget_type in [ga.LoadMem, ga.LoadMultiple] and gadget.inputs[0] == self.sp:
+      for output in gadget.outputs:
+        if output not in self.load_complexity or self.load_complexity[output] > complexity:
+          self.load_complexity[output] = complexity
+          self.loadable = None
+    elif gadget_type == ga.LoadMem:
+      self.memory_loads[gadget.outputs[0]].add(gadget.inputs[0])
+    elif gadget_type == ga.LoadMemJump and gadget.inputs[0] == self.sp:
+      self.load_mem_jumps[gadget.outputs[0]].add(gadget.inputs[1])
+      self.loadable = None
+    elif gadget_type == ga.MoveReg:
+      self.moves[gadget.outputs[0]].add(gadget.inputs[0])
+      self.loadable = None
+    elif gadget_type == ga.StoreMem:
+      self.stores.add((gadget.inputs[0], gadget.inputs[1]))
+    elif gadget_type == ga.Jump:
+      self.jumps.add(gadget.inputs[0])
+    elif gadget_type in [ga.AddGadget, ga.SubGadget] and gadget.inputs[0] == gadget.outputs[0]:
+      self.adds[gadget.outputs[0]].add(gadget.inputs[1])
+
+  def get_loadable(self):
+    """Returns the set of registers that can be loaded from the stack.  Like the GadgetList's synthesis, a register can be
+      loaded directly, by loading another register and moving the value over with any number of MoveReg gadgets, or with a
+      LoadMemJump gadget that jumps to a register that can be loaded directly."""
+    if self.loadable == None:
+      loaded = set(self.load_complexity)
+      loadable = set(loaded)
+      for register, jump_registers in self.load_mem_jumps.items():
+        if len(jump_registers & loaded) != 0:
+          loadable.add(register)
+      pending = list(loaded)
+      while len(pending) != 0: # Follow the moves out of each directly loaded register
+        source = pending.pop()
+        for register, sources in self.moves.items():
+          if source in sources and register not in loaded:
+            loaded.add(register)
+            loadable.add(register)
+            pending.append(register)
+      self.loadable = loadable
+    return self.loadable
+
+  def can_load(self, register):
+    """Determines whether a register can be loaded from the stack, either directly or by combining gadgets"""
+    return register in self.get_loadable()
+
+  def can_jump(self):
+    return any([self.can_load(reg) for reg in self.jumps])
+
+  def can_call_from_got(self):
+    """Determines whether there are gadgets to read an address from memory, add an offset to it, and jump to it (see
+      Scheduler.create_read_add_jmp_function_chain)"""
+    for jump_reg in self.jumps:
+      if (any([addr_reg != jump_reg and self.can_load(addr_reg) for addr_reg in self.memory_loads[jump_reg]])
+          and any([add_reg != jump_reg and self.can_load(add_reg) for add_reg in self.adds[jump_reg]])):
+        return True
+    return False
+
+  def can_write_memory(self):
+    for (addr_reg, value_reg) in self.stores:
+      if addr_reg != value_reg and self.can_load(addr_reg) and self.can_load(value_reg):
+        return True
+    return False
+
+  def is_sufficient(self):
+    """Returns whether all of the needed primitives have been found"""
+    if self.sufficient or self.never_sufficient:
+      return self.sufficient
+    self.sufficient = (all([self.can_load(reg) for reg in self.registers])
+      and (not self.needs_write_memory or self.can_write_memory())
+      and (not self.needs_jump or self.can_jump())
+      and (not self.needs_got_call or self.can_call_from_got()))
+    if self.sufficient:
+      self.logger.debug("Found gadgets for all the needed primitives: %s%s%s%s",
+        ", ".join([self.arch.translate_register_name(reg) for reg in self.registers]),
+        " and a memory write" if self.needs_write_memory else "", " and a jump" if self.needs_jump else "",
+        " and a call through the GOT" if self.needs_got_call else "")
+    return self.sufficient
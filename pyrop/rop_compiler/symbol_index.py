@@ -0,0 +1,154 @@
+import logging, collections
+import cPickle as pickle
+import utils
+
+def from_string(data, level = logging.WARNING):
+  """Restores a symbol index that was previously saved with SymbolIndex.to_string"""
+  index = SymbolIndex(level)
+  saved = pickle.loads(data)
+  if len(saved) != 5: # Saved before the files' hashes were, so there's no way to tell if the entries are stale
+    return index
+  (bases, complete, symbols, got_entries, hashes) = saved
+  index.saved_hashes.update(hashes)
+  index.bases.update(bases)
+  index.complete.update(complete)
+  index.symbols.update(symbols)
+  index.got_entries.update(got_entries)
+  return index
+
+class SymbolIndex(object):
+  """This class records which object (executable/library) defines each symbol and at what offset from that object's base
+    address.  Objects whose parser can enumerate its symbols are indexed when they are added, the rest are indexed lazily the
+    first time a symbol is asked for.  Either way, each parser is only ever asked about a given symbol once.  A saved index
+    records the hash of each object's file, and the entries for any file that has changed since are thrown away."""
+
+  def __init__(self, level = logging.WARNING):
+    self.logger = logging.getLogger(self.__class__.__name__)
+    self.logger.setLevel(level)
+
+    self.parsers = collections.OrderedDict() # object name -> parser (or None when restored from a saved index)
+    self.parser_factories = {}               # object name -> function creating the parser, for objects not parsed yet
+    self.bases = collections.OrderedDict()   # object name -> base address
+    self.complete = {}                       # object name -> {symbol : offset} for the objects that were fully enumerated
+    self.symbols = collections.defaultdict(dict, {}) # symbol -> {object name : offset (or None if not defined there)}
+    self.got_entries = collections.defaultdict(dict, {}) # object name -> {symbol : address of the GOT entry}
+    self.hashes = {}                         # object name -> the hash of its file, once it's been checked
+    self.saved_hashes = {}                   # object name -> the hash of its file when the index was saved
+
+  def to_string(self):
+    """Turns the index into a pickle'd object so it can be saved alongside a gadget file"""
+    for name in self.bases.keys():
+      self.check_hash(name)
+    return pickle.dumps((self.bases, self.complete, dict(self.symbols), dict(self.got_entries), self.hashes))
+
+  def check_hash(self, name):
+    """Hashes an object's file, and forgets everything the saved index knew about the object if the file has changed"""
+    if name in self.hashes:
+      return
+    self.hashes[name] = utils.hash_file(name)
+    if name in self.saved_hashes and self.saved_hashes[name] != self.hashes[name]:
+      self.logger.debug("%s has changed since the index was saved, ignoring its saved symbols", name)
+      self.complete.pop(name, None)
+      self.got_entries.pop(name, None)
+      for definitions in self.symbols.values():
+        definitions.pop(name, None)
+
+  def add_object(self, name, parser, base_address = 0):
+    """Adds an object to the index.  The parser is used to answer any queries the index doesn't already know the answer to"""
+    self.parsers[name] = parser
+    self.bases[name] = base_address # Only offsets are indexed, so changing the base doesn't invalidate anything
+    if name in self.saved_hashes:
+      self.check_hash(name)
+
+    symbols = parser.iter_symbols() if name not in self.complete and parser != None else None
+    if symbols != None:
+      defined = {}
+      for symbol, address in symbols:
+        if address != None and symbol not in defined:
+          defined[symbol] = address - base_address
+      self.complete[name] = defined
+      self.logger.debug("Indexed %d symbols in %s", len(defined), name)
+
+  def add_lazy_object(self, name, create_parser, base_address = 0):
+    """Adds an object to the index without parsing it.  The parser is only created (by calling create_parser) the first time
+      the index needs to ask it about a symbol, so objects that are never queried are never parsed"""
+    self.parsers[name] = None
+    self.bases[name] = base_address
+    if name in self.saved_hashes:
+      self.check_hash(name)
+    if name not in self.complete:
+      self.parser_factories[name] = create_parser
+
+  def get_parser(self, name):
+    """Returns the parser for an object, creating (and indexing) it if it was added lazily"""
+    if name in self.parser_factories:
+      self.add_object(name, self.parser_factories.pop(name)(), self.bases[name])
+    return self.parsers.get(name)
+
+  def set_base_address(self, name, base_address):
+    """Moves an object to a new base address"""
+    self.bases[name] = base_address
+
+  def objects(self):
+    """Returns the names of the indexed objects, in the order they were added"""
+    return self.bases.keys()
+
+  def get_symbol_offset(self, name, object_name):
+    """Returns the offset of a symbol from the base of the given object, or None if the object doesn't define it"""
+    cached = self.symbols[name]
+    if object_name in self.parser_factories and object_name not in cached: # Parse it, in case it can be fully indexed
+      self.get_parser(object_name)
+    if object_name in self.complete:
+      return self.complete[object_name].get(name)
+
+    if object_name not in cached:
+      offset = None
+      parser = self.get_parser(object_name)
+      if parser != None:
+        address = parser.get_symbol_address(name)
+        if address != None:
+          offset = address - self.bases[object_name]
+      cached[object_name] = offset
+    return cached[object_name]
+
+  def lookup(self, name, object_names = None):
+    """Returns a list of (object name, offset) tuples for each of the objects that define the symbol"""
+    if object_names == None:
+      object_names = self.objects()
+    definitions = []
+    for object_name in object_names:
+      offset = self.get_symbol_offset(name, object_name)
+      if offset != None:
+        definitions.append((object_name, offset))
+    return definitions
+
+  def get_symbol_address(self, name, object_names = None):
+    """Returns the address of the first definition of a symbol, or None if the symbol can't be found"""
+    if object_names == None:
+      object_names = self.objects()
+    for object_name in object_names:
+      offset = self.get_symbol_offset(name, object_name)
+      if offset != None:
+        return self.bases[object_name] + offset
+    return None
+
+  def get_relative_offset(self, base_name, target_name, object_names = None):
+    """Finds an object that defines both symbols and returns the offset from the base symbol to the target symbol"""
+    if object_names == None:
+      object_names = self.objects()
+    for object_name in object_names:
+      base = self.get_symbol_offset(base_name, object_name)
+      if base == None:
+        continue
+      target = self.get_symbol_offset(target_name, object_name)
+      if target != None:
+        return target - base
+    return None
+
+  def find_symbol_in_got(self, name, object_name):
+    """Returns the address of a symbol's GOT entry in the given object"""
+    entries = self.got_entries[object_name]
+    if name not in entries:
+      parser = self.get_parser(object_name)
+      entries[name] = parser.find_symbol_in_got(name) if parser != None else None
+    return entries[name]
@@ -0,0 +1,80 @@
+# This file contains relocatable ROP chain templates.  A template is a ROP chain split into words, with each word that holds
+# an address inside one of the files tagged with that file.  Instantiating the template for a new set of base addresses (e.g.
+# after an ASLR leak) just adds each file's change in base address to its words, rather than compiling the chain again.
+import struct
+import cPickle as pickle
+import utils
+
+archinfo = utils.LazyModule("archinfo")
+
+def word_format(arch, num_words):
+  """Returns the struct format for a number of words on the given arch"""
+  return {'Iend_BE' : '>', 'Iend_LE' : '<'}[arch.memory_endness] + {32 : "I", 64 : "Q"}[arch.bits] * num_words
+
+def from_string(data):
+  """Restores a template that was previously saved with ChainTemplate.to_string"""
+  (arch_name, endness, base_addresses, words, relocations, tail) = pickle.loads(data)
+  return ChainTemplate(archinfo.arch_from_id(arch_name, endness), base_addresses, words, relocations, tail)
+
+class ChainTemplate(object):
+  """This class holds a ROP chain compiled for one set of base addresses, along with which of its words need to move when the
+    files are loaded at a different base"""
+
+  def __init__(self, arch, base_addresses, words, relocations, tail = ""):
+    self.arch = arch
+    self.base_addresses = list(base_addresses) # The base address of each file that the words were compiled for
+    self.words = words                         # The chain, as a list of words
+    self.relocations = relocations             # (word index, file index) for each word that holds an address in a file
+    self.tail = tail                           # Any bytes after the last whole word
+    self.mask = utils.get_mask(arch.bits)
+    self.format = word_format(arch, len(words))
+
+  @classmethod
+  def from_probes(cls, arch, first_chain, first_bases, second_chain, second_bases):
+    """Creates a template from the same goals compiled for two different sets of base addresses.  Each file's base must
+      change by a different amount between the two, so that every changed word can be attributed to a single file."""
+    deltas = [utils.mask(second - first, arch.bits) for first, second in zip(first_bases, second_bases)]
+    if len(set(deltas)) != len(deltas) or 0 in deltas:
+      raise RuntimeError("Each file's base address must change by a different, non-zero, amount between the probes")
+    if len(first_chain) != len(second_chain):
+      raise RuntimeError("The chain isn't relocatable: its length depends on the base addresses")
+
+    size = (len(first_chain) / (arch.bits / 8)) * (arch.bits / 8)
+    if first_chain[size:] != second_chain[size:]:
+      raise RuntimeError("The chain isn't relocatable: the bytes after the last word depend on the base addresses")
+
+    first_words = struct.unpack(word_format(arch, size / (arch.bits / 8)), first_chain[:size])
+    second_words = struct.unpack(word_format(arch, size / (arch.bits / 8)), second_chain[:size])
+    relocations = []
+    for index, (first, second) in enumerate(zip(first_words, second_words)):
+      if first == second:
+        continue
+      difference = utils.mask(second - first, arch.bits)
+      if difference not in deltas:
+        raise RuntimeError("The chain isn't relocatable: word {} changed by 0x{:x}".format(index, difference))
+      relocations.append((index, deltas.index(difference)))
+    return cls(arch, first_bases, list(first_words), relocations, first_chain[size:])
+
+  def to_string(self):
+    """Turns the template into a pickle'd object so it can be saved"""
+    return pickle.dumps((self.arch.name, self.arch.memory_endness, self.base_addresses, self.words, self.relocations, self.tail),
+      pickle.HIGHEST_PROTOCOL)
+
+  def instantiate(self, base_addresses = None, bad_bytes = None):
+    """Returns the chain for the files loaded at the given base addresses (a list with one address, or None to keep the
+      compiled address, per file).  If bad bytes are given and any of the moved words contain one, None is returned, and the
+      chain will have to be compiled for those base addresses instead."""
+    if base_addresses == None:
+      base_addresses = self.base_addresses
+    deltas = [(base - old) if base != None else 0 for base, old in zip(base_addresses, self.base_addresses)]
+    bad_byte_filter = utils.get_bad_byte_filter(bad_bytes, self.arch) if bad_bytes != None else None
+
+    words = list(self.words)
+    for index, file_index in self.relocations:
+      words[index] = (words[index] + deltas[file_index]) & self.mask
+      if bad_byte_filter != None and bad_byte_filter.contains_bad_byte(words[index]):
+        return None
+    return struct.pack(self.format, *words) + self.tail
+
+  def num_relocations(self):
+    return len(self.relocations)
@@ -1,24 +1,124 @@
-import struct
-import z3
+import struct, importlib, logging, hashlib, os
+
+class LazyModule(object):
+  """A stand in for a heavy module (e.g. z3 or archinfo) that imports the module the first time one of its attributes is used,
+    so that runs which never need the module don't pay to import it"""
+
+  def __init__(self, name):
+    self.name = name
+    self.module = None
+
+  def __getattr__(self, attr):
+    if self.module == None:
+      self.module = importlib.import_module(self.name)
+    return getattr(self.module, attr)
+
+z3 = LazyModule("z3")
+
+def hash_file(filename):
+  """Returns the sha1 of a file's contents (as a hex string), or None if the file doesn't exist"""
+  if not os.path.isfile(filename):
+    return None
+  hasher = hashlib.sha1()
+  fd = open(filename, "rb")
+  for block in iter(lambda: fd.read(0x100000), ""):
+    hasher.update(block)
+  fd.close()
+  return hasher.hexdigest()
+
+logging_configured = False
+
+def configure_logging():
+  """Sets up the default log format.  Only the first call does anything, so every class can call it when it's created"""
+  global logging_configured
+  if not logging_configured:
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logging_configured = True
 
 def address_contains_bad_byte(address, bad_bytes, arch):
-  ret = False
-  if bad_bytes != None:
-    addr_bytes = ap(address, arch)
-    ret = any(map(lambda x: x in addr_bytes, bad_bytes))
-  return ret
+  if bad_bytes == None:
+    return False
+  return get_bad_byte_filter(bad_bytes, arch).contains_bad_byte(address)
+
+BAD_BYTE_FILTERS = {}
+
+def get_bad_byte_filter(bad_bytes, arch):
+  """Returns the (cached) BadByteFilter for a list of bad bytes and an arch"""
+  key = (tuple(bad_bytes), arch.bits, arch.memory_endness)
+  if key not in BAD_BYTE_FILTERS:
+    BAD_BYTE_FILTERS[key] = BadByteFilter(bad_bytes, arch)
+  return BAD_BYTE_FILTERS[key]
+
+class BadByteFilter(object):
+  """This class checks addresses for bad bytes without packing them.  Each single bad byte is checked against every byte of
+    the address at once, by xoring the address with the bad byte repeated in every byte position and checking the result
+    for a zero byte.  Bad bytes that are longer than one byte are checked against the packed address."""
+
+  def __init__(self, bad_bytes, arch):
+    self.arch = arch
+    self.bits = arch.bits
+    self.mask = get_mask(arch.bits)
+    self.patterns = [pattern for pattern in bad_bytes if len(pattern) != 1]
+    self.bad_values = sorted(set([ord(pattern) for pattern in bad_bytes if len(pattern) == 1]))
+
+    self.low_bits = int("01" * (self.bits / 8), 16)  # 0x0101...01
+    self.high_bits = int("80" * (self.bits / 8), 16) # 0x8080...80
+    self.repeated = [value * self.low_bits for value in self.bad_values]
+    self.is_bad_value = [value in self.bad_values for value in range(256)]
+
+  def contains_bad_byte(self, address):
+    if type(address) == str: # Already packed
+      return any([pattern in address for pattern in self.patterns + map(chr, self.bad_values)])
+
+    address = address & self.mask # Negative addresses are packed as two's complement
+    for repeated in self.repeated:
+      value = address ^ repeated
+      if (value - self.low_bits) & ~value & self.high_bits: # value has a zero byte, i.e. address has a byte == the bad byte
+        return True
+    if len(self.patterns) != 0:
+      addr_bytes = ap(address, self.arch)
+      return any([pattern in addr_bytes for pattern in self.patterns])
+    return False
+
+  def next_candidate(self, address):
+    """Returns the first address at or after the given one that doesn't have a bad byte in the same place as the given
+      address.  When one of the upper bytes of the address is bad, every address until that byte changes is bad as well, so
+      callers scanning a range of addresses can skip straight past them.  Only single bad bytes are considered here, so the
+      returned address may still contain a bad byte."""
+    for shift in range(self.bits - 8, -8, -8): # Most significant byte first, to skip as far as possible
+      if self.is_bad_value[(address >> shift) & 0xff]:
+        return ((address >> shift) + 1) << shift
+    return address
+
+  def find_bad_addresses(self, addresses):
+    """Returns a list of booleans saying whether each of the addresses contains a bad byte.  If numpy is available and there
+      aren't any multiple byte patterns, the addresses are checked all at once."""
+    if len(self.patterns) == 0 and len(addresses) > 0:
+      try:
+        import numpy
+      except ImportError:
+        numpy = None
+      if numpy != None:
+        values = numpy.array([address & self.mask for address in addresses], dtype = numpy.uint64)
+        bad = numpy.zeros(len(addresses), dtype = bool)
+        is_bad_value = numpy.array(self.is_bad_value, dtype = bool)
+        for shift in range(0, self.bits, 8):
+          bad |= is_bad_value[(values >> numpy.uint64(shift)) & numpy.uint64(0xff)]
+        return bad.tolist()
+    return [self.contains_bad_byte(address) for address in addresses]
+
+AP_FORMATS = { 32 : "I", 64 : "Q" }
+AP_ENDIANS = { 'Iend_BE' : '>', 'Iend_LE' : '<' }
 
 def ap(address, arch):
   """Packs an address into a string. ap is short for Address Pack"""
-  formats = { 32 : "I", 64 : "Q" }
-  endian = { 'Iend_BE' : '>', 'Iend_LE' : '<' }
   if type(address) == str: # Assume already packed
     return address
   if address < 0:
     address = (2 ** arch.bits) + address
   address = mask(address, arch.bits) # Mask it so struct.pack doesn't complain (probably not the best idea, but it's the
 
-  return struct.pack(endian[arch.memory_endness] + formats[arch.bits], address) # caller's problem to check their arguments before calling)
+  return struct.pack(AP_ENDIANS[arch.memory_endness] + AP_FORMATS[arch.bits], address) # caller's problem to check their arguments before calling)
 
 def get_contents(filename):
   """Convenience method that reads a file on disk and returns the contents"""
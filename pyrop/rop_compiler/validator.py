@@ -1,6 +1,6 @@
 import collections
 import z3
-import gadget, utils, extra_archinfo
+import gadget, utils, extra_archinfo, stats
 
 class Validator(object):
 
@@ -17,7 +17,10 @@ class Validator(object):
       for statement in statements:
         solver.append(statement)
     solver.append(gadget.get_constraint())
+    start = stats.start_timer()
     result = solver.check()
+    stats.stop_timer("validator.z3", start)
+    stats.increment("validator.rejected" if result != z3.unsat else "validator.accepted")
     return result == z3.unsat
 
 class PyvexToZ3Converter(object):
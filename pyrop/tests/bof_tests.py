@@ -156,6 +156,32 @@ class BofTests(unittest.TestCase):
 
     self.assertEqual(expected, actual)
 
+  def test_bof_system_batch(self):
+    filename = e('bof_system2')
+    files = [(filename, None, 0)]
+    goal_lists = [[["function", "system", "uname -a\x00"], ["function", "exit", status]] for status in [33, 0, 1]]
+    self.assertEqual(ropme.rop_batch(files, [], []), [])
+
+    # The goal lists only differ in the exit status, so the later ones reuse the gadget searches done for the first
+    results = ropme.rop_batch(files, [], goal_lists, collect_stats = True)
+    self.assertTrue(results[1]["stats"]["counters"].get("gadget_list.load_registers_memo_hits", 0) > 0)
+
+    # Each chain is the same as the one compiled on its own, whether the goal lists are compiled here or in worker processes
+    expected = [ropme.rop(files, [], goals) for goals in goal_lists]
+    self.assertEqual([result["chain"] for result in results], expected)
+    self.assertEqual([result["chain"] for result in ropme.rop_batch(files, [], goal_lists, processes = 2)], expected)
+
+    p = process([filename,'3000'])
+    p.writeline('A'*512 + 'B'*8 + results[0]["chain"])
+    actual = p.readline().strip()
+    p.close()
+
+    uname = process(['uname','-a'])
+    expected = uname.readline().strip()
+    uname.close()
+
+    self.assertEqual(expected, actual)
+
   def test_bof_syscall(self):
     filename = e('bof_syscall')
     p = process([filename,'3000'])
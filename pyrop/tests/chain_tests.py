@@ -0,0 +1,100 @@
+import unittest
+import archinfo
+
+import rop_compiler.chain as cm
+import rop_compiler.utils as utils
+
+class ChainTests(unittest.TestCase):
+
+  def setUp(self):
+    self.arch = archinfo.ArchAMD64()
+
+  def ap(self, *addresses):
+    return "".join([utils.ap(address, self.arch) for address in addresses])
+
+  def test_prepend_extend(self):
+    chain = cm.Chain(self.arch)
+    chain.add_address(0x40100)
+    chain.prepend(cm.Chain(self.arch).extend("B").extend("C"))
+    chain.extend("D")
+    chain.prepend("A")
+    other = cm.Chain(self.arch)
+    other.add_value(0x20)
+    other.prepend("E")
+    chain.extend(other)
+    chain.prepend(cm.Chain(self.arch)) # Empty chains and strings don't add any slots
+    chain.prepend("")
+    chain.extend("")
+
+    expected = "ABC" + self.ap(0x40100) + "D" + "E" + self.ap(0x20)
+    self.assertEqual(chain.to_string(), expected)
+    self.assertEqual(str(chain), expected)
+    self.assertEqual(len(chain), len(expected))
+    self.assertEqual([kind for (kind, value, annotation) in chain.slots()],
+      [cm.DATA, cm.DATA, cm.DATA, cm.ADDRESS, cm.DATA, cm.DATA, cm.VALUE])
+
+    # The chain that was added is unchanged
+    self.assertEqual(other.to_string(), "E" + self.ap(0x20))
+
+  def test_padding(self):
+    chain = cm.Chain(self.arch)
+    chain.add_address(0x40100)
+    start = len(chain)
+    chain.add_value(0x1)
+    chain.pad_to(start, 0x18)
+    chain.pad_to(start, 0x10, "X") # Already past the offset, so nothing is added
+    chain.add_padding(0)
+    chain.add_padding(3, "Y")
+    self.assertEqual(chain.to_string(), self.ap(0x40100, 0x1) + "Z" * 0x10 + "YYY")
+    self.assertEqual(len(chain.slots()), 4)
+
+  def test_words(self):
+    chain = cm.Chain(self.arch)
+    chain.add_value(-1)
+    chain.add_address(-0x10)
+    chain.add_value(1 << 64) # Too big, so it's masked
+    chain.add_value(utils.ap(0x41414141, self.arch)) # Already packed, so it's added as data
+    self.assertEqual(chain.slots()[3], (cm.DATA, self.ap(0x41414141), None))
+    self.assertEqual(chain.to_string(), self.ap(-1, -0x10, 0, 0x41414141))
+
+    # Big endian, 32 bit words
+    arch = archinfo.ArchMIPS32('Iend_BE')
+    chain = cm.Chain(arch)
+    chain.add_address(0x400100)
+    chain.add_value(-2)
+    self.assertEqual(chain.to_string(), "\x00\x40\x01\x00\xff\xff\xff\xfe")
+    self.assertEqual(chain.to_string(), utils.ap(0x400100, arch) + utils.ap(-2, arch))
+
+  def test_to_string(self):
+    # The same chain built by concatenating packed strings, as the scheduler used to
+    addresses = [0x40100, -8, 0x5A5A5A5A5A5A5A5A, 0xffffffffffffffff, 0]
+    old = ""
+    chain = cm.Chain(self.arch)
+    for i, address in enumerate(addresses):
+      old = utils.ap(address, self.arch) + "P" * i + old
+      piece = cm.Chain(self.arch)
+      piece.add_address(address)
+      piece.add_padding(i, "P")
+      chain.prepend(piece)
+    old += "tail"
+    chain.add_bytes("tail")
+    self.assertEqual(chain.to_string(), old)
+    self.assertEqual(len(chain), len(old))
+
+  def test_dump(self):
+    chain = cm.Chain(self.arch)
+    chain.add_address(0x40100, "LoadMem")
+    chain.add_value(0x2a)
+    chain.add_padding(4, "Z", "padding")
+    chain.add_bytes("A" * 40)
+    chain.add_bytes("/bin/sh\x00")
+    self.assertEqual(chain.dump().split("\n"), [
+      "0x0000: address  0x40100  # LoadMem",
+      "0x0008: value    0x2a",
+      "0x0010: padding  4 * 'Z'  # padding",
+      "0x0014: data     40 bytes",
+      "0x003c: data     '/bin/sh\\x00'",
+    ])
+
+if __name__ == '__main__':
+  unittest.main()
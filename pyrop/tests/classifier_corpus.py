@@ -0,0 +1,111 @@
+# This file builds a corpus of instruction windows for benchmarking the gadget classifier.  The corpus is the snippets from
+# classifier_tests.py plus windows sampled (deterministically) from the executable segments of the example binaries.  Running
+# the corpus through the classifier gives a histogram of the gadget types found, which is recorded in a golden file so that
+# optimizations to the classifier can be checked for identical results.
+import logging, random, hashlib, json, os, time, collections
+import archinfo
+import rop_compiler.classifier as classifier, rop_compiler.factories as factories, rop_compiler.finder as finder
+import classifier_tests
+
+CORPUS_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_FILE = os.path.join(CORPUS_DIR, "classifier_corpus.json")
+
+"""The number of windows to sample from each binary"""
+NUM_WINDOWS = 4000
+
+"""The seed used to sample the windows, changing it changes the corpus (and requires recording the golden file again)"""
+SEED = 0x524f50
+
+# name -> (arch, binary to sample windows from, snippets from classifier_tests)
+CORPORA = collections.OrderedDict([
+  ("amd64",  (lambda: archinfo.ArchAMD64(),           "bof",       classifier_tests.AMD64_TESTS)),
+  ("x86",    (lambda: archinfo.ArchX86(),             "libc.so",   classifier_tests.X86_TESTS)),
+  ("arm",    (lambda: archinfo.ArchARM(),             "arm_bof",   classifier_tests.ARM_TESTS)),
+  ("mips",   (lambda: archinfo.ArchMIPS32('Iend_BE'), "mips_bof",  classifier_tests.MIPS_TESTS)),
+  ("ppc_be", (lambda: archinfo.ArchPPC32('Iend_BE'),  "ppc_bof",   classifier_tests.PPC_BE_TESTS)),
+  ("ppc_le", (lambda: archinfo.ArchPPC32(),           None,        classifier_tests.PPC_LE_TESTS)),
+])
+
+def sample_windows(arch, filename, num_windows = NUM_WINDOWS, seed = SEED, parser_type = None):
+  """Returns a list of (code, address) tuples sampled from the executable segments of the given file"""
+  parser = factories.get_parser_from_name(parser_type)(filename, 0, logging.WARNING)
+  max_size = finder.Finder.MAX_GADGET_SIZE[arch.name]
+  candidates = []
+  for segment in parser.iter_executable_segments():
+    data, address = parser.get_segment_bytes_address(segment)
+    data = memoryview(data)
+    for i in range(0, len(data), arch.instruction_alignment):
+      candidates.append((data, address, i))
+
+  rng = random.Random(seed)
+  chosen = sorted(rng.sample(range(len(candidates)), min(num_windows, len(candidates))))
+  windows = []
+  for index in chosen:
+    (data, address, i) = candidates[index]
+    windows.append((data[i:i + max_size].tobytes(), address + i))
+  return windows
+
+def build_corpus(name, num_windows = NUM_WINDOWS, seed = SEED, parser_type = None):
+  """Returns the arch and list of (code, address) windows for the named corpus"""
+  (arch_func, filename, snippets) = CORPORA[name]
+  arch = arch_func()
+  windows = [(code, 0x40000) for (expected_types, code) in snippets]
+  if filename != None:
+    windows += sample_windows(arch, os.path.join(CORPUS_DIR, "..", "example", filename), num_windows, seed, parser_type)
+  return arch, windows
+
+def classify_corpus(arch, windows):
+  """Classifies each of the windows and returns a tuple of (histogram, digest, windows per second).  The histogram counts
+    each type of gadget found, and the digest is a hash of every gadget found, so even changes that leave the histogram the
+    same can be caught."""
+  gadget_classifier = classifier.GadgetClassifier(arch, log_level = logging.WARNING)
+  histogram = collections.defaultdict(int)
+  digest = hashlib.sha1()
+  start = time.time()
+  for code, address in windows:
+    gadgets = gadget_classifier.create_gadgets_from_instructions(code, address)
+    histogram["windows_with_gadgets"] += 1 if len(gadgets) != 0 else 0
+    for gadget in gadgets:
+      histogram[gadget.__class__.__name__] += 1
+      digest.update(str(gadget))
+  elapsed = time.time() - start
+  return dict(histogram), digest.hexdigest(), len(windows) / max(elapsed, 1e-9)
+
+def load_golden(filename = GOLDEN_FILE):
+  if not os.path.exists(filename):
+    return None
+  with open(filename) as f:
+    return json.load(f)
+
+def record_golden(names, filename = GOLDEN_FILE, parser_type = None):
+  """Classifies each of the named corpora and saves the results as the golden output"""
+  golden = load_golden(filename) or {}
+  for name in names:
+    arch, windows = build_corpus(name, parser_type = parser_type)
+    histogram, digest, rate = classify_corpus(arch, windows)
+    golden[name] = {"windows" : len(windows), "histogram" : histogram, "digest" : digest}
+  with open(filename, "w") as f:
+    json.dump(golden, f, indent = 2, sort_keys = True)
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description="Benchmark the gadget classifier against a corpus of instruction windows")
+  parser.add_argument('-corpus', type=str, default=None, help='A comma separated list of the corpora to run (default all)')
+  parser.add_argument('-parser_type', type=str, default="cle", help='The type of file parser (cle, pyelf, radare)')
+  parser.add_argument('-record', required=False, action='store_true', help='Record the results as the new golden output')
+  args = parser.parse_args()
+
+  names = args.corpus.split(",") if args.corpus != None else CORPORA.keys()
+  if args.record:
+    record_golden(names, parser_type = args.parser_type)
+
+  golden = load_golden() or {}
+  for name in names:
+    arch, windows = build_corpus(name, parser_type = args.parser_type)
+    histogram, digest, rate = classify_corpus(arch, windows)
+    if name not in golden:
+      status = "no golden output"
+    else:
+      status = "matches golden" if golden[name]["digest"] == digest else "DIFFERS FROM GOLDEN"
+    print "{}: {} windows, {:.1f} windows/sec, {} ({})".format(name, len(windows), rate, json.dumps(histogram, sort_keys = True), status)
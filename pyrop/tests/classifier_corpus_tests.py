@@ -0,0 +1,38 @@
+import unittest, logging
+import classifier_corpus
+
+class ClassifierCorpusTests(unittest.TestCase):
+
+  def run_corpus(self, name):
+    golden = classifier_corpus.load_golden()
+    self.assertNotEqual(golden, None, "The golden file {} is missing (run classifier_corpus.py -record)".format(
+      classifier_corpus.GOLDEN_FILE))
+    self.assertIn(name, golden, "No golden output recorded for the {} corpus (run classifier_corpus.py -record)".format(name))
+
+    arch, windows = classifier_corpus.build_corpus(name)
+    histogram, digest, rate = classifier_corpus.classify_corpus(arch, windows)
+    logging.info("%s: %.1f windows/sec", name, rate)
+    self.assertEqual(len(windows), golden[name]["windows"])
+    self.assertEqual(histogram, golden[name]["histogram"])
+    self.assertEqual(digest, golden[name]["digest"])
+
+  def test_amd64(self):
+    self.run_corpus("amd64")
+
+  def test_x86(self):
+    self.run_corpus("x86")
+
+  def test_arm(self):
+    self.run_corpus("arm")
+
+  def test_mips(self):
+    self.run_corpus("mips")
+
+  def test_ppc_be(self):
+    self.run_corpus("ppc_be")
+
+  def test_ppc_le(self):
+    self.run_corpus("ppc_le")
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,47 @@
+import unittest, tempfile, shutil, os
+
+import rop_compiler.cle_parser as cle_parser
+
+class CleParserTests(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    fd, self.filename = tempfile.mkstemp()
+    os.write(fd, "\x7fELF" + "\x90" * 0x100 + "\x5f\xc3")
+    os.close(fd)
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+    os.unlink(self.filename)
+
+  def test_metadata_cache(self):
+    class FakeParser(cle_parser.CleParser): # Stands in for loading the file with cle, and counts how often it's loaded
+      loads = 0
+      def read_metadata(self):
+        FakeParser.loads += 1
+        return cle_parser.Metadata([cle_parser.Segment(0, 0x400000, 0x106, 0x106, None)], {"main" : 0x400100, "puts" : 0x400010},
+          {"puts" : 0x400010}, {"puts" : 0x601018}, {".data" : (0x601000, 0x10), ".text" : (0x400000, 0x106)}, 0x601000)
+
+    parser = FakeParser(self.filename, 0, cache_dir = self.cache_dir)
+    self.assertEqual(FakeParser.loads, 1)
+
+    # The second parser reads everything from the cache, and still respects its own base address
+    parser = FakeParser(self.filename, 0x1000, cache_dir = self.cache_dir)
+    self.assertEqual(FakeParser.loads, 1)
+    self.assertEqual(parser.get_symbol_address("main"), 0x401100)
+    self.assertEqual(parser.get_symbol_address("missing"), None)
+    self.assertEqual(sorted(parser.iter_symbols()), [("main", 0x401100), ("puts", 0x401010)])
+    self.assertEqual(parser.get_section_range(".text"), (0x401000, 0x106))
+    self.assertEqual(parser.get_writable_memory(), 0x602000)
+    self.assertEqual(parser.find_symbol_in_got("puts"), 0x601018)
+    [segment] = list(parser.iter_executable_segments())
+    data, address = parser.get_segment_bytes_address(segment)
+    self.assertEqual((data.tobytes()[-2:], address), ("\x5f\xc3", 0x401000))
+
+    # Changing the file changes its hash, so it's loaded again
+    open(self.filename, "ab").write("\x00")
+    parser = FakeParser(self.filename, 0, cache_dir = self.cache_dir)
+    self.assertEqual(FakeParser.loads, 2)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,117 @@
+import unittest, logging, binascii
+import archinfo
+
+import rop_compiler.daemon as daemon
+from rop_compiler.gadget import *
+
+class FakeSession(object):
+  """A session that just records the requests it gets, rather than compiling anything"""
+
+  def __init__(self, files):
+    self.files = files
+    self.requests = []
+    self.num_requests = 0
+
+  def compile(self, goal_list, base_addresses = None, bad_bytes = None, strategy = None):
+    self.num_requests += 1
+    self.requests.append((goal_list, base_addresses, bad_bytes, strategy))
+    return "chain"
+
+class FakeSessionServer(daemon.CompileServer):
+
+  def create_session(self, files, libraries, arch, validate_gadgets, max_gadgets_per_signature):
+    return FakeSession(files)
+
+class FakeFinder(object):
+  """A finder that returns the given gadgets, rather than scanning a file"""
+
+  def __init__(self, gadgets):
+    self.gadgets = gadgets
+
+  def find_gadgets(self, validate = False, bad_bytes = None, oracle = None, planner = None, budget = None, retention = None,
+      scan_cache = None):
+    return GadgetList(self.gadgets)
+
+  def set_base_address(self, address):
+    pass
+
+class DaemonTests(unittest.TestCase):
+
+  def compile_request(self, *binaries):
+    return {"command" : "compile", "files" : [[binary, None, "0x40000"] for binary in binaries], "goals" : [["function", "a"]]}
+
+  def test_commands(self):
+    server = FakeSessionServer()
+    self.assertEqual(server.handle({"command" : "bogus"}), {"error" : "Unknown command: bogus"})
+
+    response = server.handle(self.compile_request("a", "b"))
+    self.assertEqual(response["chain"], binascii.hexlify("chain"))
+    server.handle(self.compile_request("a", "b"))
+    server.handle(dict(self.compile_request("c"), bad_bytes = ["\x00"], strategy = "best"))
+    self.assertEqual(server.handle({"command" : "status"}), {"sessions" : [
+      {"files" : ["a", "b"], "requests" : 2},
+      {"files" : ["c"], "requests" : 1},
+    ]})
+    session = server.sessions.values()[-1]
+    self.assertEqual(session.requests, [([["function", "a"]], [0x40000], ["\x00"], BEST)])
+
+    self.assertEqual(server.handle({"command" : "drop"}), {})
+    self.assertEqual(server.handle({"command" : "status"}), {"sessions" : []})
+
+    # A failed request is reported rather than stopping the server
+    self.assertTrue("error" in server.handle({"command" : "compile"}))
+    self.assertTrue(server.running)
+    self.assertEqual(server.handle({"command" : "shutdown"}), {})
+    self.assertFalse(server.running)
+
+  def test_max_sessions(self):
+    server = FakeSessionServer(max_sessions = 2)
+    for binary in ["a", "b", "a", "c"]:
+      server.handle(self.compile_request(binary))
+
+    # b was the least recently used session when c was added
+    self.assertEqual(server.handle({"command" : "status"}), {"sessions" : [
+      {"files" : ["a"], "requests" : 2},
+      {"files" : ["c"], "requests" : 1},
+    ]})
+    server.handle(self.compile_request("b"))
+    self.assertEqual([session["files"] for session in server.handle({"command" : "status"})["sessions"]], [["c"], ["b"]])
+
+  def test_session_bad_bytes(self):
+    self.check_session_bad_bytes(1)
+
+  def test_session_bad_bytes_in_parallel(self):
+    self.check_session_bad_bytes(2) # The worker processes are forked, so they have the fake finders too
+
+  def check_session_bad_bytes(self, processes):
+    arch = archinfo.ArchAMD64()
+    (rsp, rax) = (arch.registers['rsp'][0], arch.registers['rax'][0])
+    session = daemon.CompileSession([("a", None, 0x10000), ("b", None, 0x20000)], [], arch)
+    session.file_handler.processes = processes
+    session.file_handler.finders = [
+      FakeFinder([LoadMem(arch, 0x10b00, [rsp], [rax], [0], [], 0x10, 0x8)]),
+      FakeFinder([LoadMem(arch, 0x20100, [rsp], [rax], [0], [], 0x10, 0x8)]), # The same gadget, in the other file
+    ]
+
+    # Without bad bytes, the first file's copy of the gadget is used
+    gadgets, search_state = session.get_gadgets()
+    self.assertEqual([gadget.address for gadget in gadgets.foreach()], [0x10b00])
+
+    # but its address has a bad byte, so the second file's copy is used instead
+    gadgets, search_state = session.get_gadgets(["\x0b"])
+    self.assertEqual([gadget.address for gadget in gadgets.foreach()], [0x20100])
+    self.assertIs(session.get_gadgets(["\x0b"])[1], search_state)
+
+    # Moving the files filters the gadgets again, since the addresses with bad bytes change
+    session.rebase([0x10000, 0x20000])
+    self.assertIs(session.get_gadgets(["\x0b"])[1], search_state)
+    session.rebase([0x10000, 0x0b0000])
+    gadgets, new_search_state = session.get_gadgets(["\x0b"])
+    self.assertIsNot(new_search_state, search_state)
+    self.assertEqual([gadget.address for gadget in gadgets.foreach()], [])
+    session.rebase([0x10000, 0x30000])
+    self.assertEqual([gadget.address for gadget in session.get_gadgets(["\x0b"])[0].foreach()], [0x30100])
+    self.assertEqual([gadget.address for gadget in session.get_gadgets()[0].foreach()], [0x10b00])
+
+if __name__ == '__main__':
+  unittest.main()
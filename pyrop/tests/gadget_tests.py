@@ -1,8 +1,13 @@
-import unittest, logging
+import unittest, logging, struct, pickle
 import pyvex, archinfo
 
 from rop_compiler.gadget import *
-import rop_compiler.utils as utils
+import rop_compiler.utils as utils, rop_compiler.stats as stats
+
+try:
+  import rop_compiler.columnar_gadget_list as columnar_gadget_list
+except ImportError: # numpy isn't installed
+  columnar_gadget_list = None
 
 def n2r(arch, reg_name):
   return arch.registers[reg_name][0]
@@ -186,6 +191,282 @@ class GadgetTests(unittest.TestCase):
     self.assertEqual(chain[40:48], "CCCCCCCC") # check rdx
     self.assertEqual(len(chain), 48)
 
+  def test_create_load_registers_chain_with_bad_bytes(self):
+    a = archinfo.ArchAMD64()
+    gadget_list = self.make_gadget_list(a, [
+      (0x40100, LoadMem,      ['rsp'],        ['rbx'], [0x00], [], 0x10, 0x8),
+      (0x40200, LoadMem,      ['rsp'],        ['rcx'], [0x00], [], 0x10, 0x8),
+      (0x40300, XorGadget,    ['rbx', 'rcx'], ['rax'], [],     [], 0x8,  0x0),
+      (0x40400, LoadConst,    ['rsp'],        ['rdx'], [0x0a], [], 0x8,  0x0),
+    ])
+    gadget_list.bad_bytes = ["\x00", "\x0a"]
+
+    # rax is set by xoring two values without bad bytes, and rdx is set by a LoadConst gadget
+    register_values = {n2r(a, 'rax') : 0x0a00, n2r(a, 'rdx') : 0x0a}
+    chain, first_address = gadget_list.create_load_registers_chain(0x4343434343434343, n2r(a, 'rsp'), register_values)
+    self.assertNotEqual(chain, None)
+    rbx, rcx = struct.unpack("<Q", chain[0:8])[0], struct.unpack("<Q", chain[16:24])[0]
+    self.assertEqual(rbx ^ rcx, 0x0a00)
+    self.assertFalse(any([bad in chain[0:8] + chain[16:24] for bad in gadget_list.bad_bytes])) # check the loaded values
+    self.assertEqual(chain[32:40], utils.ap(0x40400, a)) # rdx is set after rax
+    self.assertEqual(chain[40:48], "CCCCCCCC") # Check rip
+    self.assertEqual(len(chain), 48)
+
+    # There's no way to make rsi without bad bytes
+    chain, first_address = gadget_list.create_load_registers_chain(0x4343434343434343, n2r(a, 'rsp'), {n2r(a, 'rsi') : 0x0a00})
+    self.assertEqual(chain, None)
+
+    # Until a gadget that can is added
+    gadget_list.add_gadget(LoadConst(a, 0x40500, [n2r(a, 'rsp')], [n2r(a, 'rsi')], [0x0a00], [], 0x8, 0x0))
+    chain, first_address = gadget_list.create_load_registers_chain(0x4343434343434343, n2r(a, 'rsp'), {n2r(a, 'rsi') : 0x0a00})
+    self.assertEqual(chain, utils.ap(0x4343434343434343, a))
+    self.assertEqual(first_address, 0x40500)
+
+    # or merged in
+    chain, first_address = gadget_list.create_load_registers_chain(0x4343434343434343, n2r(a, 'rsp'), {n2r(a, 'rdi') : 0x0a00})
+    self.assertEqual(chain, None)
+    gadget_list.merge([self.make_gadget_list(a, [(0x40600, LoadConst, ['rsp'], ['rdi'], [0x0a00], [], 0x8, 0x0)])])
+    chain, first_address = gadget_list.create_load_registers_chain(0x4343434343434343, n2r(a, 'rsp'), {n2r(a, 'rdi') : 0x0a00})
+    self.assertEqual(first_address, 0x40600)
+
+  def test_load_const_index(self):
+    a = archinfo.ArchAMD64()
+    r = lambda *names: [n2r(a, name) for name in names]
+    gadget_list = self.make_gadget_list(a, [
+      (0x40100, LoadConst, ['rsp'], ['rdi'], [0x00], ['rbx', 'rcx'], 0x8, 0x0),
+      (0x40200, LoadConst, ['rsp'], ['rdi'], [0x00], ['rdx'],        0x8, 0x0),
+      (0x40300, LoadConst, ['rsp'], ['rdi'], [0x00], ['rbx'],        0x8, 0x0), # As complex as 0x40200, so it stays after it
+      (0x40400, LoadConst, ['rsp'], ['rdi'], [0x00], ['rcx'],        0x8, 0x0),
+      (0x40500, LoadConst, ['rsp'], ['rsi'], [0x00], [],             0x8, 0x0),
+      (0x40600, LoadConst, ['rsp'], ['rdi'], [0x01], [],             0x8, 0x0),
+    ])
+    self.assertEqual([gadget.address for gadget in gadget_list.load_consts[(n2r(a, 'rdi'), 0x00)]],
+      [0x40200, 0x40300, 0x40400, 0x40100])
+    self.assertEqual(gadget_list.get_load_const_values(n2r(a, 'rdi')), set([0x00, 0x01]))
+
+    self.assertEqual(gadget_list.find_load_const_gadget(n2r(a, 'rdi'), 0x00).address, 0x40200)
+    self.assertEqual(gadget_list.find_load_const_gadget(n2r(a, 'rdi'), 0x00, r('rdx')).address, 0x40300)
+    self.assertEqual(gadget_list.find_load_const_gadget(n2r(a, 'rdi'), 0x00, r('rdx', 'rbx')).address, 0x40400)
+    self.assertEqual(gadget_list.find_load_const_gadget(n2r(a, 'rdi'), 0x00, r('rdx', 'rbx', 'rcx')), None)
+    self.assertEqual(gadget_list.find_load_const_gadget(n2r(a, 'rdi'), 0x02), None)
+    self.assertEqual(gadget_list.find_load_const_gadget(n2r(a, 'rdx'), 0x00), None)
+
+    # The index is kept up to date as gadgets are added
+    gadget_list.add_gadget(LoadConst(a, 0x40700, r('rsp'), r('rdi'), [0x00], r('rsi'), 0x8, 0x0))
+    gadget_list.add_gadget(LoadConst(a, 0x40800, r('rsp'), r('rdi'), [0x00], [], 0x8, 0x0))
+    self.assertEqual([gadget.address for gadget in gadget_list.load_consts[(n2r(a, 'rdi'), 0x00)]],
+      [0x40800, 0x40200, 0x40300, 0x40400, 0x40700, 0x40100])
+    self.assertEqual(gadget_list.find_load_const_gadget(n2r(a, 'rdi'), 0x00, r('rdx', 'rbx', 'rcx')).address, 0x40800)
+
+  def test_load_registers_with_load_consts(self):
+    a = archinfo.ArchAMD64()
+    gadget_list = self.make_gadget_list(a, [
+      (0x40100, LoadConst, ['rsp'], ['rdi'], [0x00], [], 0x8, 0x0),
+      (0x40200, LoadConst, ['rsp'], ['rsi'], [0x00], [], 0x8, 0x0),
+    ])
+
+    # Neither register can be loaded from the stack, so both are set with LoadConst gadgets
+    registers = {n2r(a, 'rdi') : 0x00, n2r(a, 'rsi') : 0x00}
+    gadgets = gadget_list.get_load_registers_gadgets(n2r(a, 'rsp'), registers)
+    self.assertEqual(sorted([gadget.address for gadget in gadgets]), [0x40100, 0x40200])
+    self.assertEqual(gadget_list.get_load_registers_gadgets(n2r(a, 'rsp'), {n2r(a, 'rdi') : 0x00, n2r(a, 'rsi') : 0x01}), None)
+
+  def test_load_registers_memo(self):
+    a = archinfo.ArchAMD64()
+    (rsp, rdi, rsi) = (n2r(a, 'rsp'), n2r(a, 'rdi'), n2r(a, 'rsi'))
+    gadget_list = self.make_gadget_list(a, [
+      (0x40100, LoadMem,   ['rsp'], ['rdi'], [0x00], ['rbx'], 0x10, 0x8),
+      (0x40200, LoadMem,   ['rsp'], ['rsi'], [0x00], [],      0x10, 0x8),
+      (0x40300, LoadConst, ['rsp'], ['rdi'], [0x00], [],      0x8,  0x0),
+    ])
+    addresses = lambda gadgets: sorted([gadget.address for gadget in gadgets])
+
+    stats_state = stats.start_collection()
+    try:
+      gadgets = gadget_list.get_load_registers_gadgets(rsp, {rdi : 5, rsi : 6})
+      self.assertEqual(addresses(gadgets), [0x40100, 0x40200])
+      gadgets.append(None) # The callers can change the list they get back without changing the memo
+      hits = stats.counters["gadget_list.load_registers_memo_hits"]
+
+      # No LoadConst gadget can set these values either, so they're loaded from the stack the same way
+      self.assertEqual(addresses(gadget_list.get_load_registers_gadgets(rsp, {rdi : 7, rsi : 8})), [0x40100, 0x40200])
+      self.assertEqual(stats.counters["gadget_list.load_registers_memo_hits"], hits + 1)
+
+      # but a LoadConst gadget can set rdi to 0, which changes the answer
+      self.assertEqual(addresses(gadget_list.get_load_registers_gadgets(rsp, {rdi : 0, rsi : 8})), [0x40200, 0x40300])
+      self.assertEqual(addresses(gadget_list.get_load_registers_gadgets(rsp, {rdi : 0})), [0x40300])
+      self.assertEqual(addresses(gadget_list.get_load_registers_gadgets(rsp, {rdi : 1})), [0x40100])
+    finally:
+      stats.finish_collection(stats_state)
+
+  def test_merge(self):
+    a = archinfo.ArchAMD64()
+    first = self.make_gadget_list(a, [
+      (0x40100, LoadMem,   ['rsp'], ['rbx'], [0x00], [], 0x10, 0x8),
+      (0x40200, LoadConst, ['rsp'], ['rdx'], [0x0a], [], 0x8,  0x0),
+    ])
+    second = self.make_gadget_list(a, [
+      (0x80100, LoadMem,   ['rsp'], ['rbx'], [0x00], [], 0x10, 0x8), # Does the same thing as 0x40100, so it's dropped
+      (0x80200, LoadMem,   ['rsp'], ['rcx'], [0x00], [], 0x10, 0x8),
+      (0x80300, LoadConst, ['rsp'], ['rdx'], [0x0a], [], 0x10, 0x0),
+    ])
+    first.merge([second])
+    self.assertEqual(sorted([gadget.address for gadget in first.foreach()]), [0x40100, 0x40200, 0x80200, 0x80300])
+    self.assertEqual([gadget.address for gadget in first.foreach_type_output(LoadMem, n2r(a, 'rbx'))], [0x40100])
+    self.assertEqual([gadget.address for gadget in first.load_consts[(n2r(a, 'rdx'), 0x0a)]], [0x40200, 0x80300])
+    self.assertEqual(first.find_gadget(LoadMem, [n2r(a, 'rsp')], [n2r(a, 'rcx')]).address, 0x80200)
+
+  def test_add_gadget_aliases(self):
+    a = archinfo.ArchAMD64()
+    gadget_list = self.make_gadget_list(a, [
+      (0x40100, LoadMem, ['rsp'], ['rbx'], [0x00], [],      0x10, 0x8),
+      (0x40200, LoadMem, ['rsp'], ['rbx'], [0x00], [],      0x10, 0x8), # The same as 0x40100
+      (0x40300, LoadMem, ['rsp'], ['rbx'], [0x00], ['rcx'], 0x10, 0x8), # Clobbers rcx, so it's different
+    ])
+
+    # The duplicate is an alias of the first gadget, rather than another gadget to search through
+    self.assertEqual([gadget.address for gadget in gadget_list.foreach()], [0x40100, 0x40300])
+    gadget = gadget_list.find_gadget(LoadMem, [n2r(a, 'rsp')], [n2r(a, 'rbx')])
+    self.assertEqual(gadget.all_addresses(), [0x40100, 0x40200])
+
+    # Adding the same gadget again, or one with merge_aliases False, doesn't add any aliases
+    gadget_list.add_gadget(gadget)
+    gadget_list.add_gadget(LoadMem(a, 0x40400, [n2r(a, 'rsp')], [n2r(a, 'rbx')], [0x00], [], 0x10, 0x8), False)
+    self.assertEqual(gadget.all_addresses(), [0x40100, 0x40200])
+
+    # Moving the gadgets moves their aliases too
+    gadget_list.adjust_base_address(0x1000)
+    self.assertEqual(gadget.all_addresses(), [0x41100, 0x41200])
+
+  def test_avoid_bad_bytes(self):
+    a = archinfo.ArchAMD64()
+    gadget = LoadMem(a, 0x40a00, [n2r(a, 'rsp')], [n2r(a, 'rbx')], [0x00], [], 0x10, 0x8)
+    self.assertFalse(gadget.avoid_bad_bytes(["\x0a"])) # No aliases to switch to
+    self.assertTrue(gadget.avoid_bad_bytes(["\x0b"])) # The address is already fine
+    self.assertEqual(gadget.address, 0x40a00)
+
+    # The gadget switches to its first clean alias, and keeps its old address as an alias
+    gadget.add_aliases([0x50a00, 0x40b00, 0x40c00])
+    self.assertTrue(gadget.avoid_bad_bytes(["\x0a"]))
+    self.assertEqual(gadget.address, 0x40b00)
+    self.assertEqual(gadget.all_addresses(), [0x40b00, 0x50a00, 0x40a00, 0x40c00])
+
+    # A gadget list with bad bytes switches to a clean address when a duplicate is added
+    gadget_list = GadgetList(bad_bytes = ["\x0a"])
+    gadget_list.add_gadget(LoadMem(a, 0x40a00, [n2r(a, 'rsp')], [n2r(a, 'rbx')], [0x00], [], 0x10, 0x8))
+    gadget_list.add_gadget(LoadMem(a, 0x40d00, [n2r(a, 'rsp')], [n2r(a, 'rbx')], [0x00], [], 0x10, 0x8))
+    self.assertEqual(gadget_list.find_load_stack_gadget(n2r(a, 'rbx')).all_addresses(), [0x40d00, 0x40a00])
+
+  def test_setstate(self):
+    a = archinfo.ArchAMD64()
+    (rsp, rbx, rcx) = (n2r(a, 'rsp'), n2r(a, 'rbx'), n2r(a, 'rcx'))
+    gadget = LoadMem(a, 0x40100, [rsp], [rbx], [0x00], [rcx], 0x10, 0x8)
+    gadget.add_aliases([0x40200])
+    copy = pickle.loads(pickle.dumps(gadget, pickle.HIGHEST_PROTOCOL))
+    self.assertEqual(copy.signature(), gadget.signature())
+    self.assertEqual(copy.all_addresses(), [0x40100, 0x40200])
+
+    # Gadget files saved before gadgets had aliases store 8-tuples
+    old = LoadMem.__new__(LoadMem)
+    old.__setstate__((("AMD64", a.memory_endness), 0x40100, [rsp], [rbx], [0x00], [rcx], 0x10, 0x8))
+    self.assertEqual(old.signature(), gadget.signature())
+    self.assertEqual(old.all_addresses(), [0x40100])
+
+    # and ones saved before gadgets were slotted store the __dict__, with just the arch's name
+    old = LoadMem.__new__(LoadMem)
+    old.__setstate__({'arch' : "AMD64", 'address' : 0x40100, 'inputs' : [rsp], 'outputs' : [rbx], 'params' : [0x00],
+      'clobber' : [rcx], 'stack_offset' : 0x10, 'ip_in_stack_offset' : 0x8})
+    self.assertEqual(old.signature(), gadget.signature())
+    self.assertEqual(old.all_addresses(), [0x40100])
+    self.assertEqual(old.inputs, (rsp,))
+
+  def test_pickle_gadget_list(self):
+    a = archinfo.ArchAMD64()
+    gadget_list = self.make_gadget_list(a, [
+      (0x40100, LoadMem,   ['rsp'], ['rbx'], [0x00], [],      0x10, 0x8),
+      (0x40200, LoadMem,   ['rsp'], ['rbx'], [0x00], [],      0x10, 0x8), # An alias of 0x40100
+      (0x40300, LoadMem,   ['rsp'], ['rcx'], [0x00], ['rdx'], 0x10, 0x8),
+      (0x40400, LoadConst, ['rsp'], ['rdx'], [0x0a], [],      0x8,  0x0),
+    ])
+    copy = pickle.loads(pickle.dumps(gadget_list, pickle.HIGHEST_PROTOCOL))
+    self.assertEqual(copy.strategy, BEST)
+    self.assertEqual(copy.arch.name, a.name)
+
+    # The indexes come across with the gadgets, rather than being built again
+    self.assertEqual([gadget.address for gadget in copy.foreach()], [0x40100, 0x40300, 0x40400])
+    rbx = copy.find_load_stack_gadget(n2r(a, 'rbx'))
+    self.assertEqual(rbx.all_addresses(), [0x40100, 0x40200])
+    self.assertIs(list(copy.foreach_type_output(LoadMem, n2r(a, 'rbx')))[0], rbx)
+    self.assertEqual(copy.find_load_const_gadget(n2r(a, 'rdx'), 0x0a).address, 0x40400)
+    self.assertEqual(copy.get_load_const_values(n2r(a, 'rdx')), set([0x0a]))
+
+    # Equivalent gadgets added later are still found, and merging the copy drops the duplicates
+    copy.add_gadget(LoadMem(a, 0x40500, [n2r(a, 'rsp')], [n2r(a, 'rbx')], [0x00], [], 0x10, 0x8))
+    self.assertEqual(rbx.all_addresses(), [0x40100, 0x40200, 0x40500])
+    merged = GadgetList()
+    merged.merge([gadget_list, copy])
+    self.assertEqual([gadget.address for gadget in merged.foreach_type(LoadMem)], [0x40100, 0x40300])
+
+  def test_synthesize_with_moves(self):
+    a = archinfo.ArchAMD64()
+    r = lambda *names: [n2r(a, name) for name in names]
+    gadget_list = self.make_gadget_list(a, [
+      (0x40100, LoadMem, ['rsp'], ['rax'], [0x00], [],      0x10, 0x8),
+      (0x40200, MoveReg, ['rax'], ['rbx'], [],     [],      0x8,  0x0),
+      (0x40300, MoveReg, ['rbx'], ['rcx'], [],     [],      0x8,  0x0),
+      (0x40400, MoveReg, ['rax'], ['rdx'], [],     ['rsi'], 0x8,  0x0),
+      (0x40500, MoveReg, ['rdx'], ['rcx'], [],     [],      0x8,  0x0),
+    ])
+
+    # rcx is loaded through rbx, or through rdx when rbx can't be clobbered
+    gadget = gadget_list.find_gadget(LoadMem, r('rsp'), r('rcx'))
+    self.assertEqual([g.address for g in gadget.gadgets], [0x40100, 0x40200, 0x40300])
+    self.assertEqual([g.address for g in gadget_list.find_gadget(LoadMem, r('rsp'), r('rcx'), r('rbx')).gadgets],
+      [0x40100, 0x40400, 0x40500])
+    self.assertEqual(gadget_list.find_gadget(LoadMem, r('rsp'), r('rcx'), r('rbx', 'rsi')), None)
+
+    # The synthesized gadgets are reused until a new gadget is added
+    self.assertIs(gadget_list.find_gadget(LoadMem, r('rsp'), r('rcx')), gadget)
+    gadget_list.add_gadget(MoveReg(a, 0x40600, r('rax'), r('rcx'), [], [], 0x8, 0x0))
+    self.assertEqual([g.address for g in gadget_list.find_gadget(LoadMem, r('rsp'), r('rcx')).gadgets], [0x40100, 0x40600])
+
+  @unittest.skipIf(columnar_gadget_list == None, "numpy is not installed")
+  def test_columnar_gadget_list(self):
+    a = archinfo.ArchAMD64()
+    gadgets = self.make_gadget_list(a, [
+      (0x40100, LoadMem,   ['rsp'], ['rbx'], [0x00], ['rcx'], 0x10, 0x8),
+      (0x40200, LoadMem,   ['rsp'], ['rbx'], [0x08], [],      0x18, 0x10),
+      (0x40300, LoadMem,   ['rsp'], ['rbx'], [0x00], ['rdx'], 0x10, 0x8), # As complex as 0x40100, which was added first
+      (0x40400, LoadMem,   ['rsp'], ['rax'], [0x00], ['rdi'], 0x10, 0x8),
+      (0x40500, MoveReg,   ['rax'], ['rsi'], [],     [],      0x8,  0x0),
+      (0x40600, AddGadget, ['rax', 'rbx'], ['rax'], [], ['r8'], 0x8, 0x0),
+      (0x40700, AddGadget, ['rbx', 'rcx'], ['rax'], [], [],   0x8,  0x0),
+    ]).foreach()
+    gadget_list = GadgetList(list(gadgets))
+    columnar = columnar_gadget_list.ColumnarGadgetList(gadget_list.foreach())
+
+    def addresses(gadgets):
+      return [gadget.address if gadget != None else None for gadget in gadgets]
+    def check(method, *args):
+      self.assertEqual(addresses([getattr(columnar, method)(*args)]), addresses([getattr(gadget_list, method)(*args)]))
+    def check_iter(method, *args):
+      self.assertEqual(addresses(getattr(columnar, method)(*args)), addresses(getattr(gadget_list, method)(*args)))
+
+    r = lambda *names: [n2r(a, name) for name in names]
+    for no_clobber in [None, [], r('rcx'), r('rcx', 'rdx'), r('rbx'), r('r15')]:
+      check("find_gadget", LoadMem, r('rsp'), r('rbx'), no_clobber)
+      check("find_gadget", AddGadget, r('rax', 'rbx'), r('rax'), no_clobber)
+      check_iter("foreach_type", LoadMem, no_clobber)
+      check_iter("foreach_type", AddGadget, no_clobber, r('rbx', 'rcx'))
+      check_iter("foreach_type_output", LoadMem, n2r(a, 'rbx'), no_clobber)
+      check_iter("foreach_type_output", MoveReg, n2r(a, 'rsi'), no_clobber)
+    check("find_gadget", LoadMem, r('rsp'), r('rsi'), r('rdi')) # Neither list can synthesize one without clobbering rdi
+    self.assertEqual(addresses(columnar.find_gadget(LoadMem, r('rsp'), r('rsi')).gadgets), [0x40400, 0x40500])
+
+    # Adding a gadget updates the columns
+    columnar.add_gadget(LoadMem(a, 0x40800, r('rsp'), r('rbx'), [], [], 0x8, 0x0))
+    self.assertEqual(columnar.find_gadget(LoadMem, r('rsp'), r('rbx'), r('rcx')).address, 0x40800)
+
   def skip_test_arm(self):
     arch = archinfo.ArchARM()
     tests = [
@@ -0,0 +1,41 @@
+import unittest, subprocess, sys, os, json
+
+"""The modules that are slow to import, and which runs that don't need them shouldn't import"""
+HEAVY_MODULES = ['z3', 'pyvex', 'archinfo', 'cle', 'pwn', 'elftools', 'r2']
+
+"""The most time (in seconds) that importing each of the entry points may take"""
+IMPORT_TIME_BUDGET = 0.25
+
+class ImportTests(unittest.TestCase):
+
+  def run_python(self, code):
+    """Runs some code in a fresh interpreter (so nothing is already imported) and returns what it prints, as json"""
+    env = dict(os.environ)
+    pyrop_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = pyrop_dir + os.pathsep + env.get("PYTHONPATH", "")
+    code = "import sys, time, json\n" + code
+    return json.loads(subprocess.check_output([sys.executable, "-c", code], env = env).strip().splitlines()[-1])
+
+  def test_import_time(self):
+    for module in ["rop_compiler.ropme", "rop_compiler.daemon", "rop_compiler.file_finder"]:
+      self.run_python("import {}\nprint '[]'".format(module)) # Make sure the .pyc files are written before timing anything
+      (seconds, imported) = self.run_python("start = time.time()\nimport {}\nelapsed = time.time() - start\n".format(module)
+        + "print json.dumps([elapsed, [name for name in {!r} if name in sys.modules]])".format(HEAVY_MODULES))
+      self.assertEqual(imported, [], "{} imported {}".format(module, ", ".join(imported)))
+      self.assertLess(seconds, IMPORT_TIME_BUDGET, "Importing {} took {:.3f}s".format(module, seconds))
+
+  def test_load_gadget_file(self):
+    # Loading a gadget file needs archinfo for the gadgets' arch, but shouldn't need z3 or pyvex's lifter
+    imported = self.run_python("\n".join([
+      "import archinfo",
+      "import rop_compiler.gadget as ga",
+      "arch = archinfo.ArchAMD64()",
+      "rsp, rdi = arch.registers['rsp'][0], arch.registers['rdi'][0]",
+      "gadget_list = ga.GadgetList([ga.LoadMem(arch, 0x401000, [rsp], [rdi], [0], [], 0x10, 8)])",
+      "gadget_list = ga.from_string(gadget_list.to_string())",
+      "assert gadget_list.find_load_stack_gadget(rdi).address == 0x401000",
+      "print json.dumps([name for name in ['z3', 'cle', 'rop_compiler.classifier'] if name in sys.modules])"]))
+    self.assertEqual(imported, [])
+
+if __name__ == '__main__':
+  unittest.main()
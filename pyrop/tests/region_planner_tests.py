@@ -0,0 +1,45 @@
+import unittest
+import archinfo
+
+import rop_compiler.region_planner as region_planner
+from rop_compiler.gadget import *
+
+class RegionPlannerTests(unittest.TestCase):
+
+  def setUp(self):
+    self.arch = archinfo.ArchAMD64()
+    self.rdi = self.arch.registers['rdi'][0]
+    size = region_planner.RegionPlanner.REGION_SIZE
+    # Region 0 has nothing, region 1 has a few returns, region 2 has pops of rdi, region 3 is the .plt
+    self.data = memoryview("\x90" * size + ("\xc3" * 8).ljust(size, "\x90") + ("\x5f\xc3" * 8).ljust(size, "\x90") +
+      "\x90" * size)
+    self.plt_range = (0x400000 + 3 * size, 0x100)
+
+  def get_order(self, planner):
+    regions = list(planner.iter_regions(0, self.data, 0x400000))
+    return [start / planner.REGION_SIZE for (n, d, a, start, end) in planner.order("prog", regions, [self.plt_range])]
+
+  def test_order(self):
+    planner = region_planner.RegionPlanner(self.arch, [self.rdi])
+    self.assertEqual(self.get_order(planner), [3, 2, 1, 0])
+
+    # A region's history outranks any guess, and a region that had no useful gadgets goes last
+    regions = list(planner.iter_regions(0, self.data, 0x400000))
+    planner.record("prog", regions[0], 5)
+    planner.record("prog", regions[3], 0)
+    self.assertEqual(self.get_order(planner), [0, 2, 1, 3])
+
+    # The history can be saved for later scans
+    later = region_planner.RegionPlanner(self.arch, [self.rdi])
+    later.load_history(planner.to_string())
+    self.assertEqual(self.get_order(later), [0, 2, 1, 3])
+
+  def test_is_useful(self):
+    planner = region_planner.RegionPlanner(self.arch, [self.rdi])
+    rsp, rax = self.arch.registers['rsp'][0], self.arch.registers['rax'][0]
+    self.assertTrue(planner.is_useful(LoadMem(self.arch, 0x1000, [rsp], [rax], [0], [], 0x10, 0x8)))
+    self.assertTrue(planner.is_useful(MoveReg(self.arch, 0x1000, [rax], [self.rdi], [], [], 0x8, 0x0)))
+    self.assertFalse(planner.is_useful(MoveReg(self.arch, 0x1000, [self.rdi], [rax], [], [], 0x8, 0x0)))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import archinfo
+
+import rop_compiler.retention as retention
+from rop_compiler.gadget import *
+
+class RetentionPolicyTests(unittest.TestCase):
+
+  def setUp(self):
+    self.arch = archinfo.ArchAMD64()
+
+  def r(self, *names):
+    return [self.arch.registers[name][0] for name in names]
+
+  def gadget(self, gadget_type, address, inputs, outputs, params = [], clobber = []):
+    # Each clobbered register adds one to the gadget's complexity
+    return gadget_type(self.arch, address, self.r(*inputs), self.r(*outputs), params, self.r(*clobber), 0x10, 0x8)
+
+  def addresses(self, policy):
+    return sorted([gadget.address for gadget in policy.gadgets()])
+
+  def test_keeps_least_complex(self):
+    policy = retention.RetentionPolicy(2)
+    kept = [policy.add_gadget(self.gadget(LoadMem, address, ['rsp'], ['rax'], [0], clobber)) for (address, clobber) in [
+      (0x40100, ['rbx', 'rcx']),
+      (0x40200, ['rbx']),
+      (0x40300, ['rbx', 'rcx', 'rdx']), # More complex than both of the kept gadgets, so it's never kept
+      (0x40400, []),                    # Replaces 0x40100
+    ]]
+    self.assertEqual(kept, [True, True, False, True])
+    self.assertEqual(self.addresses(policy), [0x40200, 0x40400])
+    self.assertEqual(policy.num_dropped(), 2)
+    self.assertEqual(policy.dropped, {"LoadMem" : 2})
+
+    # Gadgets with other inputs or outputs have their own slots
+    policy.add_gadget(self.gadget(LoadMem, 0x40500, ['rsp'], ['rbx'], [0], ['rcx', 'rdx']))
+    policy.add_gadget(self.gadget(MoveReg, 0x40600, ['rax'], ['rbx'], [], ['rcx', 'rdx']))
+    self.assertEqual(self.addresses(policy), [0x40200, 0x40400, 0x40500, 0x40600])
+
+  def test_aliases(self):
+    policy = retention.RetentionPolicy(1)
+    first = self.gadget(LoadMem, 0x40100, ['rsp'], ['rax'], [0])
+    self.assertTrue(policy.add_gadget(first))
+    self.assertTrue(policy.add_gadget(self.gadget(LoadMem, 0x40200, ['rsp'], ['rax'], [0]))) # Doesn't take up a slot
+    self.assertEqual(policy.gadgets(), [first])
+    self.assertEqual(first.all_addresses(), [0x40100, 0x40200])
+    self.assertEqual(policy.num_dropped(), 0)
+
+  def test_prefers_clean_addresses(self):
+    policy = retention.RetentionPolicy(1, ["\x0a"])
+    policy.add_gadget(self.gadget(LoadMem, 0x40a00, ['rsp'], ['rax'], [0]))
+    policy.add_gadget(self.gadget(LoadMem, 0x40100, ['rsp'], ['rax'], [0], ['rbx'])) # More complex, but no bad bytes
+    self.assertEqual(self.addresses(policy), [0x40100])
+
+    # A gadget with a bad address is switched to a clean alias before it's ranked
+    policy = retention.RetentionPolicy(1, ["\x0a"])
+    gadget = self.gadget(LoadMem, 0x40a00, ['rsp'], ['rax'], [0])
+    gadget.add_aliases([0x40200])
+    policy.add_gadget(gadget)
+    policy.add_gadget(self.gadget(LoadMem, 0x40100, ['rsp'], ['rax'], [0], ['rbx']))
+    self.assertEqual(self.addresses(policy), [0x40200])
+
+  def test_value_gadgets(self):
+    policy = retention.RetentionPolicy(1)
+    for (address, gadget_type, params, clobber) in [
+        (0x40100, LoadConst,       [0],  []),
+        (0x40200, LoadConst,       [1],  ['rbx']), # A different value than 0x40100, so it isn't dropped
+        (0x40300, LoadConst,       [1],  []),      # The same value as 0x40200, but less complex
+        (0x40400, AddConstGadget,  [8],  []),
+        (0x40500, AddConstGadget,  [16], []),
+        (0x40600, LoadMem,         [0],  []),
+        (0x40700, LoadMem,         [8],  ['rbx']), # The params of other gadgets don't matter
+      ]:
+      inputs = ['rsp'] if gadget_type != AddConstGadget else ['rax']
+      policy.add_gadget(self.gadget(gadget_type, address, inputs, ['rax'], params, clobber))
+    self.assertEqual(self.addresses(policy), [0x40100, 0x40300, 0x40400, 0x40500, 0x40600])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,82 @@
+import unittest, tempfile, shutil, os
+import archinfo
+
+from rop_compiler.scan_cache import *
+import rop_compiler.gadget as ga, rop_compiler.memory_finder as memory_finder, rop_compiler.region_planner as region_planner
+
+class ScanCacheTests(unittest.TestCase):
+
+  def test_amd64(self):
+    arch = archinfo.ArchAMD64()
+    rax, rdi, rsp = arch.registers['rax'][0], arch.registers['rdi'][0], arch.registers['rsp'][0]
+    cache = ScanCache()
+    code = ("\x90" * 0xfff + "\x5f\xc3") * 3
+    pages = cache.split_pages(arch, memoryview(code), 0, len(code))
+    self.assertEqual(pages, [(0, 0x1001), (0x1001, 0x2002), (0x2002, 0x3003)]) # Each page ends after a return
+
+    key = cache.page_key(arch, memoryview(code), 0, 0x1001, False)
+    self.assertEqual(key, cache.page_key(arch, memoryview("\xcc" + code), 1, 0x1002, False))
+    self.assertNotEqual(key, cache.page_key(arch, memoryview(code), 0, 0x1001, True))
+    cache.record(key, 0x400000, cache.snapshot([
+      ga.LoadMem(arch, 0x400fff, [rsp], [rdi], [0], [], 0x10, 8),
+      ga.LoadConst(arch, 0x400800, [], [rax], [0x401000], [], 8, 0)]))
+
+    # Reusing the page at a new address moves the gadgets, except those that have to be classified again
+    new_cache = ScanCache()
+    new_cache.load(cache.to_string())
+    self.assertEqual(new_cache.lookup("\x00" * 20, 0x400000), (None, None))
+    (gadgets, stale) = new_cache.lookup(key, 0x400000)
+    self.assertEqual([gadget.address for gadget in gadgets], [0x400fff, 0x400800])
+    self.assertEqual(stale, [])
+    (gadgets, stale) = new_cache.lookup(key, 0x400010)
+    self.assertEqual([gadget.address for gadget in gadgets], [0x40100f])
+    self.assertEqual(stale, [0x400810])
+
+  def scan(self, cache, bad_bytes = None, budget = None, filename = '../example/bof'):
+    finder = memory_finder.MemoryFinder(filename, archinfo.ArchAMD64())
+    finder.find_gadgets(bad_bytes = bad_bytes, budget = budget, scan_cache = cache)
+    return cache
+
+  def test_partial_scans(self):
+    full = pickle.loads(self.scan(ScanCache()).to_string())
+    self.assertNotEqual(len(full), 0)
+
+    # Scans that don't record any pages (because they stop early, or can't reuse pages scanned with bad bytes) keep the
+    # pages from the previous scans
+    for (bad_bytes, budget) in [(None, region_planner.ScanBudget(max_addresses = 0)), (["\x00"], None)]:
+      cache = ScanCache()
+      cache.load(pickle.dumps(full))
+      self.assertEqual(pickle.loads(self.scan(cache, bad_bytes, budget).to_string()), full)
+
+    # A scan of another file keeps the pages of the files scanned before it, as well as adding its own
+    other = ScanCache()
+    other.record("\x00" * 20, 0x400000, [], "other")
+    cache = ScanCache()
+    cache.load(other.to_string())
+    pages = pickle.loads(self.scan(cache).to_string())
+    self.assertEqual(sorted(pages.keys()), sorted(full.keys() + ["\x00" * 20]))
+    self.assertEqual(pages["\x00" * 20], other.current["\x00" * 20])
+
+  def test_new_build(self):
+    # Another build of bof, in a different directory, with some of the code changed
+    directory = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(directory, "bof")
+      shutil.copy('../example/bof', filename)
+      with open(filename, "r+b") as f:
+        f.seek(0x600) # In .text
+        f.write("\x90" * 0x10)
+
+      old = pickle.loads(self.scan(ScanCache()).to_string())
+      new = pickle.loads(self.scan(ScanCache(), filename = filename).to_string())
+      self.assertNotEqual(sorted(old.keys()), sorted(new.keys()))
+
+      # The old build's pages that were replaced by the new build's aren't kept
+      cache = ScanCache()
+      cache.load(pickle.dumps(old))
+      self.assertEqual(sorted(pickle.loads(self.scan(cache, filename = filename).to_string()).keys()), sorted(new.keys()))
+    finally:
+      shutil.rmtree(directory)
+
+if __name__ == '__main__':
+  unittest.main()
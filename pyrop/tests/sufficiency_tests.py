@@ -0,0 +1,69 @@
+import unittest
+import archinfo
+
+import rop_compiler.sufficiency as sufficiency
+import rop_compiler.goal as go
+from rop_compiler.gadget import *
+
+class SufficiencyOracleTests(unittest.TestCase):
+
+  def setUp(self):
+    self.arch = archinfo.ArchAMD64()
+
+  def r(self, *names):
+    return [self.arch.registers[name][0] for name in names]
+
+  def gadget(self, gadget_type, inputs, outputs, clobber = [], stack_offset = 0x10, ip_in_stack_offset = 0x8):
+    return gadget_type(self.arch, 0x40000, self.r(*inputs), self.r(*outputs), [0], self.r(*clobber), stack_offset,
+      ip_in_stack_offset)
+
+  def test_load_registers(self):
+    oracle = sufficiency.SufficiencyOracle(self.arch, self.r('rdi', 'rsi', 'rdx'))
+    oracle.add_gadget(self.gadget(LoadMem, ['rsp'], ['rdi']))
+    oracle.add_gadget(self.gadget(LoadMem, ['rsp'], ['rsi'], ['rax', 'rbx', 'rcx', 'r8', 'r9'])) # Too complex
+    self.assertFalse(oracle.can_load(self.r('rsi')[0]))
+
+    # rsi is loaded by moving rax through rbx
+    oracle.add_gadgets([self.gadget(LoadMem, ['rsp'], ['rax']), self.gadget(MoveReg, ['rbx'], ['rsi']),
+      self.gadget(MoveReg, ['rax'], ['rbx'])])
+    self.assertTrue(oracle.can_load(self.r('rsi')[0]))
+    self.assertFalse(oracle.is_sufficient())
+
+    # and rdx with a LoadMemJump to a loaded register
+    oracle.add_gadget(self.gadget(LoadMemJump, ['rsp', 'rax'], ['rdx'], ip_in_stack_offset = None))
+    self.assertTrue(oracle.is_sufficient())
+
+  def test_jump(self):
+    oracle = sufficiency.SufficiencyOracle(self.arch, self.r('rdi'), needs_jump = True)
+    oracle.add_gadgets([self.gadget(LoadMem, ['rsp'], ['rdi']), self.gadget(Jump, ['rax'], [], ip_in_stack_offset = None)])
+    self.assertFalse(oracle.is_sufficient()) # rax can't be set
+    oracle.add_gadget(self.gadget(LoadMem, ['rsp'], ['rax']))
+    self.assertTrue(oracle.is_sufficient())
+
+  def test_got_call(self):
+    oracle = sufficiency.SufficiencyOracle(self.arch, [], needs_jump = True, needs_got_call = True)
+    oracle.add_gadgets([self.gadget(LoadMem, ['rsp'], ['rax']), self.gadget(LoadMem, ['rsp'], ['rbx']),
+      self.gadget(LoadMem, ['rsp'], ['rcx']), self.gadget(Jump, ['rax'], [], ip_in_stack_offset = None),
+      self.gadget(LoadMem, ['rbx'], ['rax'])])
+    self.assertFalse(oracle.is_sufficient()) # Nothing adds the offset to rax
+    oracle.add_gadget(self.gadget(AddGadget, ['rax', 'rcx'], ['rax']))
+    self.assertTrue(oracle.is_sufficient())
+
+  def test_nothing_to_track(self):
+    oracle = sufficiency.SufficiencyOracle(self.arch, [])
+    oracle.add_gadget(self.gadget(LoadMem, ['rsp'], ['rdi']))
+    self.assertFalse(oracle.is_sufficient())
+
+  def test_from_goals(self):
+    oracle = sufficiency.SufficiencyOracle.from_goals([go.FunctionGoal("puts", 0x400500, ["hello", 2])], self.arch)
+    self.assertEqual(oracle.registers, set(self.r('rdi', 'rsi')))
+    self.assertTrue(oracle.needs_write_memory)
+    self.assertTrue(oracle.needs_jump)
+    self.assertFalse(oracle.needs_got_call)
+
+    # Without a file handler to find mprotect, the shellcode goal has to go through the GOT
+    oracle = sufficiency.SufficiencyOracle.from_goals([go.ShellcodeAddressGoal(0x601000)], self.arch)
+    self.assertTrue(oracle.needs_got_call)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,55 @@
+import unittest, tempfile, os
+
+import rop_compiler.symbol_index as symbol_index
+
+class FakeParser(object):
+  """A parser that can't enumerate its symbols, and counts how often it's asked about one"""
+  def __init__(self, symbols):
+    self.symbols = symbols
+    self.queries = 0
+
+  def iter_symbols(self):
+    return None
+
+  def get_symbol_address(self, name):
+    self.queries += 1
+    return self.symbols.get(name)
+
+class SymbolIndexTests(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.filename = tempfile.mkstemp()
+    os.write(fd, "\x7fELF version 1")
+    os.close(fd)
+
+  def tearDown(self):
+    os.unlink(self.filename)
+
+  def test_lazy_queries(self):
+    parser = FakeParser({"system" : 0x1100})
+    index = symbol_index.SymbolIndex()
+    index.add_object(self.filename, parser, 0x1000)
+    self.assertEqual(index.get_symbol_address("system"), 0x1100)
+    self.assertEqual(index.get_symbol_address("system"), 0x1100)
+    self.assertEqual(index.get_symbol_address("missing"), None)
+    self.assertEqual(parser.queries, 2)
+
+  def test_saved_index(self):
+    index = symbol_index.SymbolIndex()
+    index.add_object(self.filename, FakeParser({"system" : 0x1100}), 0x1000)
+    index.get_symbol_address("system")
+    data = index.to_string()
+
+    # The same file is answered from the saved index, without parsing it
+    index = symbol_index.from_string(data)
+    index.add_lazy_object(self.filename, lambda: self.fail("The file shouldn't be parsed"), 0x2000)
+    self.assertEqual(index.get_symbol_address("system"), 0x2100)
+
+    # Once the file changes, the saved offsets are ignored
+    open(self.filename, "ab").write("2")
+    index = symbol_index.from_string(data)
+    index.add_lazy_object(self.filename, lambda: FakeParser({"system" : 0x2200}), 0x2000)
+    self.assertEqual(index.get_symbol_address("system"), 0x2200)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,29 @@
+import unittest, struct
+import archinfo
+
+from rop_compiler.template import *
+
+class TemplateTests(unittest.TestCase):
+
+  def test_amd64(self):
+    arch = archinfo.ArchAMD64()
+    bases, probe_bases = [0x400000, 0x7f0000000000], [0x1400000, 0x7f0002000000]
+    def make_chain(bases): # A gadget in the executable, a constant, an address in the library, and some padding
+      return struct.pack("<QQQ", bases[0] + 0x1234, 0x41414141, bases[1] + 0x5678) + "JJJJ"
+
+    template = ChainTemplate.from_probes(arch, make_chain(bases), bases, make_chain(probe_bases), probe_bases)
+    self.assertEqual(template.num_relocations(), 2)
+    self.assertEqual(template.instantiate(), make_chain(bases))
+    self.assertEqual(template.instantiate([0x400000, 0x7f1234567000]), make_chain([0x400000, 0x7f1234567000]))
+    self.assertEqual(template.instantiate([None, 0x7f1234567000]), make_chain([0x400000, 0x7f1234567000]))
+    self.assertEqual(from_string(template.to_string()).instantiate(), make_chain(bases))
+
+    # The moved words are checked for bad bytes
+    self.assertEqual(template.instantiate([0x400000, 0x7f12340a0000], ["\x0a"]), None)
+
+    # A word that changed by something other than a file's change in base can't be relocated
+    self.assertRaises(RuntimeError, ChainTemplate.from_probes, arch, make_chain(bases), bases,
+      make_chain(probe_bases)[:8] + "\x00" * 8 + make_chain(probe_bases)[16:], probe_bases)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -2,6 +2,7 @@ import unittest, logging
 import archinfo
 
 from rop_compiler.utils import *
+import rop_compiler.stats as stats
 
 class UtilTests(unittest.TestCase):
 
@@ -10,5 +11,40 @@ class UtilTests(unittest.TestCase):
     self.assertTrue(address_contains_bad_byte(0x401234, "\x00", arch))
     self.assertFalse(address_contains_bad_byte(0x7fffffff12345678, "\x00", arch))
 
+  def test_bad_byte_filter(self):
+    arch = archinfo.ArchAMD64()
+    bad_byte_filter = get_bad_byte_filter(["\x0a", "\x20"], arch)
+    self.assertTrue(bad_byte_filter.contains_bad_byte(0x40200a))
+    self.assertTrue(bad_byte_filter.contains_bad_byte(0x400a01))
+    self.assertFalse(bad_byte_filter.contains_bad_byte(0x401234))
+    self.assertTrue(bad_byte_filter.contains_bad_byte(-0xf6))  # Packed as 0xffffffffffffff0a
+    self.assertFalse(bad_byte_filter.contains_bad_byte(-0xa1)) # Packed as 0xffffffffffffff5f
+    self.assertEqual(bad_byte_filter.next_candidate(0x400a10), 0x400b00)
+    self.assertEqual(bad_byte_filter.next_candidate(0x401234), 0x401234)
+    self.assertEqual(bad_byte_filter.find_bad_addresses([0x40200a, 0x401234]), [True, False])
+
+    # Bad patterns longer than a byte are checked against the packed address
+    self.assertTrue(address_contains_bad_byte(0x400a0b, ["\x0b\x0a"], arch))
+    self.assertFalse(address_contains_bad_byte(0x400a0b, ["\x0a\x0b"], arch))
+    self.assertTrue(address_contains_bad_byte(ap(0x400a0b, arch), ["\x0b\x0a"], arch))
+
+  def test_stats_collection(self):
+    stats.reset()
+    stats.enable()
+    stats.increment("outer")
+    state = stats.start_collection()
+    stats.increment("inner", 2)
+    self.assertEqual(stats.finish_collection(state)["counters"], {"inner" : 2})
+    self.assertTrue(stats.enabled) # The caller's collection carries on, and includes the inner call
+    self.assertEqual(stats.get_stats()["counters"], {"outer" : 1, "inner" : 2})
+
+    stats.disable()
+    state = stats.start_collection()
+    stats.increment("inner")
+    stats.finish_collection(state)
+    self.assertFalse(stats.enabled)
+    self.assertEqual(stats.get_stats()["counters"], {"outer" : 1, "inner" : 2})
+    stats.reset()
+
 if __name__ == '__main__':
   unittest.main()
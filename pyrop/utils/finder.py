@@ -1,6 +1,9 @@
 import archinfo
-import logging, collections
+import logging, collections, sys, os
 import rop_compiler.factories as factories
+import rop_compiler.gadget as ga
+import rop_compiler.stats as stats
+import rop_compiler.scan_cache as sc
 
 import argparse
 
@@ -11,6 +14,9 @@ parser.add_argument('-big_endian', required=False, action='store_true', help="Wh
 parser.add_argument('-finder_type', type=str, default="mem", help='The type of gadget finder (memory, file)')
 parser.add_argument('-o', type=str, default=None, help='File to write the gadgets to')
 parser.add_argument('-parser_type', type=str, default="cle", help='The type of file parser (cle, pyelf, radare)')
+parser.add_argument('-scan_cache', type=str, default=None, help='A file to reuse the gadgets of unchanged pages from (if it'
+  + ' exists), and to save the pages of this scan to (memory finder only)')
+parser.add_argument('-stats', required=False, action='store_true', help='Print counters and timings for the scan to stderr')
 parser.add_argument('-v', required=False, action='store_true', help='Verbose mode')
 parser.add_argument('-validate', required=False, action='store_true', help='Validate gadgets with z3')
 args = parser.parse_args()
@@ -19,13 +25,32 @@ finder_type = factories.get_finder_from_name(args.finder_type)
 logging_level = logging.DEBUG if args.v else logging.WARNING
 arch = archinfo.arch_from_id(args.arch, 'Iend_BE' if args.big_endian else 'Iend_LE')
 finder = finder_type(args.filename, arch, 0, logging_level, args.parser_type)
-gadget_list = finder.find_gadgets(args.validate)
+if args.stats:
+  stats.enable()
+
+if args.scan_cache != None:
+  scan_cache = sc.ScanCache(logging_level)
+  if os.path.exists(args.scan_cache):
+    scan_cache.load(open(args.scan_cache, "rb").read())
+  batches = [list(finder.find_gadgets(args.validate, scan_cache = scan_cache).foreach())]
+else: # Stream the gadgets out as they're found, rather than holding them all in memory until the scan finishes
+  batches = finder.iter_gadget_batches(args.validate)
 
 if args.o == None:
-  for gadget in gadget_list.foreach():
-    print gadget
+  for batch in batches:
+    for gadget in batch:
+      print gadget
 else:
-  fd = open(args.o, "w")
-  fd.write(gadget_list.to_string())
+  fd = open(args.o, "wb")
+  for batch in batches:
+    ga.write_gadgets(fd, batch)
+  fd.close()
+
+if args.scan_cache != None:
+  fd = open(args.scan_cache, "wb")
+  fd.write(scan_cache.to_string())
   fd.close()
 
+if args.stats:
+  sys.stderr.write(stats.format_stats() + "\n")
+